@@ -0,0 +1,118 @@
+"""
+KimiTableToJSON 输出格式对比：JSON 模板输出 vs 紧凑的表头 + 制表符分隔数据行（output_format="tsv"）
+JSON 输出在每一行重复所有字段名，输出 token 随 "字段名长度 x 行数" 增长；紧凑输出只在表头出现一次字段名
+
+离线模式按 table_template 中的模板构造不同行数的两种输出，比较预估的输出 token 数
+（安装了 tiktoken 时同时给出 cl100k_base 的计数，仅作参考）；
+--live 模式对真实图片分别用两种格式提取，比较接口返回的 completion_tokens 和耗时
+
+用法:
+    python examples/benchmark_kimi_compact_output.py
+    python examples/benchmark_kimi_compact_output.py --live --image table_template/style2.png --template table_template/style2.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_json_template import compact_layout, expand_compact_rows
+from tuxs.utils.kimi_token_estimator import KimiTokenEstimator
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    encoding = None
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_rows(template: dict, count: int) -> list:
+    """按模板的行循环生成指定行数的数据"""
+    rows = template["data"]
+    return [dict(rows[i % len(rows)]) for i in range(count)]
+
+
+def json_output(rows: list) -> str:
+    """JSON 模板输出（默认提示词下模型通常输出带缩进的 JSON 代码块）"""
+    return "```json\n" + json.dumps({"data": rows}, ensure_ascii=False, indent=2) + "\n```"
+
+
+def compact_output(rows: list) -> str:
+    """紧凑输出：表头 + 制表符分隔的数据行"""
+    columns = list(rows[0].keys())
+    return "\n".join(["\t".join(columns)] + ["\t".join(str(row[column]) for column in columns) for row in rows])
+
+
+def count(text: str, estimator: KimiTokenEstimator) -> str:
+    """预估 token 数（以及 tiktoken 计数）"""
+    result = f"{estimator.estimate_text(text):6d}"
+    if encoding is not None:
+        result += f" / {len(encoding.encode(text)):6d}"
+    return result
+
+
+def offline():
+    estimator = KimiTokenEstimator()
+    print("=" * 80)
+    print("输出 token 对比（预估" + (" / tiktoken" if encoding is not None else "") + "）")
+    print("=" * 80)
+    for name in ("style1.json", "style2.json"):
+        with open(os.path.join(PROJECT_ROOT, "table_template", name), "r", encoding="utf-8") as f:
+            template = json.load(f)
+        assert compact_layout(template) is not None
+        for rows_count in (10, 50, 200):
+            rows = make_rows(template, rows_count)
+            compact = compact_output(rows)
+            # 展开结果与 JSON 输出一致
+            assert expand_compact_rows(compact, template) == {"data": rows}
+            json_tokens = estimator.estimate_text(json_output(rows))
+            compact_tokens = estimator.estimate_text(compact)
+            print(
+                f"{name:<12} {rows_count:4d} 行   JSON {count(json_output(rows), estimator)}   "
+                f"TSV {count(compact, estimator)}   减少 {1 - compact_tokens / json_tokens:.0%}"
+            )
+
+
+def live(args):
+    from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+    
+    with open(args.template, "r", encoding="utf-8") as f:
+        template = json.load(f)
+    print("=" * 80)
+    print(f"真实接口对比: {args.image}")
+    print("=" * 80)
+    results = {}
+    for output_format in ("json", "tsv"):
+        extractor = KimiTableToJSON(output_format=output_format)
+        start = time.perf_counter()
+        result = extractor.extract_table_data(args.image, template, max_tokens=args.max_tokens)
+        elapsed = time.perf_counter() - start
+        results[output_format] = result
+        rows = len((result["json_data"] or {}).get("data", []))
+        print(
+            f"{output_format:<5} completion_tokens {result['usage'].get('completion_tokens', 0):6d}   "
+            f"耗时 {elapsed:6.2f}s   行数 {rows}   追问 {result['repairs']}"
+        )
+    print("结果一致:", results["json"]["json_data"] == results["tsv"]["json_data"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KimiTableToJSON 输出格式对比")
+    parser.add_argument("--live", action="store_true", help="使用真实接口（读取 KIMI_API_KEY）")
+    parser.add_argument("--image", default=os.path.join(PROJECT_ROOT, "table_template", "style2.png"), help="表格图片")
+    parser.add_argument("--template", default=os.path.join(PROJECT_ROOT, "table_template", "style2.json"), help="JSON 模板")
+    parser.add_argument("--max-tokens", type=int, default=4000, help="最大生成 token 数")
+    args = parser.parse_args()
+    
+    offline()
+    if args.live:
+        live(args)
+
+
+if __name__ == "__main__":
+    main()
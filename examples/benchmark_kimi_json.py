@@ -0,0 +1,115 @@
+"""
+Kimi JSON 编解码微基准测试
+对比标准库 json 与 orjson 在真实大小负载上的序列化 / 解析耗时:
+    - 请求体：内联 4MB 图片 base64 的 chat/completions 请求
+    - 响应体：200 行 / 2000 行表格提取结果（含 JSON 代码块的 chat.completion 响应）
+    - save_json：带缩进写出提取结果
+
+用法:
+    pip install orjson
+    python examples/benchmark_kimi_json.py
+"""
+import os
+import sys
+import json
+import base64
+import timeit
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_table(rows: int) -> dict:
+    """构造提取结果"""
+    return {
+        "title": "商品规格表",
+        "data": [
+            {"序号": i, "名称": f"商品{i}", "规格": "100ml x 24瓶", "单价": 12.5 + i, "备注": "含税价格，不含运费"}
+            for i in range(rows)
+        ]
+    }
+
+
+def make_response(rows: int) -> bytes:
+    """构造 chat.completion 响应体"""
+    content = "```json\n" + json.dumps(make_table(rows), ensure_ascii=False, indent=2) + "\n```"
+    return json.dumps({
+        "id": "chatcmpl-bench",
+        "model": "moonshot-v1-32k-vision-preview",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 3000, "completion_tokens": 8000, "total_tokens": 11000}
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def make_request(image_bytes: int) -> dict:
+    """构造内联图片的请求体"""
+    image = base64.b64encode(os.urandom(image_bytes)).decode("ascii")
+    return {
+        "model": "moonshot-v1-8k-vision-preview",
+        "messages": [
+            {"role": "system", "content": "你是一个专业的表格数据提取助手。" * 20},
+            {"role": "user", "content": [
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}},
+                {"type": "text", "text": "请按照模板提取表格数据。" * 50}
+            ]}
+        ],
+        "temperature": 0.1,
+        "max_tokens": 4000
+    }
+
+
+def bench(label: str, stdlib_func, orjson_func, number: int):
+    """分别计时并输出单次耗时（毫秒）"""
+    stdlib_ms = min(timeit.repeat(stdlib_func, number=number, repeat=3)) / number * 1000
+    line = f"{label:<32} json {stdlib_ms:8.3f} ms"
+    if orjson_func is not None:
+        orjson_ms = min(timeit.repeat(orjson_func, number=number, repeat=3)) / number * 1000
+        line += f"   orjson {orjson_ms:8.3f} ms   x{stdlib_ms / orjson_ms:.1f}"
+    print(line)
+
+
+def main():
+    print("=" * 80)
+    print("Kimi JSON 编解码微基准测试" + ("" if orjson is not None else "（未安装 orjson，只测试标准库）"))
+    print("=" * 80)
+    
+    request = make_request(3 * 1024 * 1024)  # base64 后约 4MB
+    bench(
+        "请求体序列化（4MB base64）",
+        lambda: json.dumps(request).encode("utf-8"),  # requests 的 json= 参数
+        (lambda: orjson.dumps(request)) if orjson else None,
+        number=10
+    )
+    
+    for rows in (200, 2000):
+        raw = make_response(rows)
+        bench(
+            f"响应解析（{rows} 行，{len(raw) / 1024:.0f}KB）",
+            lambda: json.loads(raw),
+            (lambda: orjson.loads(raw)) if orjson else None,
+            number=50
+        )
+        content = json.loads(raw)["choices"][0]["message"]["content"]
+        body = content[len("```json\n"):-len("\n```")]
+        bench(
+            f"_extract_json（{rows} 行）",
+            lambda: json.loads(body),
+            (lambda: orjson.loads(body)) if orjson else None,
+            number=50
+        )
+        table = make_table(rows)
+        bench(
+            f"save_json 缩进输出（{rows} 行）",
+            lambda: json.dumps(table, ensure_ascii=False, indent=2).encode("utf-8"),
+            (lambda: orjson.dumps(table, option=orjson.OPT_INDENT_2)) if orjson else None,
+            number=50
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+表格提取流程的离线压测
+在本地启动模拟的 Moonshot 服务（延迟分布 + 429 / 5xx 注入），并发执行 KimiTableToJSON 提取，
+输出吞吐、耗时分位数以及客户端的重试 / 限流指标，不消耗 API 额度
+
+用法:
+    python examples/benchmark_kimi_mock.py --requests 64 --concurrency 16 --latency lognormal:-1.0,0.5 --error-rate 0.05
+"""
+import io
+import os
+import sys
+import time
+import base64
+import asyncio
+import argparse
+import statistics
+
+from PIL import Image, ImageDraw
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer
+from tuxs.utils.kimi_request_policy import KimiRequestPolicy
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+def make_table_image(index: int) -> str:
+    """生成一张内容各不相同的表格图片（base64），避免被 single-flight 合并"""
+    image = Image.new("RGB", (640, 240), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for row in range(4):
+        draw.line([(0, row * 60), (640, row * 60)], fill=(0, 0, 0))
+        draw.text((10, row * 60 + 20), f"row {row} / request {index}", fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+async def run(extractor: KimiTableToJSON, images: list, stream: bool) -> list:
+    """并发提取所有图片，返回每次提取的 (耗时秒数, 是否成功)"""
+    
+    async def one(image_base64: str):
+        start = time.perf_counter()
+        try:
+            result = await extractor.aextract_table_data_from_base64(
+                image_base64, TEMPLATE, max_tokens=1000, stream=stream
+            )
+            ok = result["json_data"] is not None
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+    
+    return await asyncio.gather(*(one(image) for image in images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="表格提取流程的离线压测")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", default="lognormal:-1.0,0.5", help="模拟服务的延迟分布，见 parse_latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--stream", action="store_true", help="使用流式响应")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    images = [make_table_image(index) for index in range(args.requests)]
+    metrics = KimiMetrics()
+    
+    with KimiMockServer(
+        latency=args.latency,
+        stream_chunk_delay=0.002,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=0.2,
+        error_rate=args.error_rate,
+        seed=args.seed
+    ) as server:
+        client = KimiClient(
+            api_key="benchmark",
+            base_url=server.base_url,
+            max_concurrency=args.concurrency,
+            policy=KimiRequestPolicy(backoff_base=0.05, backoff_max=0.5, max_retries=5),
+            metrics=metrics
+        )
+        extractor = KimiTableToJSON(client=client)
+        
+        start = time.perf_counter()
+        results = asyncio.run(run(extractor, images, args.stream))
+        elapsed = time.perf_counter() - start
+        server_stats = server.stats()
+    
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    succeeded = sum(1 for _, ok in results if ok)
+    print("=" * 60)
+    print(f"离线压测: {args.requests} 次提取，并发 {args.concurrency}，延迟 {args.latency}，"
+          f"429 概率 {args.rate_limit_rate}，5xx 概率 {args.error_rate}，流式 {args.stream}")
+    print("=" * 60)
+    print(f"成功 {succeeded}/{args.requests}，总耗时 {elapsed:.2f} s，吞吐 {args.requests / elapsed:.1f} 次/s")
+    print(f"单次耗时: 平均 {statistics.mean(latencies):.1f} ms, p50 {statistics.median(latencies):.1f} ms, "
+          f"p95 {latencies[max(0, int(len(latencies) * 0.95) - 1)]:.1f} ms")
+    print(f"模拟服务: {server_stats}")
+    print(f"客户端指标: {metrics.snapshot()}")
+    histograms = metrics.histograms()
+    for name in ("queue_wait_seconds", "connect_seconds", "ttfb_seconds", "total_seconds"):
+        for model, data in histograms.get(name, {}).items():
+            print(f"{name}[{model}]: {data['count']} 次，平均 {data['mean'] * 1000:.1f} ms，p95 <= {data['p95']} s")
+
+
+if __name__ == "__main__":
+    main()
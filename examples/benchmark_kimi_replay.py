@@ -0,0 +1,142 @@
+"""
+基于录制 / 回放的提取流程性能回归测试
+先把一次真实（或模拟服务）的提取流量录制到 cassette，之后去掉网络延迟重复回放，
+分别统计 KimiTableToJSON 提取、TableRenderer 填充和 HTMLScreenshotter 截图的本地耗时
+
+用法:
+    # 录制（默认对本地模拟服务录制；--live 使用 KIMI_API_KEY 访问真实接口）
+    python examples/benchmark_kimi_replay.py --record --cassette kimi.cassette.jsonl.gz [--live]
+    # 回放（--latency recorded 还原录制的延迟，默认 none）
+    python examples/benchmark_kimi_replay.py --cassette kimi.cassette.jsonl.gz --repeat 20 [--screenshot]
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import statistics
+
+from PIL import Image, ImageDraw
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_cassette import KimiCassetteTransport
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+from tuxs.utils.table_renderer import TableRenderer
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+HTML_TEMPLATE = """<html><body><table>
+<thead><tr><th>姓名</th><th>年龄</th><th>部门</th></tr></thead>
+<tbody><tr><td>{{name}}</td><td>{{age}}</td><td>{{department}}</td></tr></tbody>
+</table></body></html>"""
+
+
+def make_table_image() -> str:
+    """生成固定内容的表格图片（base64），录制和回放时请求体相同"""
+    image = Image.new("RGB", (640, 240), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for row in range(4):
+        draw.line([(0, row * 60), (640, row * 60)], fill=(0, 0, 0))
+        draw.text((10, row * 60 + 20), f"row {row}", fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def make_extractor(transport: KimiCassetteTransport, api_key: str, base_url: str) -> KimiTableToJSON:
+    """创建使用录制 / 回放传输层的提取器（关闭响应缓存和请求合并，每次都经过传输层）"""
+    client = KimiClient(api_key=api_key, base_url=base_url, transport=transport, metrics=KimiMetrics(), single_flight=None)
+    return KimiTableToJSON(client=client)
+
+
+def record(args, image_base64: str):
+    """录制一次普通提取和一次流式提取"""
+    if args.live:
+        transport = KimiCassetteTransport(args.cassette, mode="record")
+        extractor = make_extractor(transport, os.getenv("KIMI_API_KEY"), os.getenv("KIMI_BASE_URL"))
+        for stream in (False, True):
+            extractor.extract_table_data_from_base64(image_base64, TEMPLATE, stream=stream)
+    else:
+        with KimiMockServer(latency="lognormal:-1.0,0.3", stream_chunk_delay=0.005, seed=1) as server:
+            transport = KimiCassetteTransport(args.cassette, mode="record")
+            extractor = make_extractor(transport, "replay", server.base_url)
+            for stream in (False, True):
+                extractor.extract_table_data_from_base64(image_base64, TEMPLATE, stream=stream)
+    print(f"已录制 {transport.stats()['recorded']} 次请求到 {args.cassette}")
+
+
+def summarize(label: str, samples: list):
+    """输出耗时分位数（毫秒）"""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<28} p50 {statistics.median(ordered) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+
+
+def replay(args, image_base64: str):
+    """重复回放并分阶段计时"""
+    screenshotter = None
+    if args.screenshot:
+        from tuxs.utils.html_screenshotter import HTMLScreenshotter
+        screenshotter = HTMLScreenshotter()
+    renderer = TableRenderer()
+    timings = {"提取（普通）": [], "提取（流式）": [], "填充 HTML": [], "截图": []}
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for _ in range(args.repeat):
+            # 每轮使用新的传输层，从 cassette 开头回放
+            transport = KimiCassetteTransport(args.cassette, latency=args.latency)
+            extractor = make_extractor(transport, "replay", "http://replay.invalid/v1")
+            for stream, label in ((False, "提取（普通）"), (True, "提取（流式）")):
+                start = time.perf_counter()
+                result = extractor.extract_table_data_from_base64(image_base64, TEMPLATE, stream=stream)
+                timings[label].append(time.perf_counter() - start)
+            
+            # 与 ComfyUI 工作流相同：提取节点输出 JSON 字符串，渲染节点解析后填充
+            json_string = json.dumps(result["json_data"], ensure_ascii=False)
+            start = time.perf_counter()
+            html = renderer.render_table_from_strings(HTML_TEMPLATE, json_string)
+            timings["填充 HTML"].append(time.perf_counter() - start)
+            
+            if screenshotter is not None:
+                start = time.perf_counter()
+                screenshotter.capture_from_string(html, os.path.join(temp_dir, "table.png"), 640, 240)
+                timings["截图"].append(time.perf_counter() - start)
+    
+    if screenshotter is not None:
+        screenshotter.close()
+    print("=" * 80)
+    print(f"回放 {args.repeat} 轮，延迟: {args.latency}")
+    print("=" * 80)
+    for label, samples in timings.items():
+        if samples:
+            summarize(label, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于录制 / 回放的提取流程性能回归测试")
+    parser.add_argument("--cassette", default="kimi.cassette.jsonl.gz", help="cassette 文件路径")
+    parser.add_argument("--record", action="store_true", help="录制（覆盖已有文件）")
+    parser.add_argument("--live", action="store_true", help="录制时访问真实接口（读取 KIMI_API_KEY）")
+    parser.add_argument("--repeat", type=int, default=10, help="回放轮数")
+    parser.add_argument("--latency", default="none", help="回放延迟: none / recorded / 倍数")
+    parser.add_argument("--screenshot", action="store_true", help="同时统计 HTMLScreenshotter 截图耗时（需要 Chrome）")
+    args = parser.parse_args()
+    
+    image_base64 = make_table_image()
+    if args.record:
+        record(args, image_base64)
+    else:
+        replay(args, image_base64)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+KimiClient 连接复用基准测试
+在本地启动一个模拟的 /v1/chat/completions 接口，对比共享连接池与每次新建连接的单次请求耗时
+"""
+import os
+import sys
+import time
+import statistics
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_mock_server import KimiMockServer
+
+
+def run_benchmark(client: KimiClient, rounds: int) -> list:
+    """
+    连续调用 rounds 次并记录每次请求的耗时（毫秒）
+    """
+    # 预热一次，排除首次建连的影响
+    client.chat_text_only("ping", max_tokens=1)
+
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        client.chat_text_only("ping", max_tokens=1)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main(rounds: int = 200):
+    server = KimiMockServer(responder=lambda payload: "ok").start()
+    base_url = server.base_url
+
+    try:
+        results = {}
+        for reuse in (False, True):
+            client = KimiClient(api_key="benchmark", reuse_connections=reuse)
+            client.base_url = base_url
+            results[reuse] = run_benchmark(client, rounds)
+
+        print("=" * 60)
+        print(f"KimiClient 连接复用基准测试（{rounds} 次请求）")
+        print("=" * 60)
+        for reuse, latencies in results.items():
+            label = "共享连接池" if reuse else "每次新建连接"
+            print(f"{label}: 平均 {statistics.mean(latencies):.3f} ms, "
+                  f"p50 {statistics.median(latencies):.3f} ms, "
+                  f"p95 {sorted(latencies)[int(len(latencies) * 0.95) - 1]:.3f} ms")
+
+        saved = statistics.mean(results[False]) - statistics.mean(results[True])
+        print(f"每次请求平均节省: {saved:.3f} ms")
+        print("注意: 本地回环且无 TLS，真实 HTTPS 环境下节省的握手耗时会显著更多")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
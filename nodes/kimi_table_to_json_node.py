@@ -54,11 +54,24 @@ class KimiTableToJSONNode(io.ComfyNode):
                 ),
                 io.Int.Input(
                     "max_tokens",
-                    default=4000,
-                    min=100,
+                    default=0,
+                    min=0,
                     max=10000,
                     lazy=True,
-                )
+                    tooltip="最大生成 token 数，0 表示根据模板和图片中的表格行数自动估算",
+                ),
+                io.Boolean.Input(
+                    "stream",
+                    default=False,
+                    lazy=True,
+                    tooltip="流式接收结果，JSON 闭合后立即结束并在控制台显示进度",
+                ),
+                io.Boolean.Input(
+                    "compact_output",
+                    default=False,
+                    lazy=True,
+                    tooltip="模型只输出表头和制表符分隔的数据行，在本地展开为模板 JSON，行数多时输出 token 和耗时明显减少",
+                ),
             ],
             outputs=[
                 io.String.Output(display_name="JSON Data"),  # JSON 数据字符串
@@ -68,16 +81,16 @@ class KimiTableToJSONNode(io.ComfyNode):
         )
 
     @classmethod
-    def check_lazy_status(cls, image_base64, json_template, api_key, temperature, max_tokens):
+    def check_lazy_status(cls, image_base64, json_template, api_key, temperature, max_tokens, stream=False, compact_output=False):
         """
         控制惰性输入的评估时机
         
         总是需要评估所有输入参数
         """
-        return ["image_base64", "json_template", "api_key", "temperature", "max_tokens"]
+        return ["image_base64", "json_template", "api_key", "temperature", "max_tokens", "stream", "compact_output"]
 
     @classmethod
-    def execute(cls, image_base64, json_template, api_key, temperature, max_tokens) -> io.NodeOutput:
+    async def execute(cls, image_base64, json_template, api_key, temperature, max_tokens, stream=False, compact_output=False) -> io.NodeOutput:
         """
         执行节点逻辑
         
@@ -92,7 +105,11 @@ class KimiTableToJSONNode(io.ComfyNode):
         temperature: float
             温度参数，控制输出随机性 (0-1)
         max_tokens: int
-            最大生成 token 数
+            最大生成 token 数，0 表示自动估算
+        stream: bool
+            是否流式接收结果
+        compact_output: bool
+            是否使用紧凑输出（表头 + 制表符分隔的数据行）
             
         Returns:
         --------
@@ -121,8 +138,8 @@ class KimiTableToJSONNode(io.ComfyNode):
                 else:
                     raise ValueError("未提供 API 密钥，且环境变量 KIMI_API_KEY 未设置")
             
-            # 初始化 Kimi 客户端
-            extractor = KimiTableToJSON(api_key=kimi_api_key)
+            # 初始化 Kimi 客户端（同一 API 密钥的执行共享进程级 KimiClient 和连接池）
+            extractor = KimiTableToJSON(api_key=kimi_api_key, output_format="tsv" if compact_output else None)
             
             # 解析 JSON 模板
             try:
@@ -130,12 +147,14 @@ class KimiTableToJSONNode(io.ComfyNode):
             except json.JSONDecodeError as e:
                 raise ValueError(f"JSON 模板格式错误: {str(e)}")
             
-            # 直接使用 base64 方法，无需创建临时文件
-            result = extractor.extract_table_data_from_base64(
+            # 直接使用 base64 方法，无需创建临时文件；异步调用不阻塞 ComfyUI 事件循环
+            result = await extractor.aextract_table_data_from_base64(
                 image_base64=image_base64,
                 json_template=template_obj,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens or None,
+                stream=stream,
+                on_progress=cls._print_progress if stream else None
             )
             
             # 提取结果
@@ -163,10 +182,17 @@ class KimiTableToJSONNode(io.ComfyNode):
             print(f"[KimiTableToJSONNode] {error_msg}")
             return io.NodeOutput("", error_msg, "{}")
 
+    @staticmethod
+    def _print_progress(delta, content):
+        """流式模式下每接收约 500 个字符输出一次进度"""
+        if len(content) // 500 != (len(content) - len(delta)) // 500:
+            print(f"[KimiTableToJSONNode] 已接收 {len(content)} 个字符")
+
     @classmethod
-    def fingerprint_inputs(cls, image_base64, json_template, api_key, temperature, max_tokens):
-        # 将 image_base64 和 json_template 组合后计算 hash
-        combined = f"{image_base64}{json_template}"
+    def fingerprint_inputs(cls, image_base64, json_template, api_key, temperature, max_tokens, stream=False, compact_output=False):
+        # 将 image_base64、json_template 和影响输出的参数组合后计算 hash
+        # （api_key 不影响输出，不参与计算）
+        combined = f"{image_base64}{json_template}|{temperature}|{max_tokens}|{stream}|{compact_output}"
         return hashlib.sha256(combined.encode('utf-8')).hexdigest()
 
 # 节点映射配置
@@ -0,0 +1,129 @@
+"""
+KimiClient 异步接口（achat / aanalyze_image* / aextract_* / atable_image_to_html）的单元测试（使用本地模拟服务）
+"""
+import io
+import os
+import sys
+import time
+import base64
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON, CANNED_TABLE_HTML
+from tuxs.utils.kimi_table_to_html import KimiTableToHTML
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+class InFlightResponder:
+    """回显提示词，并统计同时处理中的请求数"""
+    
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    def __call__(self, payload):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        content = payload["messages"][-1]["content"]
+        return content if isinstance(content, str) else content[-1]["text"]
+
+
+class TestKimiAsync(unittest.TestCase):
+    """异步接口测试"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 32), "white").save(buffer, format="PNG")
+        self.image_bytes = buffer.getvalue()
+        self.image_path = os.path.join(self.temp_dir, "table.png")
+        with open(self.image_path, "wb") as f:
+            f.write(self.image_bytes)
+        self.image_base64 = base64.b64encode(self.image_bytes).decode("ascii")
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_client(self, server, max_concurrency=4):
+        """创建指向模拟服务的客户端"""
+        return KimiClient(
+            api_key="mock",
+            base_url=server.base_url,
+            max_concurrency=max_concurrency,
+            metrics=KimiMetrics(),
+            single_flight=None
+        )
+    
+    def test_achat_respects_max_concurrency(self):
+        """并发的 achat 全部返回各自的结果，同时进行的请求数不超过 max_concurrency"""
+        responder = InFlightResponder()
+        with KimiMockServer(responder=responder) as server:
+            client = self.make_client(server, max_concurrency=3)
+            
+            async def run():
+                return await asyncio.gather(*(client.achat(f"prompt {i}") for i in range(10)))
+            
+            results = asyncio.run(run())
+        
+        self.assertEqual([result["content"] for result in results], [f"prompt {i}" for i in range(10)])
+        self.assertLessEqual(responder.max_in_flight, 3)
+        self.assertGreaterEqual(responder.max_in_flight, 2)
+    
+    def test_image_and_extraction_variants(self):
+        """aanalyze_image* 发送图片；aextract_table_data_from_base64 / atable_image_to_html 与同步版本结果一致"""
+        responder = InFlightResponder(delay=0)
+        with KimiMockServer(responder=responder) as server:
+            client = self.make_client(server)
+            
+            async def run():
+                return await asyncio.gather(
+                    client.aanalyze_image(self.image_path, "path"),
+                    client.aanalyze_image_base64(self.image_base64, "base64"),
+                    client.aanalyze_images([self.image_path, self.image_path], "paths"),
+                    client.aanalyze_images_base64([self.image_base64], "base64 list")
+                )
+            
+            results = asyncio.run(run())
+            self.assertEqual([result["content"] for result in results], ["path", "base64", "paths", "base64 list"])
+            self.assertTrue(all("vision" in result["model"] for result in results))
+        
+        with KimiMockServer() as server:
+            client = self.make_client(server)
+            extractor = KimiTableToJSON(client=client)
+            converter = KimiTableToHTML(client=client)
+            
+            async def run():
+                return await asyncio.gather(
+                    extractor.aextract_table_data_from_base64(self.image_base64, TEMPLATE),
+                    extractor.aextract_table_data(self.image_path, TEMPLATE, stream=True),
+                    converter.atable_image_to_html(self.image_path)
+                )
+            
+            from_base64, streamed, html = asyncio.run(run())
+        
+        self.assertEqual(from_base64["json_data"], CANNED_TABLE_JSON)
+        self.assertEqual(streamed["json_data"], CANNED_TABLE_JSON)
+        self.assertEqual(html["html_code"], CANNED_TABLE_HTML.strip())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+KimiTableToJSON 并发批量提取的单元测试（使用本地模拟服务）
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_batch_manifest import KimiBatchManifest
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON
+from tuxs.utils.kimi_table_to_html import KimiTableToHTML
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+class TestKimiBatchExtract(unittest.TestCase):
+    """batch_extract / iter_batch_extract 测试"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_paths = []
+        for i in range(6):
+            path = os.path.join(self.temp_dir, f"table{i}.png")
+            Image.new("RGB", (32, 32), (i * 40, 0, 0)).save(path)
+            self.image_paths.append(path)
+        self.output_dir = os.path.join(self.temp_dir, "output")
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_extractor(self, server):
+        """创建连接模拟服务的提取器"""
+        client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+        return KimiTableToJSON(client=client)
+    
+    def test_concurrent_results_in_order(self):
+        """并发提取的总耗时接近单张的耗时，结果按输入顺序返回，回调按完成顺序调用"""
+        finished = []
+        with KimiMockServer(latency=0.3) as server:
+            extractor = self.make_extractor(server)
+            start = time.monotonic()
+            results = extractor.batch_extract(
+                self.image_paths, TEMPLATE, self.output_dir, max_workers=6, on_result=finished.append
+            )
+            elapsed = time.monotonic() - start
+        
+        self.assertLess(elapsed, 0.3 * len(self.image_paths) / 2)
+        self.assertEqual([r["image_path"] for r in results], self.image_paths)
+        self.assertTrue(all(r["success"] and r["data"] == CANNED_TABLE_JSON for r in results))
+        self.assertEqual(sorted(r["index"] for r in finished), list(range(len(self.image_paths))))
+        self.assertTrue(all(os.path.exists(r["output_path"]) for r in results))
+    
+    def test_iterator_and_failures(self):
+        """迭代器按完成顺序返回；失败的图片不影响其他图片；提前停止时不再提取剩余的图片"""
+        with KimiMockServer() as server:
+            extractor = self.make_extractor(server)
+            paths = self.image_paths[:2] + [os.path.join(self.temp_dir, "missing.png")]
+            items = list(extractor.iter_batch_extract(paths, TEMPLATE, self.output_dir, max_workers=3))
+            self.assertEqual(sorted(item["index"] for item in items), [0, 1, 2])
+            failed = [item for item in items if not item["success"]]
+            self.assertEqual([item["index"] for item in failed], [2])
+            
+            requests_before = server.stats()["requests"]
+            iterator = extractor.iter_batch_extract(self.image_paths, TEMPLATE, self.output_dir, max_workers=1)
+            next(iterator)
+            iterator.close()
+            time.sleep(0.2)
+            self.assertLess(server.stats()["requests"] - requests_before, len(self.image_paths))
+    
+    def test_duplicate_names_get_unique_outputs(self):
+        """不同目录中的同名图片写入不同的输出文件"""
+        other_dir = os.path.join(self.temp_dir, "other")
+        os.makedirs(other_dir)
+        duplicate = os.path.join(other_dir, "table0.png")
+        shutil.copy(self.image_paths[0], duplicate)
+        paths = [self.image_paths[0], duplicate, self.image_paths[1]]
+        with KimiMockServer() as server:
+            results = self.make_extractor(server).batch_extract(paths, TEMPLATE, self.output_dir, max_workers=3)
+        
+        self.assertEqual(
+            [os.path.basename(r["output_path"]) for r in results],
+            ["table0_0.json", "table0_1.json", "table1.json"]
+        )
+    
+    def test_resume_from_manifest(self):
+        """重新运行时跳过已完成的图片，只重试失败的图片；图片内容或模板变化后重新提取"""
+        missing = os.path.join(self.temp_dir, "late.png")
+        paths = self.image_paths[:2] + [missing]
+        with KimiMockServer() as server:
+            extractor = self.make_extractor(server)
+            results = extractor.batch_extract(paths, TEMPLATE, self.output_dir)
+            self.assertEqual([r["success"] for r in results], [True, True, False])
+            summary = KimiBatchManifest(self.output_dir).summary()
+            self.assertEqual((summary["done"], summary["failed"]), (2, 1))
+            self.assertGreater(summary["completion_tokens"], 0)
+            
+            # 补上缺失的图片，修改第二张图片
+            Image.new("RGB", (32, 32), (0, 255, 0)).save(missing)
+            Image.new("RGB", (32, 32), (0, 0, 255)).save(self.image_paths[1])
+            requests_before = server.stats()["requests"]
+            results = extractor.batch_extract(paths, TEMPLATE, self.output_dir)
+            self.assertEqual(server.stats()["requests"] - requests_before, 2)
+            self.assertEqual([r.get("skipped", False) for r in results], [True, False, False])
+            self.assertEqual(results[0]["data"], CANNED_TABLE_JSON)
+            self.assertTrue(all(r["success"] for r in results))
+            
+            # 模板变化后全部重新提取
+            requests_before = server.stats()["requests"]
+            extractor.batch_extract(paths, dict(TEMPLATE, note=""), self.output_dir)
+            self.assertEqual(server.stats()["requests"] - requests_before, 3)
+            
+            # batch_convert 使用同样的清单
+            converter = KimiTableToHTML(client=extractor.client)
+            html_dir = os.path.join(self.temp_dir, "html")
+            converter.batch_convert(paths, html_dir)
+            requests_before = server.stats()["requests"]
+            results = converter.batch_convert(paths, html_dir)
+            self.assertEqual(server.stats()["requests"], requests_before)
+            self.assertTrue(all(r["skipped"] for r in results))
+    
+    def test_manifest_write_failure_is_not_fatal(self):
+        """清单无法写入（输出目录不存在）时只打印警告，不留下临时文件"""
+        missing_dir = os.path.join(self.temp_dir, "missing")
+        manifest = KimiBatchManifest(missing_dir)
+        manifest.record(self.image_paths[0], "digest", "params", "failed", error="boom")
+        self.assertEqual(manifest.summary()["failed"], 1)
+        self.assertFalse(os.path.exists(missing_dir))
+        
+        os.makedirs(missing_dir)
+        os.makedirs(manifest.path)  # 清单路径被目录占用，os.replace 失败
+        manifest.record(self.image_paths[0], "digest", "params", "done", self.image_paths[0])
+        self.assertEqual(os.listdir(missing_dir), [os.path.basename(manifest.path)])
+
+
+if __name__ == "__main__":
+    unittest.main()
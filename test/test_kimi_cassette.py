@@ -0,0 +1,121 @@
+"""
+KimiCassetteTransport 请求录制 / 回放的单元测试（使用本地模拟服务录制）
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_cassette import KimiCassetteTransport, CassetteMissError
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_file_cache import KimiFileCache
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+class TestKimiCassette(unittest.TestCase):
+    """KimiCassetteTransport 测试"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "kimi.cassette.jsonl.gz")
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def make_extractor(self, transport, base_url):
+        """创建使用指定传输层的提取器"""
+        client = KimiClient(
+            api_key="sk-secretsecret",
+            base_url=base_url,
+            transport=transport,
+            upload_images=True,
+            file_cache=KimiFileCache(path=":memory:"),
+            metrics=KimiMetrics(),
+            single_flight=None
+        )
+        return KimiTableToJSON(client=client)
+    
+    def run_extractions(self, extractor):
+        """普通请求和流式请求各提取一次"""
+        return [
+            extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE)["json_data"],
+            extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE, stream=True)["json_data"]
+        ]
+    
+    def test_record_and_replay(self):
+        """录制后不访问网络回放，结果一致；可以还原或去掉录制的延迟；文件中不含 API 密钥"""
+        with KimiMockServer(latency=0.2, stream_chunk_delay=0.005) as server:
+            transport = KimiCassetteTransport(self.path, mode="record")
+            results = self.run_extractions(self.make_extractor(transport, server.base_url))
+            self.assertEqual(results, [CANNED_TABLE_JSON, CANNED_TABLE_JSON])
+            self.assertEqual(server.stats()["uploads"], 1)
+            self.assertEqual(transport.stats()["recorded"], 3)
+        
+        with open(self.path, "rb") as f:
+            self.assertNotIn(b"secret", f.read())
+        
+        # 模拟服务已关闭，地址也不同：只能从 cassette 回放
+        transport = KimiCassetteTransport(self.path, latency="none")
+        extractor = self.make_extractor(transport, "http://127.0.0.1:9/v1")
+        start = time.monotonic()
+        self.assertEqual(self.run_extractions(extractor), results)
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(transport.stats()["played"], 3)
+        
+        transport = KimiCassetteTransport(self.path, latency="recorded")
+        extractor = self.make_extractor(transport, "http://127.0.0.1:9/v1")
+        start = time.monotonic()
+        self.assertEqual(self.run_extractions(extractor), results)
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+    
+    def test_unrecorded_request(self):
+        """请求内容与录制时不同时抛出 CassetteMissError"""
+        with KimiMockServer(responder=lambda payload: "pong") as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                transport=KimiCassetteTransport(self.path, mode="record"),
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            self.assertEqual(client.chat_text_only("ping")["content"], "pong")
+        
+        client = KimiClient(
+            api_key="mock",
+            transport=KimiCassetteTransport(self.path, latency=0),
+            metrics=KimiMetrics(),
+            single_flight=None
+        )
+        self.assertEqual(client.chat_text_only("ping")["content"], "pong")
+        with self.assertRaises(CassetteMissError):
+            client.chat_text_only("other")
+    
+    def test_env_recording_across_clients(self):
+        """通过环境变量录制时，之后创建的 KimiClient 追加录制，不覆盖之前的录制"""
+        env = {"KIMI_CASSETTE": self.path, "KIMI_CASSETTE_MODE": "record"}
+        with KimiMockServer(responder=lambda payload: payload["messages"][-1]["content"][0]["text"]) as server:
+            with patch.dict(os.environ, env):
+                for text in ("first", "second"):
+                    client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+                    self.assertEqual(client.chat_text_only(text)["content"], text)
+        
+        transport = KimiCassetteTransport(self.path, latency=0)
+        self.assertEqual(transport.stats()["interactions"], 2)
+        client = KimiClient(api_key="mock", transport=transport, metrics=KimiMetrics(), single_flight=None)
+        self.assertEqual(client.chat_text_only("first")["content"], "first")
+        self.assertEqual(client.chat_text_only("second")["content"], "second")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+KimiClient 共享与按请求选择模型的单元测试（不访问网络）
+"""
+import os
+import sys
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient, get_client, get_shared_session
+from tuxs.utils.kimi_transport import TimedHTTPAdapter
+
+
+class TestKimiClientSharing(unittest.TestCase):
+    """KimiClient 共享测试"""
+    
+    def fake_post(self, payload, estimated_tokens=0, stream=False, endpoint=None):
+        """返回回显模型名称的假响应"""
+        response = MagicMock()
+        response.content = json.dumps({
+            "model": payload["model"],
+            "choices": [{"message": {"content": payload["messages"][-1]["content"][-1]["text"]}}],
+            "usage": {"total_tokens": 1}
+        }).encode("utf-8")
+        return response
+    
+    def test_get_client_shared_per_api_key(self):
+        """同一 API 密钥返回同一个客户端"""
+        self.assertIs(get_client("key-a"), get_client("key-a"))
+        self.assertIsNot(get_client("key-a"), get_client("key-b"))
+    
+    def test_get_client_distinguishes_kwargs(self):
+        """构造参数不同时返回另一个客户端，相同时共用"""
+        default = get_client("key-kwargs")
+        larger = get_client("key-kwargs", max_concurrency=9)
+        self.assertIsNot(larger, default)
+        self.assertEqual(larger.max_concurrency, 9)
+        self.assertIs(get_client("key-kwargs", max_concurrency=9), larger)
+        self.assertIs(get_client("key-kwargs"), default)
+        # 不可哈希的参数按内容区分
+        self.assertIs(
+            get_client("key-kwargs", base_urls=["http://127.0.0.1:1/v1"]),
+            get_client("key-kwargs", base_urls=["http://127.0.0.1:1/v1"])
+        )
+    
+    def test_clients_share_pooled_session(self):
+        """不同客户端共用同一个会话，会话挂载按配置大小的 TimedHTTPAdapter"""
+        first = KimiClient(api_key="key-pool-a", pool_connections=3, pool_maxsize=7)
+        second = KimiClient(api_key="key-pool-b", pool_connections=3, pool_maxsize=7)
+        self.assertIs(first.session, second.session)
+        self.assertIs(first.session, get_shared_session(3, 7))
+        self.assertIs(first.transport.session, first.session)
+        
+        for url in ("https://api.moonshot.cn/v1", "http://127.0.0.1:8000/v1"):
+            adapter = first.session.get_adapter(url)
+            self.assertIsInstance(adapter, TimedHTTPAdapter)
+            self.assertEqual(adapter.poolmanager.connection_pool_kw["maxsize"], 7)
+            self.assertEqual(adapter.poolmanager.pools._maxsize, 3)
+        
+        # 连接池大小不同时使用另一个会话；关闭复用时不使用会话
+        self.assertIsNot(KimiClient(api_key="key-pool-c", pool_connections=3, pool_maxsize=8).session, first.session)
+        self.assertIsNone(KimiClient(api_key="key-pool-d", reuse_connections=False).session)
+        with patch.dict(os.environ, {"KIMI_POOL_CONNECTIONS": "3", "KIMI_POOL_MAXSIZE": "7"}):
+            self.assertIs(KimiClient(api_key="key-pool-e").session, first.session)
+    
+    def test_concurrent_requests_resolve_model_per_request(self):
+        """并发请求各自选择模型，不修改共享客户端的 model"""
+        client = KimiClient(api_key="key-test", auto_model_tier=False)
+        image = "data:image/png;base64,iVBORw0KGgo="
+        
+        def call(index):
+            if index % 2:
+                result = client.chat(f"text-{index}", image_base64_list=image)
+            else:
+                result = client.chat(f"text-{index}")
+            return index, result
+        
+        with patch.object(client, "_post_chat_completions", side_effect=self.fake_post):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(call, range(32)))
+        
+        for index, result in results:
+            self.assertEqual(result["content"], f"text-{index}")
+            expected = "moonshot-v1-8k-vision-preview" if index % 2 else "moonshot-v1-8k"
+            self.assertEqual(result["model"], expected)
+        self.assertEqual(client.model, "moonshot-v1-8k")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+静态提示词前缀与 KimiContextCache 上下文缓存的单元测试（使用本地模拟服务）
+"""
+import os
+import sys
+import json
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_context_cache import KimiContextCache
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+from tuxs.utils.kimi_transport import RequestsTransport
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+class TestKimiContextCache(unittest.TestCase):
+    """KimiContextCache 测试"""
+    
+    def test_prefix_is_byte_identical(self):
+        """同一模板无论以字典还是任意格式的字符串传入，系统提示词前缀都相同，且不含随请求变化的内容"""
+        extractor = KimiTableToJSON(client=KimiClient(api_key="mock", single_flight=None))
+        system_a, prompt_a = extractor._build_prompt(TEMPLATE)
+        system_b, prompt_b = extractor._build_prompt(json.dumps(TEMPLATE))
+        self.assertEqual(system_a, system_b)
+        self.assertEqual(prompt_a, prompt_b)
+        self.assertTrue(system_a.startswith(KimiTableToJSON.SYSTEM_PROMPT))
+        self.assertIn('"department"', system_a)
+        self.assertNotIn('"department"', prompt_a)
+        
+        system_c, prompt_c = extractor._build_prompt(TEMPLATE, custom_prompt="自定义")
+        self.assertEqual((system_c, prompt_c), (KimiTableToJSON.SYSTEM_PROMPT, "自定义"))
+    
+    def test_client_references_cached_prefix(self):
+        """开启 context_caching 后同一前缀只创建一次缓存，缓存失效时改为内联发送并在下次重新创建"""
+        bodies = []
+        
+        class RecordingTransport(RequestsTransport):
+            def post(self, url, headers, data, stream=False, timeout=None):
+                if url.endswith("/chat/completions"):
+                    bodies.append(json.loads(b"".join(data)))
+                return super().post(url, headers, data, stream=stream, timeout=timeout)
+        
+        context_cache = KimiContextCache(ttl=600)
+        with KimiMockServer() as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                transport=RecordingTransport(),
+                metrics=KimiMetrics(),
+                single_flight=None,
+                context_caching=True,
+                context_cache=context_cache
+            )
+            extractor = KimiTableToJSON(client=client)
+            for image in ("iVBORw0KGgo=", "iVBORw0KGgoA"):
+                result = extractor.extract_table_data_from_base64(image, TEMPLATE)
+                self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+            self.assertEqual(server.stats()["caches"], 1)
+            self.assertEqual([body["messages"][0]["role"] for body in bodies], ["cache", "cache"])
+            self.assertEqual(bodies[0]["messages"][0], bodies[1]["messages"][0])
+            self.assertEqual(context_cache.stats()["entries"], 1)
+            
+            server.expire_caches()
+            result = extractor.extract_table_data_from_base64("iVBORw0KGgoB", TEMPLATE)
+            self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+            self.assertEqual(bodies[-1]["messages"][0]["role"], "system")
+            self.assertEqual(context_cache.stats()["entries"], 0)
+            
+            extractor.extract_table_data_from_base64("iVBORw0KGgoC", TEMPLATE)
+            self.assertEqual(server.stats()["caches"], 2)
+            self.assertEqual(client.metrics.snapshot()["context_caches"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+KimiEndpointPool 多密钥 / 多地址负载均衡的单元测试（使用本地模拟服务）
+"""
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_endpoint_pool import KimiEndpoint, KimiEndpointPool
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer
+from tuxs.utils.kimi_rate_limiter import KimiRateLimiter
+from tuxs.utils.kimi_request_policy import KimiRequestPolicy
+from tuxs.utils.kimi_transport import RequestsTransport
+
+
+class TestKimiEndpointPool(unittest.TestCase):
+    """KimiEndpointPool 测试"""
+    
+    def make_pool(self, count=2, **kwargs):
+        """创建不限流的成员池"""
+        endpoints = [KimiEndpoint(f"key-{i}", rate_limiter=KimiRateLimiter(rpm=0, tpm=0)) for i in range(count)]
+        return KimiEndpointPool(endpoints, **kwargs)
+    
+    def test_least_loaded_and_rate_limits(self):
+        """优先选择进行中请求最少的成员；限流配额用完的成员让位给其他成员"""
+        pool = self.make_pool(3)
+        chosen = [pool.select()[0] for _ in range(3)]
+        self.assertEqual(len({id(endpoint) for endpoint in chosen}), 3)
+        pool.release(chosen[1])
+        self.assertIs(pool.select()[0], chosen[1])
+        
+        limited = KimiEndpoint("limited", rate_limiter=KimiRateLimiter(rpm=1))
+        free = KimiEndpoint("free", rate_limiter=KimiRateLimiter(rpm=0, tpm=0))
+        pool = KimiEndpointPool([limited, free])
+        limited.rate_limiter.acquire()
+        for _ in range(3):
+            endpoint, _ = pool.select()
+            self.assertIs(endpoint, free)
+    
+    def test_circuit_breaker(self):
+        """连续失败达到阈值后熔断，冷却后只放行一个探测请求，探测成功后恢复"""
+        pool = self.make_pool(2, failure_threshold=2, cooldown=0.2)
+        bad, good = pool.endpoints
+        pool.record(bad, False)
+        pool.record(bad, False)
+        for _ in range(4):
+            endpoint, probe_token = pool.select()
+            self.assertIs(endpoint, good)
+            self.assertIsNone(probe_token)
+            pool.release(endpoint, probe_token)
+        
+        time.sleep(0.25)
+        good.in_flight = 5
+        bad.in_flight = 1  # 熔断前发出、仍在进行中的请求
+        probe, probe_token = pool.select()
+        self.assertIs(probe, bad)
+        self.assertIsNotNone(probe_token)
+        self.assertIs(pool.select()[0], good)
+        # 其他请求结束不会放行第二个探测请求
+        pool.release(bad)
+        self.assertIs(pool.select()[0], good)
+        pool.record(probe, True)
+        pool.release(probe, probe_token)
+        self.assertFalse(pool.stats()[0]["circuit_open"])
+        self.assertEqual(pool.stats()[0]["circuit_opens"], 1)
+    
+    def test_client_spreads_keys_and_skips_failing_endpoint(self):
+        """多个密钥均匀分担请求；持续失败的地址熔断后请求全部发往健康的地址"""
+        keys = []
+        
+        class RecordingTransport(RequestsTransport):
+            def post(self, url, headers, data, stream=False, timeout=None):
+                keys.append(headers["Authorization"])
+                return super().post(url, headers, data, stream=stream, timeout=timeout)
+        
+        with KimiMockServer(latency=0.05) as server:
+            client = KimiClient(
+                api_keys=["pool-key-a", "pool-key-b"],
+                base_urls=[server.base_url],
+                transport=RecordingTransport(),
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda i: client.chat_text_only(f"ping {i}"), range(8)))
+            self.assertEqual(keys.count("Bearer pool-key-a"), 4)
+            self.assertEqual(keys.count("Bearer pool-key-b"), 4)
+        
+        with KimiMockServer() as good, KimiMockServer(error_rate=1.0, error_statuses=(503,)) as bad:
+            client = KimiClient(
+                api_keys=["pool-key-c"],
+                base_urls=[bad.base_url, good.base_url],
+                policy=KimiRequestPolicy(backoff_base=0.01, max_retries=1),
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            client.endpoint_pool.failure_threshold = 2
+            with self.assertRaises(requests.HTTPError):
+                client.chat_text_only("first")  # 两次尝试都发往故障地址，随后熔断
+            for i in range(4):
+                self.assertTrue(client.chat_text_only(f"after {i}")["content"])
+            self.assertEqual(bad.stats()["requests"], 2)
+            self.assertEqual(good.stats()["ok"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+KimiImagePreprocessor 上传前图片预处理的单元测试
+"""
+import io
+import os
+import sys
+import base64
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_image_preprocessor import KimiImagePreprocessor
+from tuxs.utils.kimi_metrics import KimiMetrics
+
+
+def encode(image, fmt, **kwargs):
+    """把图片编码为指定格式的字节"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def text_image(width=1200, height=800):
+    """白底黑字的表格截图：颜色少、边缘锐利"""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, height, 40):
+        draw.line([(0, y), (width, y)], fill="black")
+        for x in range(10, width - 60, 120):
+            draw.text((x, y + 12), f"R{y // 40}C{x // 120}", fill="black")
+    return image
+
+
+def photo_image(width=600, height=400, seed=0):
+    """带噪点的渐变照片：颜色连续变化"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height))
+    image.putdata([
+        (x * 255 // width, y * 255 // height, (x + y + rng.randint(0, 40)) % 256)
+        for y in range(height) for x in range(width)
+    ])
+    return image
+
+
+class TestKimiImagePreprocessor(unittest.TestCase):
+    """KimiImagePreprocessor 测试"""
+    
+    def test_resize_to_long_edge(self):
+        """长边超过上限时等比缩小，未超过时不缩放"""
+        preprocessor = KimiImagePreprocessor(max_long_edge=600, formats=("png",))
+        data, fmt, stats = preprocessor.process(encode(text_image(1200, 800), "PNG"))
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (600, 400))
+        self.assertEqual(stats["original_size"], (1200, 800))
+        self.assertEqual(stats["processed_size"], (600, 400))
+        self.assertEqual(fmt, "png")
+        
+        data, _, stats = KimiImagePreprocessor(max_long_edge=2000).process(encode(text_image(1200, 800), "PNG"))
+        self.assertEqual(stats["processed_size"], (1200, 800))
+    
+    def test_format_choice(self):
+        """文字截图选用 PNG，照片选用 JPEG"""
+        preprocessor = KimiImagePreprocessor(max_long_edge=0, formats=("png", "jpeg"))
+        _, fmt, _ = preprocessor.process(encode(text_image(), "BMP"))
+        self.assertEqual(fmt, "png")
+        
+        _, fmt, stats = preprocessor.process(encode(photo_image(), "PNG"))
+        self.assertEqual(fmt, "jpeg")
+        self.assertGreater(stats["saved_bytes"], 0)
+        self.assertGreater(stats["estimated_upload_seconds_saved"], 0)
+    
+    def test_keep_original_when_not_smaller(self):
+        """无需缩放且重新编码没有变小时原样返回原始字节"""
+        original = encode(text_image(), "PNG", optimize=True)
+        data, fmt, stats = KimiImagePreprocessor(max_long_edge=0, formats=("png", "jpeg")).process(original)
+        self.assertTrue(data is original)
+        self.assertEqual(fmt, "png")
+        self.assertEqual(stats["saved_bytes"], 0)
+    
+    def test_client_opt_out(self):
+        """KimiClient 未配置预处理器（且未设置 KIMI_IMAGE_MAX_EDGE）时图片原样发送"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            original = encode(text_image(1200, 800), "PNG")
+            path = os.path.join(temp_dir, "table.png")
+            with open(path, "wb") as f:
+                f.write(original)
+            data_url = "data:image/png;base64," + base64.b64encode(original).decode("ascii")
+            
+            env = {key: value for key, value in os.environ.items() if key != "KIMI_IMAGE_MAX_EDGE"}
+            with patch.dict(os.environ, env, clear=True):
+                client = KimiClient(api_key="mock", metrics=KimiMetrics(), single_flight=None)
+            self.assertIsNone(client.image_preprocessor)
+            self.assertEqual(client.encode_image(path), data_url)
+            self.assertEqual(client.normalize_base64_image(data_url), data_url)
+            
+            client = KimiClient(
+                api_key="mock",
+                image_preprocessor=KimiImagePreprocessor(max_long_edge=600),
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            for url in (client.encode_image(path), client.normalize_base64_image(data_url)):
+                with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+                    self.assertEqual(image.size, (600, 400))
+            snapshot = client.metrics.snapshot()
+            self.assertEqual(snapshot["images_preprocessed"], 2)
+            self.assertGreater(snapshot["image_bytes_saved"], 0)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
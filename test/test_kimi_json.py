@@ -0,0 +1,44 @@
+"""
+kimi_json 编解码的单元测试
+"""
+import os
+import sys
+import json
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils import kimi_json
+
+
+class TestKimiJSON(unittest.TestCase):
+    """kimi_json 测试"""
+    
+    def test_output_matches_stdlib(self):
+        """紧凑与缩进输出都与标准库 json（ensure_ascii=False）一致"""
+        data = {"title": "员工表", "data": [{"姓名": "张三", "年龄": 30, "比例": 0.5, "在职": True, "备注": None}]}
+        self.assertEqual(
+            kimi_json.dumps_bytes(data),
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+        self.assertEqual(
+            kimi_json.dumps(data, indent=2),
+            json.dumps(data, ensure_ascii=False, indent=2)
+        )
+        self.assertEqual(kimi_json.loads(kimi_json.dumps_bytes(data)), data)
+        self.assertEqual(kimi_json.loads(kimi_json.dumps(data)), data)
+    
+    def test_fallbacks(self):
+        """orjson 不支持的输入回退到标准库，非法 JSON 抛出 json.JSONDecodeError"""
+        value = kimi_json.loads(b'{"value": NaN}')["value"]
+        self.assertNotEqual(value, value)
+        self.assertEqual(kimi_json.dumps({1: "a"}), '{"1":"a"}')
+        self.assertEqual(kimi_json.dumps({"big": 2 ** 70}), '{"big":%d}' % 2 ** 70)
+        self.assertEqual(kimi_json.dumps({"v": object()}, default=lambda o: "x"), '{"v":"x"}')
+        with self.assertRaises(json.JSONDecodeError):
+            kimi_json.loads("{not json")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+"""
+JSON 模板校验、本地修复与按行追问的单元测试
+"""
+import os
+import sys
+import json
+import unittest
+
+import requests
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_json_template import (
+    repair_json_text, validate_against_template, parse_path, compact_layout, expand_compact_rows, KimiRowStreamParser
+)
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON, CANNED_TABLE_TSV
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+from tuxs.utils.kimi_transport import RequestsTransport
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+class TestKimiJSONTemplate(unittest.TestCase):
+    """kimi_json_template 测试"""
+    
+    def test_repair_json_text(self):
+        """多余的逗号在本地修复；截断时保留完整的行，丢弃被截断的行"""
+        self.assertEqual(repair_json_text('{"a": [1, 2,],}'), {"a": [1, 2]})
+        truncated = '{"title": "t", "data": [{"name": "a", "age": 1}, {"name": "b", "ag'
+        self.assertEqual(repair_json_text(truncated), {"title": "t", "data": [{"name": "a", "age": 1}]})
+        with self.assertRaises(json.JSONDecodeError):
+            repair_json_text("not json")
+    
+    def test_validate_against_template(self):
+        """可修复的问题在本地修复，字段名不一致或类型不符的行按整行报告"""
+        data = {
+            "title": 5,
+            "data": [
+                {"name": "张三", "age": "28", "department": None, "extra": 1},
+                {"Name": "李四", "Age": 32},
+                "王五",
+                {"name": "赵六"}
+            ]
+        }
+        repaired, failures = validate_against_template(data, TEMPLATE)
+        self.assertEqual(repaired["title"], "5")
+        self.assertEqual(repaired["data"][0], {"name": "张三", "age": 28, "department": ""})
+        self.assertEqual(repaired["data"][3], {"name": "赵六", "age": "", "department": ""})
+        self.assertEqual([failure["path"] for failure in failures], ["data[1]", "data[2]"])
+        self.assertEqual(parse_path("data[1]"), ["data", 1])
+        
+        _, failures = validate_against_template([1, 2], TEMPLATE)
+        self.assertEqual(failures[0]["path"], "")
+    
+    def test_repair_only_failing_rows(self):
+        """请求 JSON 输出格式；只追问不符合模板的行，并把修正后的行合并回结果"""
+        requests_seen = []
+        
+        def responder(payload):
+            requests_seen.append(payload)
+            messages = payload["messages"]
+            if messages[-1]["role"] == "user" and isinstance(messages[-1]["content"], str):
+                # 追问：只返回被点名的行
+                self.assertIn("data[1]", messages[-1]["content"])
+                return json.dumps({"data[1]": CANNED_TABLE_JSON["data"][1]}, ensure_ascii=False)
+            rows = [dict(row) for row in CANNED_TABLE_JSON["data"]]
+            rows[1] = {"姓名": "李四", "年龄": 32}
+            return json.dumps({"title": CANNED_TABLE_JSON["title"], "data": rows}, ensure_ascii=False)
+        
+        with KimiMockServer(responder=responder) as server:
+            client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+            extractor = KimiTableToJSON(client=client)
+            result = extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE)
+        
+        self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+        self.assertEqual(result["repairs"], 1)
+        self.assertEqual(result["validation_errors"], [])
+        self.assertEqual(len(requests_seen), 2)
+        self.assertEqual(requests_seen[0]["response_format"], {"type": "json_object"})
+        # usage 包括追问的 token
+        self.assertGreater(result["usage"]["completion_tokens"], len(result["raw_content"]))
+    
+    def test_json_mode_fallback_only_for_response_format_errors(self):
+        """只有错误信息指向 response_format 的 400 才关闭 json_mode 并重发，其他 400 原样抛出"""
+        
+        class RejectingTransport(RequestsTransport):
+            """带 response_format 的请求返回指定错误信息的 400"""
+            
+            def __init__(self, message):
+                super().__init__()
+                self.message = message
+                self.rejected = 0
+            
+            def post(self, url, headers, data, stream=False, timeout=None):
+                body = data if isinstance(data, bytes) else b"".join(data)
+                if b'"response_format"' not in body:
+                    return super().post(url, headers, body, stream=stream, timeout=timeout)
+                self.rejected += 1
+                response = requests.Response()
+                response.status_code = 400
+                response.reason = "Bad Request"
+                response.url = url
+                response._content = json.dumps({"error": {"message": self.message}}).encode("utf-8")
+                return response
+        
+        with KimiMockServer() as server:
+            for message, falls_back in (("response_format json_object is not supported", True), ("image too large", False)):
+                transport = RejectingTransport(message)
+                client = KimiClient(
+                    api_key="mock", base_url=server.base_url, transport=transport, metrics=KimiMetrics(), single_flight=None
+                )
+                extractor = KimiTableToJSON(client=client)
+                if falls_back:
+                    result = extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE)
+                    self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+                else:
+                    with self.assertRaises(requests.HTTPError):
+                        extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE)
+                self.assertEqual(transport.rejected, 1)
+                self.assertEqual(extractor.json_mode, not falls_back)
+    
+    def test_expand_compact_rows(self):
+        """紧凑输出按表头的列名展开，支持调整列顺序、Markdown 表格和省略的行末空值"""
+        self.assertEqual(compact_layout(TEMPLATE), {"rows_key": "data", "columns": ["name", "age", "department"], "fields": ["title"]})
+        self.assertIsNone(compact_layout({"a": [{"b": [1]}]}))
+        
+        text = "@title\t表格\ndepartment\tname\tage\n研发部\t张三\t28\n\t李四\n1\t2\t3\t4"
+        data = expand_compact_rows(text, TEMPLATE)
+        self.assertEqual(data["title"], "表格")
+        self.assertEqual(data["data"][0], {"department": "研发部", "name": "张三", "age": "28"})
+        self.assertEqual(data["data"][1], {"department": "", "name": "李四", "age": ""})
+        repaired, failures = validate_against_template(data, TEMPLATE)
+        self.assertEqual(repaired["data"][0], {"name": "张三", "age": 28, "department": "研发部"})
+        self.assertEqual([failure["path"] for failure in failures], ["data[2]"])
+        
+        markdown = "| name | age | department |\n|---|---|---|\n| 王五 | 25 | 财务部 |"
+        self.assertEqual(expand_compact_rows(markdown, TEMPLATE)["data"], [{"name": "王五", "age": "25", "department": "财务部"}])
+    
+    def test_compact_output_uses_fewer_tokens(self):
+        """output_format="tsv" 得到与 JSON 输出相同的结果，生成的 token 更少"""
+        with KimiMockServer() as server:
+            client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+            results = {
+                output_format: KimiTableToJSON(client=client, output_format=output_format).extract_table_data_from_base64(
+                    "iVBORw0KGgo=", TEMPLATE
+                )
+                for output_format in ("json", "tsv")
+            }
+        self.assertEqual(results["tsv"]["json_data"], CANNED_TABLE_JSON)
+        self.assertEqual(results["tsv"]["json_data"], results["json"]["json_data"])
+        self.assertEqual(results["tsv"]["output_format"], "tsv")
+        self.assertLess(results["tsv"]["usage"]["completion_tokens"], results["json"]["usage"]["completion_tokens"])
+
+    
+    def test_row_stream_parser(self):
+        """逐字符输入时每一行在右括号 / 换行到达时返回；截断时保留已完成的行"""
+        text = "```json\n" + json.dumps(CANNED_TABLE_JSON, ensure_ascii=False, indent=2) + "\n```"
+        parser = KimiRowStreamParser(TEMPLATE)
+        emitted = []
+        for position, ch in enumerate(text):
+            for index, row in parser.feed(ch):
+                emitted.append(index)
+                # 行对象刚好闭合
+                self.assertEqual(text[position], "}")
+        self.assertEqual(emitted, [0, 1, 2])
+        self.assertEqual(parser.result(), dict(CANNED_TABLE_JSON, title=""))
+        
+        parser = KimiRowStreamParser(TEMPLATE)
+        parser.feed(text[:text.index("王五")])
+        self.assertEqual(parser.result()["data"], CANNED_TABLE_JSON["data"][:2])
+        
+        parser = KimiRowStreamParser(TEMPLATE, compact=True)
+        rows = parser.feed(CANNED_TABLE_TSV[:-3])
+        self.assertEqual([index for index, _ in rows], [0, 1])
+        self.assertEqual(parser.finish(complete=False), [])
+        self.assertEqual(parser.result(), {"title": CANNED_TABLE_JSON["title"], "data": CANNED_TABLE_JSON["data"][:2]})
+    
+    def test_on_row_and_truncated_output(self):
+        """流式提取时按行回调；输出达到 max_tokens 被截断时返回已完整输出的行"""
+        for output_format in ("json", "tsv"):
+            with KimiMockServer(stream_chunk_size=4) as server:
+                client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+                extractor = KimiTableToJSON(client=client, output_format=output_format, max_repairs=0, max_continuations=0)
+                rows = []
+                result = extractor.extract_table_data_from_base64(
+                    "iVBORw0KGgo=", TEMPLATE, stream=True, on_row=lambda index, row: rows.append((index, row))
+                )
+                self.assertEqual(rows, list(enumerate(CANNED_TABLE_JSON["data"])))
+                self.assertFalse(result["truncated"])
+                
+                full = len(result["raw_content"])
+                result = extractor.extract_table_data_from_base64("iVBORw0KGgo=", TEMPLATE, max_tokens=full - 5)
+                self.assertTrue(result["truncated"])
+                self.assertEqual(result["json_data"]["data"], CANNED_TABLE_JSON["data"][:2])
+
+    
+    def test_continue_truncated_output(self):
+        """输出被截断时只请求剩余的行，与已输出的行拼接（去掉重复的行）"""
+        full = {
+            "json": json.dumps(CANNED_TABLE_JSON, ensure_ascii=False),
+            "tsv": CANNED_TABLE_TSV
+        }
+        continued = {
+            "json": json.dumps({"title": "", "data": CANNED_TABLE_JSON["data"][1:]}, ensure_ascii=False),
+            "tsv": "李四\t32\t市场部\n王五\t25\t财务部"
+        }
+        for output_format in ("json", "tsv"):
+            requests_seen = []
+            
+            def responder(payload):
+                requests_seen.append(payload)
+                last = payload["messages"][-1]["content"]
+                if isinstance(last, str) and "截断" in last:
+                    # 续写请求带有被截断的回复和已完整输出的最后一行
+                    self.assertIn("李四", last)
+                    self.assertEqual(payload["messages"][-2]["role"], "assistant")
+                    return continued[output_format]
+                return full[output_format]
+            
+            with KimiMockServer(responder=responder) as server:
+                client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+                extractor = KimiTableToJSON(client=client, output_format=output_format)
+                rows = []
+                result = extractor.extract_table_data_from_base64(
+                    "iVBORw0KGgo=", TEMPLATE, max_tokens=len(full[output_format]) - 5, stream=True,
+                    on_row=lambda index, row: rows.append(index)
+                )
+            
+            self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+            self.assertEqual(result["continuations"], 1)
+            self.assertFalse(result["truncated"])
+            self.assertEqual(rows, [0, 1, 2])
+            self.assertEqual(len(requests_seen), 2)
+            # usage 包括续写的 token
+            self.assertGreater(result["usage"]["completion_tokens"], len(full[output_format]))
+
+
+if __name__ == "__main__":
+    unittest.main()
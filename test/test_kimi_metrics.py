@@ -0,0 +1,84 @@
+"""
+KimiMetrics 调用指标与导出的单元测试（使用本地模拟服务）
+"""
+import os
+import sys
+import json
+import unittest
+import urllib.request
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics, start_metrics_server
+from tuxs.utils.kimi_mock_server import KimiMockServer
+
+
+class TestKimiMetrics(unittest.TestCase):
+    """KimiMetrics 测试"""
+    
+    def test_histograms_and_exports(self):
+        """调用记录按模型计入直方图，导出的 Prometheus 文本和 JSON 一致"""
+        metrics = KimiMetrics()
+        metrics.incr("requests", 3)
+        for total in (0.02, 0.3, 200.0):
+            metrics.record_request({"model": "moonshot-v1-8k", "total": total, "prompt_tokens": 900, "connect": None})
+        metrics.record_request({"model": "moonshot-v1-32k", "total": 1.5})
+        
+        histograms = metrics.histograms()
+        total_8k = histograms["total_seconds"]["moonshot-v1-8k"]
+        self.assertEqual(total_8k["count"], 3)
+        self.assertAlmostEqual(total_8k["sum"], 200.32)
+        self.assertEqual(total_8k["p50"], 0.5)
+        self.assertIsNone(total_8k["p95"])  # 超出最大桶
+        self.assertNotIn("connect_seconds", histograms)
+        self.assertEqual(histograms["prompt_tokens"]["moonshot-v1-8k"]["buckets"]["1024"], 3)
+        self.assertEqual(len(metrics.recent_requests(2)), 2)
+        
+        text = metrics.to_prometheus()
+        self.assertIn("kimi_requests_total 3", text)
+        self.assertIn("# TYPE kimi_total_seconds histogram", text)
+        self.assertIn('kimi_total_seconds_bucket{model="moonshot-v1-8k",le="0.025"} 1', text)
+        self.assertIn('kimi_total_seconds_bucket{model="moonshot-v1-8k",le="+Inf"} 3', text)
+        self.assertIn('kimi_total_seconds_count{model="moonshot-v1-32k"} 1', text)
+        
+        exported = json.loads(metrics.to_json())
+        self.assertEqual(exported["requests"], 3)
+        self.assertEqual(exported["histograms"]["total_seconds"]["moonshot-v1-32k"]["count"], 1)
+    
+    def test_client_records_timings(self):
+        """客户端记录排队、连接、首字节、总耗时、字节数和 token 数；复用连接时连接耗时为 0"""
+        metrics = KimiMetrics()
+        with KimiMockServer(latency=0.05) as server:
+            client = KimiClient(api_key="metrics", base_url=server.base_url, metrics=metrics, single_flight=None)
+            client.chat("第一次", image_base64_list="iVBORw0KGgo=")
+            for _ in client.chat_stream("第二次"):
+                pass
+            
+            first, second = metrics.recent_requests()
+            self.assertEqual(first["model"], "moonshot-v1-8k-vision-preview")
+            self.assertGreater(first["connect"], 0)
+            self.assertEqual(second["connect"], 0)
+            self.assertTrue(second["stream"])
+            for record in (first, second):
+                self.assertGreaterEqual(record["ttfb"], 0.05)
+                self.assertGreaterEqual(record["total"], record["ttfb"])
+                self.assertGreaterEqual(record["queue_wait"], 0)
+                self.assertGreater(record["request_bytes"], 0)
+                self.assertGreater(record["response_bytes"], 0)
+                self.assertGreater(record["prompt_tokens"], 0)
+            self.assertEqual(first["image_tokens"], 1024)
+            self.assertEqual(second["image_tokens"], 0)
+            
+            exporter = start_metrics_server(0, metrics=metrics)
+            url = f"http://127.0.0.1:{exporter.server_address[1]}"
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                self.assertIn("kimi_ttfb_seconds_bucket", response.read().decode("utf-8"))
+            with urllib.request.urlopen(f"{url}/metrics.json") as response:
+                self.assertEqual(json.loads(response.read())["histograms"]["ttfb_seconds"]
+                                 ["moonshot-v1-8k"]["count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
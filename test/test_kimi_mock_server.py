@@ -0,0 +1,158 @@
+"""
+KimiMockServer 本地模拟服务与传输层的单元测试
+"""
+import os
+import sys
+import unittest
+
+import requests
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_file_cache import KimiFileCache
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer, CANNED_TABLE_JSON
+from tuxs.utils.kimi_rate_limiter import KimiRateLimiter
+from tuxs.utils.kimi_request_policy import KimiRequestPolicy
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+from tuxs.utils.kimi_transport import RequestsTransport
+
+
+class TestKimiMockServer(unittest.TestCase):
+    """KimiMockServer 测试"""
+    
+    def make_client(self, server, max_retries=3):
+        """创建指向模拟服务的客户端"""
+        return KimiClient(
+            api_key="mock",
+            base_url=server.base_url,
+            policy=KimiRequestPolicy(backoff_base=0.01, max_retries=max_retries),
+            metrics=KimiMetrics(),
+            single_flight=None
+        )
+    
+    def test_canned_table_response(self):
+        """默认返回预设的表格 JSON，普通和流式结果一致"""
+        with KimiMockServer(latency="uniform:0.01,0.02", seed=1) as server:
+            extractor = KimiTableToJSON(client=self.make_client(server))
+            template = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+            result = extractor.extract_table_data_from_base64("iVBORw0KGgo=", template)
+            streamed = extractor.extract_table_data_from_base64("iVBORw0KGgo=", template, stream=True)
+            self.assertEqual(result["json_data"], CANNED_TABLE_JSON)
+            self.assertEqual(streamed["json_data"], CANNED_TABLE_JSON)
+            self.assertEqual(server.stats()["streams"], 1)
+    
+    def test_fault_injection_and_retry(self):
+        """注入的 429 / 5xx 按策略重试，重试用尽后抛出 HTTPError"""
+        with KimiMockServer(error_rate=1.0, error_statuses=(503,)) as server:
+            client = self.make_client(server, max_retries=2)
+            with self.assertRaises(requests.HTTPError):
+                client.chat_text_only("ping")
+            self.assertEqual(server.stats()["errors"], 3)
+            self.assertEqual(client.metrics.snapshot()["retries"], 2)
+        
+        with KimiMockServer(rate_limit_rate=1.0, retry_after=0.01) as server:
+            client = self.make_client(server, max_retries=1)
+            with self.assertRaises(requests.HTTPError):
+                client.chat_text_only("ping")
+            self.assertEqual(client.metrics.snapshot()["throttled"], 2)
+    
+    def test_failed_attempts_refund_tokens(self):
+        """失败的尝试和落选的对冲请求退回预留的 TPM 预算"""
+        limiter = KimiRateLimiter(tpm=60000)
+        with KimiMockServer(error_rate=1.0, error_statuses=(503,)) as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                policy=KimiRequestPolicy(backoff_base=0.01, max_retries=2),
+                rate_limiter=limiter,
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            with self.assertRaises(requests.HTTPError):
+                client.chat_text_only("ping")
+        self.assertGreater(limiter._tokens.tokens, limiter._tokens.capacity - 100)
+        
+        limiter = KimiRateLimiter(tpm=60000)
+        with KimiMockServer(latency=0.2, responder=lambda payload: "pong") as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                policy=KimiRequestPolicy(hedge=True, hedge_after=0.05),
+                rate_limiter=limiter,
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            result = client.chat_text_only("ping")
+            self.assertEqual(client.metrics.snapshot()["hedges"], 1)
+        # 只有作为结果的请求按实际 usage 计入预算
+        self.assertGreater(limiter._tokens.tokens, limiter._tokens.capacity - result["usage"]["total_tokens"] - 100)
+    
+    def test_malformed_body_refunds_tokens(self):
+        """200 响应体损坏时抛出解析错误，并退回预留的 TPM 预算"""
+        
+        class TruncatingTransport(RequestsTransport):
+            def post(self, url, headers, data, stream=False, timeout=None):
+                response = super().post(url, headers, data, stream=stream, timeout=timeout)
+                response._content = response.content[:-10]
+                return response
+        
+        limiter = KimiRateLimiter(tpm=60000)
+        with KimiMockServer() as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                transport=TruncatingTransport(),
+                rate_limiter=limiter,
+                metrics=KimiMetrics(),
+                single_flight=None
+            )
+            for _ in range(3):
+                with self.assertRaises(ValueError):
+                    client.chat_text_only("ping")
+        self.assertGreater(limiter._tokens.tokens, limiter._tokens.capacity - 100)
+    
+    def test_custom_transport(self):
+        """可替换传输层"""
+        sent = []
+        
+        class RecordingTransport(RequestsTransport):
+            def post(self, url, headers, data, stream=False, timeout=None):
+                sent.append(url)
+                return super().post(url, headers, data, stream=stream, timeout=timeout)
+        
+        with KimiMockServer(responder=lambda payload: "pong") as server:
+            client = KimiClient(api_key="mock", base_url=server.base_url, transport=RecordingTransport())
+            self.assertEqual(client.chat_text_only("ping")["content"], "pong")
+            self.assertEqual(sent, [f"{server.base_url}/chat/completions"])
+
+    
+    def test_upload_images_once(self):
+        """开启 upload_images 后同一张图片只上传一次，服务端文件失效时清除缓存并改为内联"""
+        file_cache = KimiFileCache(path=":memory:")
+        with KimiMockServer() as server:
+            client = KimiClient(
+                api_key="mock",
+                base_url=server.base_url,
+                upload_images=True,
+                file_cache=file_cache,
+                single_flight=None
+            )
+            for prompt in ("提取 HTML", "提取 JSON", "再次提取"):
+                client.chat(prompt, image_base64_list="iVBORw0KGgo=")
+            self.assertEqual(server.stats()["uploads"], 1)
+            self.assertEqual(file_cache.stats()["entries"], 1)
+            
+            server.expire_files()
+            result = client.chat("过期后", image_base64_list="iVBORw0KGgo=")
+            self.assertTrue(result["content"])
+            self.assertEqual(file_cache.stats()["entries"], 0)
+            
+            client.chat("重新上传", image_base64_list="iVBORw0KGgo=")
+            self.assertEqual(server.stats()["uploads"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+KimiOutputBudget 输出 token 预算估算的单元测试
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer
+from tuxs.utils.kimi_output_budget import KimiOutputBudget
+from tuxs.utils.kimi_table_to_json import KimiTableToJSON
+
+
+TEMPLATE = {"title": "", "data": [{"name": "", "age": 0, "department": ""}]}
+
+
+def make_table(path: str, rows: int, columns: int = 5, width: int = 800, row_height: int = 32):
+    """生成带表格线的表格图片（表头 + rows 行数据）"""
+    image = Image.new("RGB", (width, (rows + 1) * row_height + 1), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(rows + 2):
+        draw.line([(0, row * row_height), (width, row * row_height)], fill="black")
+    for column in range(columns + 1):
+        x = min(column * width // columns, width - 1)
+        draw.line([(x, 0), (x, (rows + 1) * row_height)], fill="black")
+    for row in range(rows + 1):
+        for column in range(columns):
+            draw.text((column * width // columns + 8, row * row_height + 10), f"v{row}-{column}", fill="black")
+    image.save(path)
+
+
+class TestKimiOutputBudget(unittest.TestCase):
+    """KimiOutputBudget 测试"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.budget = KimiOutputBudget()
+    
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_estimate_rows(self):
+        """按文字行检测表格行数（包括表头），无法识别的图片返回 None"""
+        for rows in (3, 40, 120):
+            path = os.path.join(self.temp_dir, f"table{rows}.png")
+            make_table(path, rows)
+            self.assertEqual(self.budget.estimate_rows(path), rows + 1)
+        self.assertIsNone(self.budget.estimate_rows(image_base64="iVBORw0KGgo="))
+    
+    def test_budget_scales_with_rows(self):
+        """预算随行数增长并限制在上下限之内；紧凑输出的预算更小"""
+        small = os.path.join(self.temp_dir, "small.png")
+        large = os.path.join(self.temp_dir, "large.png")
+        make_table(small, 3)
+        make_table(large, 120)
+        small_budget = self.budget.budget(TEMPLATE, image_path=small)
+        large_budget = self.budget.budget(TEMPLATE, image_path=large)
+        self.assertTrue(small_budget["rows_detected"])
+        self.assertLess(small_budget["max_tokens"], 4000)
+        self.assertGreater(large_budget["max_tokens"], 121 * large_budget["row_tokens"])
+        self.assertLess(
+            self.budget.budget(TEMPLATE, image_path=large, compact=True)["max_tokens"], large_budget["max_tokens"]
+        )
+        
+        capped = KimiOutputBudget(max_tokens=1000).budget(TEMPLATE, image_path=large)
+        self.assertEqual(capped["max_tokens"], 1000)
+        fallback = self.budget.budget(TEMPLATE, image_base64="iVBORw0KGgo=")
+        self.assertFalse(fallback["rows_detected"])
+        self.assertEqual(fallback["rows"], self.budget.default_rows)
+    
+    def test_extractor_uses_budget(self):
+        """未指定 max_tokens 时使用估算的预算，指定时或关闭自动估算时不变"""
+        path = os.path.join(self.temp_dir, "table.png")
+        make_table(path, 3)
+        seen = []
+        
+        def responder(payload):
+            seen.append(payload["max_tokens"])
+            return '{"title": "", "data": []}'
+        
+        with KimiMockServer(responder=responder) as server:
+            client = KimiClient(api_key="mock", base_url=server.base_url, metrics=KimiMetrics(), single_flight=None)
+            KimiTableToJSON(client=client).extract_table_data(path, TEMPLATE)
+            KimiTableToJSON(client=client).extract_table_data(path, TEMPLATE, max_tokens=1234)
+            KimiTableToJSON(client=client, adaptive_max_tokens=False).extract_table_data(path, TEMPLATE)
+        
+        self.assertEqual(seen, [self.budget.budget(TEMPLATE, image_path=path)["max_tokens"], 1234, 4000])
+
+
+if __name__ == "__main__":
+    unittest.main()
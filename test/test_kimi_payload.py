@@ -0,0 +1,109 @@
+"""
+ImageSource / StreamingJSONPayload 低拷贝请求体的单元测试
+"""
+import os
+import sys
+import json
+import base64
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_payload import ImageSource, StreamingJSONPayload, json_default
+
+
+def build_payload(image):
+    """构造一个包含单张图片的 chat/completions 请求体"""
+    return {
+        "model": "moonshot-v1-8k-vision-preview",
+        "messages": [
+            {"role": "system", "content": "你是表格识别助手"},
+            {"role": "user", "content": [
+                {"type": "image_url", "image_url": {"url": image}},
+                {"type": "text", "text": "提取表格 \"数据\""}
+            ]}
+        ],
+        "temperature": 0.1,
+        "max_tokens": 4000
+    }
+
+
+class TestStreamingJSONPayload(unittest.TestCase):
+    """StreamingJSONPayload 测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_bytes = os.urandom(100003)
+        self.image_path = os.path.join(self.temp_dir, "table.jpg")
+        with open(self.image_path, "wb") as f:
+            f.write(self.image_bytes)
+        self.expected_url = "data:image/jpeg;base64," + base64.b64encode(self.image_bytes).decode("ascii")
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_body_matches_json_dumps(self):
+        """各种图片来源生成的请求体与 json.dumps 结果一致，长度准确"""
+        sources = [
+            ImageSource.from_path(self.image_path),
+            ImageSource.from_bytes(self.image_bytes, "jpeg"),
+            ImageSource.from_base64(self.expected_url)
+        ]
+        expected = json.loads(json.dumps(build_payload(self.expected_url), ensure_ascii=False))
+        for source in sources:
+            body = StreamingJSONPayload(build_payload(source), chunk_size=3 * 1024)
+            data = b"".join(body)
+            self.assertEqual(len(body), len(data))
+            self.assertEqual(json.loads(data.decode("utf-8")), expected)
+            # 可重复迭代（重试时重新发送）
+            self.assertEqual(b"".join(body), data)
+    
+    def test_base64_with_whitespace_and_digest(self):
+        """带换行的 base64 会被规范化，内容哈希与来源形式无关"""
+        encoded = base64.encodebytes(self.image_bytes).decode("ascii")
+        from_base64 = ImageSource.from_base64(encoded)
+        from_path = ImageSource.from_path(self.image_path)
+        self.assertEqual(from_base64.read_bytes(), self.image_bytes)
+        self.assertEqual(from_base64.digest(), from_path.digest())
+        self.assertEqual(json_default(from_path), f"data:image/jpeg;base64,sha256:{from_path.digest()}")
+    
+    def test_streaming_keeps_memory_low(self):
+        """发送 10MB 图片时，流式请求体的峰值内存远小于 json.dumps 的完整副本"""
+        large_bytes = os.urandom(10 * 1024 * 1024)
+        large_path = os.path.join(self.temp_dir, "large.png")
+        with open(large_path, "wb") as f:
+            f.write(large_bytes)
+        
+        for source in (ImageSource.from_path(large_path), ImageSource.from_bytes(large_bytes)):
+            tracemalloc.start()
+            try:
+                body = StreamingJSONPayload(build_payload(source))
+                total = 0
+                for chunk in body:
+                    total += len(chunk)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(total, len(body))
+            self.assertLess(peak, 2 * 1024 * 1024)
+        
+        # 对照：json.dumps 需要完整的 base64 字符串和序列化结果
+        tracemalloc.start()
+        try:
+            data_url = "data:image/png;base64," + base64.b64encode(large_bytes).decode("ascii")
+            json.dumps(build_payload(data_url)).encode("utf-8")
+            _, baseline_peak = tracemalloc.get_traced_memory()
+            del data_url
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(baseline_peak, 10 * peak)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+KimiRateLimiter 限流器的单元测试
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_rate_limiter import KimiRateLimiter, parse_retry_after
+
+
+class TestKimiRateLimiter(unittest.TestCase):
+    """KimiRateLimiter 测试"""
+    
+    def test_unlimited_does_not_wait(self):
+        """测试未配置配额时直接放行"""
+        limiter = KimiRateLimiter(rpm=0, tpm=0)
+        for _ in range(100):
+            self.assertLess(limiter.acquire(10000), 0.05)
+    
+    def test_rpm_limit_waits_for_refill(self):
+        """测试请求数用尽后需要等待令牌补充"""
+        limiter = KimiRateLimiter(rpm=600, tpm=0)  # 每 0.1 秒补充 1 个
+        limiter._requests.tokens = 1
+        limiter.acquire()
+        waited = limiter.acquire()
+        self.assertGreater(waited, 0.05)
+    
+    def test_settle_refunds_unused_tokens(self):
+        """测试用实际 usage 退回多预估的 token"""
+        limiter = KimiRateLimiter(rpm=0, tpm=6000)
+        limiter.acquire(5000)
+        limiter.settle(5000, 1000)
+        self.assertLess(limiter.acquire(4000), 0.05)
+    
+    def test_estimate_wait_does_not_consume(self):
+        """测试预估等待时间不占用配额，且包含暂停时间"""
+        limiter = KimiRateLimiter(rpm=600, tpm=0)
+        limiter._requests.tokens = 0
+        self.assertGreater(limiter.estimate_wait(), 0.05)
+        self.assertEqual(limiter.stats()["acquired"], 0)
+        self.assertEqual(KimiRateLimiter(rpm=0, tpm=0).estimate_wait(10000), 0.0)
+        paused = KimiRateLimiter(rpm=0, tpm=0)
+        paused.pause(1.0)
+        self.assertGreater(paused.estimate_wait(), 0.9)
+    
+    def test_fifo_order(self):
+        """测试调用方按到达顺序放行"""
+        limiter = KimiRateLimiter(rpm=1200, tpm=0)  # 每 0.05 秒补充 1 个
+        limiter._requests.tokens = 0
+        order = []
+        
+        def worker(index):
+            limiter.acquire()
+            order.append(index)
+        
+        threads = []
+        for i in range(5):
+            thread = threading.Thread(target=worker, args=(i,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(order, list(range(5)))
+    
+    def test_pause_blocks_callers(self):
+        """测试 pause 期间新请求需要等待"""
+        limiter = KimiRateLimiter(rpm=0, tpm=0)
+        limiter.pause(0.1)
+        self.assertGreater(limiter.acquire(), 0.05)
+        self.assertEqual(limiter.stats()["throttled_responses"], 1)
+    
+    def test_parse_retry_after(self):
+        """测试解析 Retry-After 响应头"""
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("invalid"))
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
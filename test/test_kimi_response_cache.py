@@ -0,0 +1,99 @@
+"""
+KimiResponseCache 响应缓存的单元测试
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_response_cache import KimiResponseCache
+
+
+class TestKimiResponseCache(unittest.TestCase):
+    """KimiResponseCache 测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "cache.sqlite3")
+        self.payload = {
+            "model": "moonshot-v1-8k-vision-preview",
+            "messages": [{"role": "user", "content": [
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+                {"type": "text", "text": "提取表格"}
+            ]}],
+            "temperature": 0.1,
+            "max_tokens": 4000
+        }
+        self.response = {"choices": [{"message": {"content": "{}"}}], "usage": {"total_tokens": 10}}
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_make_key_depends_on_image_and_params(self):
+        """测试缓存键包含图片内容和采样参数"""
+        key = KimiResponseCache.make_key(self.payload)
+        self.assertEqual(key, KimiResponseCache.make_key(dict(reversed(list(self.payload.items())))))
+        
+        other_temperature = dict(self.payload, temperature=0.2)
+        self.assertNotEqual(key, KimiResponseCache.make_key(other_temperature))
+        
+        other_image = dict(self.payload)
+        other_image["messages"] = [{"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,BBBB"}},
+            {"type": "text", "text": "提取表格"}
+        ]}]
+        self.assertNotEqual(key, KimiResponseCache.make_key(other_image))
+    
+    def test_hit_miss_and_persistence(self):
+        """测试命中计数，以及重新打开数据库后缓存仍然有效"""
+        cache = KimiResponseCache(self.db_path)
+        key = cache.make_key(self.payload)
+        
+        self.assertIsNone(cache.get(key))
+        cache.set(key, self.response)
+        self.assertEqual(cache.get(key), self.response)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        cache.close()
+        
+        reopened = KimiResponseCache(self.db_path)
+        self.assertEqual(reopened.get(key), self.response)
+        reopened.close()
+    
+    def test_ttl_expiry(self):
+        """测试过期条目视为未命中"""
+        cache = KimiResponseCache(self.db_path, ttl=0.05)
+        cache.set("k", self.response)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["entries"], 0)
+        cache.close()
+    
+    def test_lru_eviction(self):
+        """测试超出大小上限时淘汰最久未访问的条目"""
+        entry_size = len(json.dumps(self.response, ensure_ascii=False).encode("utf-8"))
+        cache = KimiResponseCache(self.db_path, max_bytes=entry_size * 2 + 10)
+        cache.set("a", self.response)
+        time.sleep(0.01)
+        cache.set("b", self.response)
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.set("c", self.response)
+        
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
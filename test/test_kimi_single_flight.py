@@ -0,0 +1,85 @@
+"""
+KimiSingleFlight 进行中请求合并的单元测试（不访问网络）
+"""
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_single_flight import KimiSingleFlight
+
+
+class TestKimiSingleFlight(unittest.TestCase):
+    """KimiSingleFlight 测试"""
+    
+    def test_concurrent_calls_share_one_execution(self):
+        """相同 key 的并发调用只执行一次，异常同样共享"""
+        flight = KimiSingleFlight()
+        calls = []
+        
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"value": 1}
+        
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda _: flight.do("same", slow), range(6)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sum(shared for _, shared in results), 5)
+        self.assertTrue(all(result == {"value": 1} for result, _ in results))
+        self.assertEqual(flight.in_flight(), 0)
+        
+        barrier = threading.Barrier(3)
+        
+        def failing():
+            time.sleep(0.2)
+            raise RuntimeError("boom")
+        
+        def call_failing(_):
+            barrier.wait()
+            try:
+                flight.do("error", failing)
+            except RuntimeError as e:
+                return str(e)
+        
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            self.assertEqual(list(executor.map(call_failing, range(3))), ["boom"] * 3)
+    
+    def test_client_deduplicates_identical_requests(self):
+        """KimiClient 对相同的并发请求只调用一次 API，不同请求各自调用"""
+        metrics = KimiMetrics()
+        client = KimiClient(api_key="key-test", metrics=metrics, single_flight=KimiSingleFlight())
+        sent = []
+        
+        def fake_post(payload, estimated_tokens=0, stream=False, endpoint=None):
+            text = payload["messages"][-1]["content"][-1]["text"]
+            sent.append(text)
+            time.sleep(0.2)
+            response = MagicMock()
+            response.content = json.dumps({
+                "choices": [{"message": {"content": text}}],
+                "usage": {"total_tokens": 1}
+            }).encode("utf-8")
+            return response
+        
+        prompts = ["same"] * 6 + ["other"]
+        with patch.object(client, "_post_chat_completions", side_effect=fake_post):
+            with ThreadPoolExecutor(max_workers=7) as executor:
+                results = list(executor.map(lambda prompt: client.chat(prompt, temperature=0.1), prompts))
+        
+        self.assertEqual(sorted(sent), ["other", "same"])
+        self.assertEqual([result["content"] for result in results], prompts)
+        self.assertEqual(metrics.snapshot()["deduplicated"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
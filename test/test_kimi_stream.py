@@ -0,0 +1,98 @@
+"""
+KimiClient.chat_stream / KimiStreamResponse 流式响应的单元测试（使用本地模拟服务）
+"""
+import os
+import sys
+import time
+import unittest
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_client import KimiClient
+from tuxs.utils.kimi_metrics import KimiMetrics
+from tuxs.utils.kimi_mock_server import KimiMockServer
+from tuxs.utils.kimi_transport import RequestsTransport
+
+
+REPLY = "第一行数据，" * 20
+
+
+class RecordingTransport(RequestsTransport):
+    """记录返回的响应对象，用于检查连接是否被释放"""
+    
+    def __init__(self):
+        super().__init__()
+        self.responses = []
+    
+    def post(self, url, headers, data, stream=False, timeout=None):
+        response = super().post(url, headers, data, stream=stream, timeout=timeout)
+        self.responses.append(response)
+        return response
+
+
+class TestKimiStream(unittest.TestCase):
+    """chat_stream 测试"""
+    
+    def make_client(self, server, transport=None):
+        """创建指向模拟服务的客户端"""
+        return KimiClient(
+            api_key="mock",
+            base_url=server.base_url,
+            transport=transport,
+            metrics=KimiMetrics(),
+            single_flight=None
+        )
+    
+    def test_deltas_join_to_full_content(self):
+        """内容增量按顺序拼接为完整回复；最后一个数据块的 usage 和 finish_reason 被记录"""
+        with KimiMockServer(responder=lambda payload: REPLY, stream_chunk_size=7) as server:
+            stream = self.make_client(server).chat_stream("提取")
+            deltas = list(stream)
+        
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(deltas), REPLY)
+        self.assertEqual(stream.content, REPLY)
+        self.assertEqual(stream.finish_reason, "stop")
+        self.assertEqual(stream.usage["completion_tokens"], len(REPLY))
+        self.assertEqual(
+            stream.usage["total_tokens"],
+            stream.usage["prompt_tokens"] + stream.usage["completion_tokens"]
+        )
+        
+        result = stream.to_result()
+        self.assertEqual(result["content"], REPLY)
+        self.assertEqual(result["usage"], stream.usage)
+        self.assertEqual(result["raw_response"]["choices"][0]["message"]["content"], REPLY)
+        self.assertEqual(result["raw_response"]["choices"][0]["finish_reason"], "stop")
+    
+    def test_truncated_stream_reports_length(self):
+        """达到 max_tokens 时 finish_reason 为 length"""
+        with KimiMockServer(responder=lambda payload: REPLY) as server:
+            stream = self.make_client(server).chat_stream("提取", max_tokens=10)
+            content = "".join(stream)
+        
+        self.assertEqual(content, REPLY[:10])
+        self.assertEqual(stream.finish_reason, "length")
+    
+    def test_close_early_releases_connection(self):
+        """提前 close() 时不等待剩余内容，关闭连接并释放成员的并发计数"""
+        transport = RecordingTransport()
+        with KimiMockServer(responder=lambda payload: REPLY, stream_chunk_size=4, stream_chunk_delay=0.05) as server:
+            client = self.make_client(server, transport)
+            stream = client.chat_stream("提取")
+            start = time.monotonic()
+            next(iter(stream))
+            self.assertEqual(client.endpoint_pool.endpoints[0].in_flight, 1)
+            stream.close()
+            
+            self.assertLess(time.monotonic() - start, 0.05 * len(REPLY) / 4 / 2)
+            self.assertTrue(transport.responses[0].raw.closed)
+            self.assertEqual(client.endpoint_pool.endpoints[0].in_flight, 0)
+            self.assertEqual(len(client.metrics.recent_requests()), 1)
+            # 连接释放后客户端仍可继续调用
+            self.assertEqual(client.chat_text_only("再次")["content"], REPLY)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+KimiTokenEstimator token 预估与档位选择的单元测试
+"""
+import io
+import os
+import sys
+import base64
+import unittest
+
+from PIL import Image
+
+# 添加父目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuxs.utils.kimi_payload import ImageSource
+from tuxs.utils.kimi_token_estimator import KimiTokenEstimator
+
+
+def make_image(width, height):
+    """生成指定尺寸的 PNG 字节"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (255, 255, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def build_messages(text, image=None):
+    """构造单条用户消息"""
+    content = [{"type": "text", "text": text}]
+    if image is not None:
+        content.insert(0, {"type": "image_url", "image_url": {"url": image}})
+    return [{"role": "user", "content": content}]
+
+
+class TestKimiTokenEstimator(unittest.TestCase):
+    """KimiTokenEstimator 测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.estimator = KimiTokenEstimator(image_patch_size=28, message_overhead=0, safety_margin=0)
+    
+    def test_estimate_text_and_image(self):
+        """文本按字符类型预估，图片按尺寸折算"""
+        self.assertEqual(self.estimator.estimate_text("表格abcdef"), 2 + 2)
+        
+        image = ImageSource.from_bytes(make_image(280, 56))
+        estimate = self.estimator.estimate(build_messages("提取", image), max_tokens=100)
+        self.assertEqual(estimate["image_tokens"], 10 * 2)
+        self.assertEqual(estimate["image_count"], 1)
+        self.assertEqual(estimate["total_tokens"], 2 + 20 + 100)
+        
+        # base64 / data URL 来源得到相同尺寸
+        encoded = base64.b64encode(make_image(280, 56)).decode("ascii")
+        self.assertEqual(self.estimator.image_size(ImageSource.from_base64(encoded)), (280, 56))
+        self.assertEqual(self.estimator.image_size("data:image/png;base64," + encoded), (280, 56))
+    
+    def test_select_smallest_fitting_tier(self):
+        """选择能容纳请求的最小档位，有图片时使用视觉模型"""
+        small = self.estimator.estimate(build_messages("提取"), max_tokens=4000)
+        self.assertEqual(self.estimator.select_model("moonshot-v1-128k", small), "moonshot-v1-8k")
+        
+        image = ImageSource.from_bytes(make_image(2800, 2800))  # 10000 tokens
+        large = self.estimator.estimate(build_messages("提取", image), max_tokens=4000)
+        self.assertEqual(
+            self.estimator.select_model("moonshot-v1-8k", large),
+            "moonshot-v1-32k-vision-preview"
+        )
+        # 关闭自动档位时保持原档位，只切换到视觉版本
+        self.assertEqual(
+            self.estimator.select_model("moonshot-v1-8k", large, auto_tier=False),
+            "moonshot-v1-8k-vision-preview"
+        )
+        # 其他模型没有图片时不处理，有图片时切换到视觉模型
+        self.assertEqual(self.estimator.select_model("kimi-latest", small), "kimi-latest")
+        self.assertEqual(self.estimator.select_model("moonshot-v1-auto", large), "moonshot-v1-8k-vision-preview")
+        self.assertEqual(self.estimator.select_model("custom-32k", large), "moonshot-v1-32k-vision-preview")
+        self.assertEqual(self.estimator.select_model("custom-vision", large), "custom-vision")
+
+
+if __name__ == "__main__":
+    unittest.main()
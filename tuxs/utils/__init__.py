@@ -3,14 +3,48 @@
 """
 from .kimi_table_to_html import KimiTableToHTML
 from .kimi_table_to_json import KimiTableToJSON
+from .kimi_json_template import KimiRowStreamParser
 from .kimi_client import KimiClient
+from .kimi_response_cache import KimiResponseCache
+from .kimi_file_cache import KimiFileCache
+from .kimi_context_cache import KimiContextCache
+from .kimi_rate_limiter import KimiRateLimiter
+from .kimi_endpoint_pool import KimiEndpoint, KimiEndpointPool
+from .kimi_request_policy import KimiRequestPolicy
+from .kimi_metrics import KimiMetrics
+from .kimi_image_preprocessor import KimiImagePreprocessor
+from .kimi_token_estimator import KimiTokenEstimator
+from .kimi_output_budget import KimiOutputBudget
+from .kimi_single_flight import KimiSingleFlight
+from .kimi_transport import KimiTransport, RequestsTransport
+from .kimi_cassette import KimiCassetteTransport
+from .kimi_batch_manifest import KimiBatchManifest
+from .kimi_mock_server import KimiMockServer
 from .html_screenshotter import HTMLScreenshotter
 from .table_renderer import TableRenderer
 
 __all__ = [
     'KimiTableToHTML',
     'KimiTableToJSON', 
+    'KimiRowStreamParser',
     'KimiClient', 
+    'KimiResponseCache',
+    'KimiFileCache',
+    'KimiContextCache',
+    'KimiRateLimiter',
+    'KimiEndpoint',
+    'KimiEndpointPool',
+    'KimiRequestPolicy',
+    'KimiMetrics',
+    'KimiImagePreprocessor',
+    'KimiTokenEstimator',
+    'KimiOutputBudget',
+    'KimiSingleFlight',
+    'KimiTransport',
+    'RequestsTransport',
+    'KimiCassetteTransport',
+    'KimiBatchManifest',
+    'KimiMockServer',
     'HTMLScreenshotter', 
     'TableRenderer'
 ]
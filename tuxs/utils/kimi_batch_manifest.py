@@ -0,0 +1,179 @@
+"""
+批量任务的进度清单
+在输出目录中记录每张图片的内容哈希、状态、输出路径和 token 用量，
+重新运行时跳过内容和参数都未变化、且输出文件仍存在的已完成图片，只重试失败和新增的图片
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any
+
+
+# 默认清单文件名，可通过环境变量 KIMI_BATCH_MANIFEST 覆盖
+DEFAULT_MANIFEST_NAME = "kimi_manifest.json"
+
+# 清单格式版本
+MANIFEST_VERSION = 1
+
+
+class KimiBatchManifest:
+    """保存在输出目录中的 JSON 进度清单（线程安全，每次更新后原子写入）"""
+    
+    def __init__(self, output_dir: str, filename: Optional[str] = None):
+        """
+        初始化进度清单，已有的清单文件会被读取
+        
+        Args:
+            output_dir: 批量任务的输出目录
+            filename: 清单文件名，默认读取环境变量 KIMI_BATCH_MANIFEST 或 kimi_manifest.json
+        """
+        self.path = os.path.join(output_dir, filename or os.getenv("KIMI_BATCH_MANIFEST") or DEFAULT_MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.items: Dict[str, Dict[str, Any]] = {}
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == MANIFEST_VERSION:
+                    self.items = manifest.get("items", {})
+            except (OSError, ValueError, AttributeError) as e:
+                # 清单损坏时从头开始，不影响批量任务本身
+                print(f"警告: 无法读取进度清单 {self.path} - {e}")
+    
+    @staticmethod
+    def file_hash(path: str) -> Optional[str]:
+        """
+        计算文件内容的 SHA-256
+        
+        Args:
+            path: 文件路径
+            
+        Returns:
+            十六进制摘要，文件无法读取时返回 None
+        """
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+    
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        """
+        计算任务参数（模板、提示词等）的摘要，参数变化后已完成的图片也会重新处理
+        
+        Args:
+            *parts: 影响输出结果的参数
+            
+        Returns:
+            十六进制摘要
+        """
+        text = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _key(image_path: str) -> str:
+        """清单中的键：规范化的图片路径"""
+        return os.path.normcase(os.path.abspath(image_path))
+    
+    def completed(self, image_path: str, digest: Optional[str], params: str) -> Optional[Dict[str, Any]]:
+        """
+        查询可以跳过的已完成条目
+        
+        Args:
+            image_path: 图片路径
+            digest: 图片当前内容的 SHA-256
+            params: 当前任务参数的摘要（见 fingerprint）
+            
+        Returns:
+            条目字典；内容或参数已变化、上次失败或输出文件不存在时返回 None
+        """
+        with self._lock:
+            entry = self.items.get(self._key(image_path))
+        if (
+            entry is None
+            or digest is None
+            or entry.get("status") != "done"
+            or entry.get("hash") != digest
+            or entry.get("params") != params
+        ):
+            return None
+        if not entry.get("output_path") or not os.path.exists(entry["output_path"]):
+            return None
+        return entry
+    
+    def record(
+        self,
+        image_path: str,
+        digest: Optional[str],
+        params: str,
+        status: str,
+        output_path: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ):
+        """
+        记录一张图片的处理结果并立即写入清单文件（写入失败时只打印警告）
+        
+        Args:
+            image_path: 图片路径
+            digest: 图片内容的 SHA-256
+            params: 任务参数的摘要
+            status: "done" 或 "failed"
+            output_path: 输出文件路径
+            usage: token 用量
+            error: 失败原因
+        """
+        entry = {
+            "image_path": image_path,
+            "hash": digest,
+            "params": params,
+            "status": status,
+            "output_path": output_path,
+            "usage": usage or {},
+            "error": error,
+            "updated_at": time.time()
+        }
+        with self._lock:
+            self.items[self._key(image_path)] = entry
+            self._save()
+    
+    def _save(self):
+        """
+        原子写入清单文件（先写临时文件再替换），进程中途退出时不会留下损坏的清单
+        
+        写入失败（输出目录不存在、磁盘只读、文件被占用等）时只打印警告：清单只用于断点续跑，不能中断批量任务本身
+        """
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "items": self.items}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"警告: 无法写入进度清单 {self.path} - {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    
+    def summary(self) -> Dict[str, Any]:
+        """
+        获取清单统计
+        
+        Returns:
+            {"done", "failed", "prompt_tokens", "completion_tokens", "total_tokens"}
+        """
+        with self._lock:
+            entries = list(self.items.values())
+        summary = {"done": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        for entry in entries:
+            summary["done" if entry.get("status") == "done" else "failed"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                summary[key] += (entry.get("usage") or {}).get(key) or 0
+        return summary
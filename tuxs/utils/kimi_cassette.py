@@ -0,0 +1,370 @@
+"""
+Kimi 请求录制 / 回放（cassette）
+把真实的请求 / 响应对（去除 API 密钥）录制到紧凑的 JSONL 文件，之后不访问网络按原样回放，
+可以还原录制时的延迟，也可以去掉延迟，只测量 KimiTableToJSON 等本地处理的开销
+
+设置环境变量后 KimiClient 自动使用:
+    KIMI_CASSETTE=tests/kimi.cassette.jsonl.gz
+    KIMI_CASSETTE_MODE=record        # record: 录制（每个进程第一次录制时覆盖已有文件）；replay: 回放（默认）
+    KIMI_CASSETTE_LATENCY=none       # recorded: 还原录制的延迟（默认）；none: 去掉延迟；数字: 延迟倍数
+"""
+import os
+import re
+import gzip
+import time
+import base64
+import hashlib
+import datetime
+import threading
+from urllib.parse import urlsplit
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_json import dumps, loads
+    from .kimi_transport import KimiTransport, RequestsTransport
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_json import dumps, loads
+    from utils.kimi_transport import KimiTransport, RequestsTransport
+
+
+# 录制的响应头（其余响应头与回放无关，不写入文件）
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+
+# 响应体中可能回显的 API 密钥
+_API_KEY_PATTERN = re.compile(r"sk-[A-Za-z0-9_\-]{6,}")
+
+# 录制中的 cassette 文件 -> 写入锁：每个 KimiClient 都会创建自己的传输层，
+# 同一进程中只有第一个录制传输层覆盖文件，之后的传输层追加写入，并共用写入锁
+_recording_locks: Dict[str, threading.Lock] = {}
+_recording_registry_lock = threading.Lock()
+
+
+class CassetteMissError(requests.RequestException):
+    """回放时 cassette 中没有对应的录制（请求内容与录制时不同）"""
+    pass
+
+
+def _redact(text: str) -> str:
+    """去除文本中的 API 密钥"""
+    return _API_KEY_PATTERN.sub("sk-***", text)
+
+
+def parse_latency_scale(spec: Union[None, str, float]) -> float:
+    """
+    解析回放延迟设置
+    
+    Args:
+        spec: "recorded" / None 还原录制的延迟，"none" 去掉延迟，数字为延迟倍数
+        
+    Returns:
+        延迟倍数
+    """
+    if spec is None:
+        return 1.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    spec = spec.strip().lower()
+    if spec in ("", "recorded"):
+        return 1.0
+    if spec in ("none", "off", "0"):
+        return 0.0
+    return float(spec)
+
+
+class _ReplayStream:
+    """流式响应的原始数据源：按录制的到达时间逐行产出 SSE 数据（供 requests.Response.iter_content 读取）"""
+    
+    def __init__(self, events: List[List[Any]], start: float, scale: float):
+        self.events = events
+        self.start = start
+        self.scale = scale
+    
+    def stream(self, chunk_size: int = 1024, decode_content: bool = True):
+        for offset, line in self.events:
+            delay = self.start + offset * self.scale - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            yield line.encode("utf-8") + b"\n"
+    
+    def close(self):
+        pass
+
+
+class KimiCassetteTransport(KimiTransport):
+    """
+    录制 / 回放传输层
+    
+    - record: 通过 inner 发送请求，把 (请求摘要, 状态码, 响应体或 SSE 行, 首字节和总耗时) 追加写入 cassette
+    - replay: 不访问网络，按请求摘要查找录制的响应；同一请求录制了多次时按顺序回放（用完后重复最后一次）
+    
+    请求按 "接口路径 + 请求体的 SHA-256" 匹配，与 API 地址和密钥无关；文件只保存摘要和字节数，
+    不保存请求体（图片 base64）和请求头，响应体中的 API 密钥也会被替换。
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        inner: Optional[KimiTransport] = None,
+        latency: Union[None, str, float] = None
+    ):
+        """
+        初始化录制 / 回放传输层
+        
+        Args:
+            path: cassette 文件路径，以 .gz 结尾时使用 gzip 压缩
+            mode: "record" 录制（同一进程中第一次录制该文件时覆盖已有文件，之后追加）或 "replay" 回放
+            inner: 录制时实际发送请求的传输层（可选），默认使用不复用连接的 RequestsTransport
+            latency: 回放延迟，"recorded"（默认）还原录制的延迟，"none" 去掉延迟，数字为延迟倍数
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.inner = inner or RequestsTransport()
+        self.latency_scale = parse_latency_scale(latency)
+        
+        self._lock = threading.Lock()
+        # 回放：key -> 录制列表，以及每个 key 已回放的次数
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._played: Dict[str, int] = {}
+        self._recorded = 0
+        self._file_lock = self._lock
+        
+        if mode == "record":
+            file_key = os.path.normcase(os.path.abspath(path))
+            with _recording_registry_lock:
+                if file_key not in _recording_locks:
+                    os.makedirs(os.path.dirname(file_key), exist_ok=True)
+                    with self._open("wb"):
+                        pass
+                    _recording_locks[file_key] = threading.Lock()
+                self._file_lock = _recording_locks[file_key]
+        else:
+            self._load()
+    
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode)
+        return open(self.path, mode)
+    
+    def _load(self):
+        """读取 cassette 文件"""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with self._open("rb") as f:
+            for line in f:
+                if line.strip():
+                    interaction = loads(line)
+                    self._interactions.setdefault(interaction["key"], []).append(interaction)
+    
+    def _append(self, interaction: Dict[str, Any]):
+        """追加一条录制（每行一个 JSON 对象）"""
+        line = (dumps(interaction) + "\n").encode("utf-8")
+        with self._file_lock:
+            with self._open("ab") as f:
+                f.write(line)
+        with self._lock:
+            self._recorded += 1
+    
+    @staticmethod
+    def make_key(url: str, body: bytes) -> str:
+        """
+        计算请求的匹配键
+        
+        Args:
+            url: 请求地址（只使用路径部分）
+            body: 请求体
+            
+        Returns:
+            "<路径>:<请求体 SHA-256>"
+        """
+        return f"{urlsplit(url).path}:{hashlib.sha256(body).hexdigest()}"
+    
+    @staticmethod
+    def _upload_body(files: Dict[str, Any], data: Optional[Dict[str, str]]) -> bytes:
+        """把上传的文件内容和表单字段拼成用于计算匹配键的字节串"""
+        parts = []
+        for name in sorted(files):
+            value = files[name]
+            content = value[1] if isinstance(value, tuple) else value
+            if hasattr(content, "read"):
+                content = content.read()
+                if isinstance(value, tuple):
+                    files[name] = (value[0], content) + tuple(value[2:])
+                else:
+                    files[name] = content
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            parts.append(name.encode("utf-8") + b"=" + hashlib.sha256(content).digest())
+        for name in sorted(data or {}):
+            parts.append(f"{name}={data[name]}".encode("utf-8"))
+        return b"\n".join(parts)
+    
+    def post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        data: Any,
+        stream: bool = False,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        # 录制和回放都需要完整的请求体来计算匹配键
+        body = data if isinstance(data, bytes) else b"".join(data)
+        key = self.make_key(url, body)
+        if self.mode == "replay":
+            return self._replay(key, url)
+        return self._record(
+            key, url, len(body), stream,
+            lambda: self.inner.post(url, headers=headers, data=body, stream=stream, timeout=timeout)
+        )
+    
+    def upload(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        files: Dict[str, Any],
+        data: Optional[Dict[str, str]] = None,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        files = dict(files)
+        body = self._upload_body(files, data)
+        key = self.make_key(url, body)
+        if self.mode == "replay":
+            return self._replay(key, url)
+        return self._record(
+            key, url, len(body), False,
+            lambda: self.inner.upload(url, headers=headers, files=files, data=data, timeout=timeout)
+        )
+    
+    def _record(self, key: str, url: str, request_bytes: int, stream: bool, send) -> requests.Response:
+        """发送请求并录制响应，返回从录制内容重建的响应（响应体已读取完毕）"""
+        interaction = {"key": key, "path": urlsplit(url).path, "request_bytes": request_bytes, "stream": stream}
+        start = time.monotonic()
+        try:
+            response = send()
+        except requests.Timeout:
+            interaction.update(error="timeout", total=time.monotonic() - start)
+            self._append(interaction)
+            raise
+        except requests.ConnectionError:
+            interaction.update(error="connection", total=time.monotonic() - start)
+            self._append(interaction)
+            raise
+        
+        elapsed = getattr(response, "elapsed", None)
+        interaction["ttfb"] = elapsed.total_seconds() if elapsed else time.monotonic() - start
+        interaction["status"] = response.status_code
+        interaction["headers"] = {
+            name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers
+        }
+        try:
+            if stream:
+                events = []
+                for line in response.iter_lines():
+                    events.append([time.monotonic() - start, _redact(line.decode("utf-8", errors="replace"))])
+                interaction["events"] = events
+            else:
+                try:
+                    interaction["body"] = _redact(response.content.decode("utf-8"))
+                except UnicodeDecodeError:
+                    interaction["body_b64"] = base64.b64encode(response.content).decode("ascii")
+        finally:
+            response.close()
+        interaction["total"] = time.monotonic() - start
+        self._append(interaction)
+        
+        replayed = self._build_response(interaction, url, start, 0.0)
+        timing = getattr(response, "kimi_timing", None)
+        if isinstance(timing, dict):
+            replayed.kimi_timing = dict(timing)
+        return replayed
+    
+    def _replay(self, key: str, url: str) -> requests.Response:
+        """按匹配键回放录制的响应"""
+        start = time.monotonic()
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteMissError(f"No recorded interaction for {key} in {self.path}")
+            index = self._played.get(key, 0)
+            self._played[key] = index + 1
+            interaction = recorded[min(index, len(recorded) - 1)]
+        
+        # 非流式响应等待完整耗时，流式响应等待首字节耗时，其余时间在读取时按行等待
+        wait = interaction.get("total" if "events" not in interaction else "ttfb", 0.0) * self.latency_scale
+        if wait > 0:
+            time.sleep(wait)
+        
+        error = interaction.get("error")
+        if error == "timeout":
+            raise requests.Timeout(f"Recorded timeout for {url}")
+        if error == "connection":
+            raise requests.ConnectionError(f"Recorded connection error for {url}")
+        return self._build_response(interaction, url, start, self.latency_scale)
+    
+    @staticmethod
+    def _build_response(interaction: Dict[str, Any], url: str, start: float, scale: float) -> requests.Response:
+        """由录制内容构造 requests.Response"""
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.headers = CaseInsensitiveDict(interaction.get("headers", {}))
+        response.url = url
+        response.encoding = "utf-8"
+        response.reason = ""
+        ttfb = interaction.get("ttfb", 0.0) * scale
+        response.elapsed = datetime.timedelta(seconds=ttfb)
+        if "events" in interaction:
+            response.raw = _ReplayStream(interaction["events"], start, scale)
+        elif "body_b64" in interaction:
+            response._content = base64.b64decode(interaction["body_b64"])
+        else:
+            response._content = interaction.get("body", "").encode("utf-8")
+        response.kimi_timing = {"ttfb": ttfb, "connect": 0.0}
+        return response
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取回放统计信息
+        
+        Returns:
+            {"mode", "recorded", "interactions", "played"}
+        """
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "recorded": self._recorded,
+                "interactions": sum(len(items) for items in self._interactions.values()),
+                "played": sum(self._played.values())
+            }
+    
+    def close(self):
+        self.inner.close()
+
+
+def cassette_from_env(inner: Optional[KimiTransport] = None) -> Optional[KimiCassetteTransport]:
+    """
+    根据环境变量 KIMI_CASSETTE / KIMI_CASSETTE_MODE / KIMI_CASSETTE_LATENCY 创建录制 / 回放传输层
+    
+    Args:
+        inner: 录制时实际发送请求的传输层
+        
+    Returns:
+        KimiCassetteTransport 实例，未设置 KIMI_CASSETTE 时返回 None
+    """
+    path = os.getenv("KIMI_CASSETTE")
+    if not path:
+        return None
+    return KimiCassetteTransport(
+        path,
+        mode=os.getenv("KIMI_CASSETTE_MODE", "replay").lower(),
+        inner=inner,
+        latency=os.getenv("KIMI_CASSETTE_LATENCY")
+    )
@@ -3,31 +3,320 @@
 支持自定义图片和 prompt 的灵活调用
 """
 import os
+import sys
+import json
 import base64
+import asyncio
+import functools
+import time
+import threading
+import weakref
 import requests
-from typing import Optional, Dict, Any, List, Union
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List, Union, Tuple, Iterator, Callable
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_response_cache import KimiResponseCache, get_default_cache
+    from .kimi_rate_limiter import KimiRateLimiter, parse_retry_after
+    from .kimi_request_policy import KimiRequestPolicy
+    from .kimi_metrics import KimiMetrics, get_default_metrics, start_metrics_server
+    from .kimi_image_preprocessor import KimiImagePreprocessor
+    from .kimi_payload import ImageSource, StreamingJSONPayload
+    from .kimi_token_estimator import KimiTokenEstimator
+    from .kimi_single_flight import KimiSingleFlight
+    from .kimi_transport import KimiTransport, RequestsTransport, TimedHTTPAdapter
+    from .kimi_cassette import cassette_from_env
+    from .kimi_file_cache import KimiFileCache, get_default_file_cache
+    from .kimi_context_cache import KimiContextCache, get_default_context_cache
+    from .kimi_endpoint_pool import KimiEndpoint, KimiEndpointPool
+    from . import kimi_json
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_response_cache import KimiResponseCache, get_default_cache
+    from utils.kimi_rate_limiter import KimiRateLimiter, parse_retry_after
+    from utils.kimi_request_policy import KimiRequestPolicy
+    from utils.kimi_metrics import KimiMetrics, get_default_metrics, start_metrics_server
+    from utils.kimi_image_preprocessor import KimiImagePreprocessor
+    from utils.kimi_payload import ImageSource, StreamingJSONPayload
+    from utils.kimi_token_estimator import KimiTokenEstimator
+    from utils.kimi_single_flight import KimiSingleFlight
+    from utils.kimi_transport import KimiTransport, RequestsTransport, TimedHTTPAdapter
+    from utils.kimi_cassette import cassette_from_env
+    from utils.kimi_file_cache import KimiFileCache, get_default_file_cache
+    from utils.kimi_context_cache import KimiContextCache, get_default_context_cache
+    from utils.kimi_endpoint_pool import KimiEndpoint, KimiEndpointPool
+    from utils import kimi_json
+
+
+# 默认连接池大小，可通过环境变量 KIMI_POOL_CONNECTIONS / KIMI_POOL_MAXSIZE 覆盖
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+# 异步接口默认的最大并发请求数，可通过环境变量 KIMI_MAX_CONCURRENCY 覆盖
+DEFAULT_MAX_CONCURRENCY = 8
+
+# 进程内共享的 HTTP 会话，按连接池配置区分
+_shared_sessions: Dict[Tuple[int, int], requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def get_shared_session(
+    pool_connections: Optional[int] = None,
+    pool_maxsize: Optional[int] = None
+) -> requests.Session:
+    """
+    获取进程内共享的 HTTP 会话（带连接池和 keep-alive）
+    
+    同一进程内相同连接池配置的所有 KimiClient 共用一个会话，
+    即使是每次节点执行都新建的短生命周期客户端，也能复用已建立的 TCP/TLS 连接。
+    
+    Args:
+        pool_connections: 缓存的连接池数量（按主机区分），默认读取环境变量 KIMI_POOL_CONNECTIONS 或 10
+        pool_maxsize: 每个连接池保持的最大连接数，默认读取环境变量 KIMI_POOL_MAXSIZE 或 10
+        
+    Returns:
+        共享的 requests.Session 实例
+    """
+    if pool_connections is None:
+        pool_connections = int(os.getenv("KIMI_POOL_CONNECTIONS", DEFAULT_POOL_CONNECTIONS))
+    if pool_maxsize is None:
+        pool_maxsize = int(os.getenv("KIMI_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+    
+    key = (pool_connections, pool_maxsize)
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # TimedHTTPAdapter 与 HTTPAdapter 行为相同，额外记录新建连接的耗时
+            adapter = TimedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _shared_sessions[key] = session
+        return session
+
+
+# 异步接口使用的线程池和信号量（按事件循环和并发上限区分）
+_async_executor: Optional[ThreadPoolExecutor] = None
+_async_executor_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_async_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[int, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def _get_async_executor() -> ThreadPoolExecutor:
+    """获取异步接口共用的线程池，阻塞的 HTTP 请求在其中执行"""
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="kimi-async")
+        return _async_executor
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """获取对冲请求使用的线程池"""
+    global _hedge_executor
+    with _async_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="kimi-hedge")
+        return _hedge_executor
+
+
+def _get_async_semaphore(max_concurrency: int) -> asyncio.Semaphore:
+    """获取当前事件循环中指定并发上限的共享信号量"""
+    loop = asyncio.get_running_loop()
+    # 不同线程中的事件循环可能同时访问
+    with _async_executor_lock:
+        semaphores = _async_semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(max_concurrency)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            semaphores[max_concurrency] = semaphore
+    return semaphore
+
+
+# 进程内共享的客户端，按 API 密钥和构造参数区分
+_shared_clients: Dict[Tuple[Any, ...], "KimiClient"] = {}
+_shared_clients_lock = threading.Lock()
 
 
 class KimiClient:
-    """通用的 Kimi API 调用工具类"""
+    """
+    通用的 Kimi API 调用工具类
     
-    def __init__(self, api_key: Optional[str] = None):
+    线程安全：每次请求的模型、消息和请求体都在调用内部确定，不修改实例状态，
+    同一个实例可以在多个线程 / 协程中并发使用（见 get_client）。
+    set_model 等配置方法应在共享前调用。
+    """
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pool_connections: Optional[int] = None,
+        pool_maxsize: Optional[int] = None,
+        reuse_connections: bool = True,
+        max_concurrency: Optional[int] = None,
+        cache: Optional[KimiResponseCache] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        rate_limiter: Optional[KimiRateLimiter] = None,
+        policy: Optional[KimiRequestPolicy] = None,
+        metrics: Optional[KimiMetrics] = None,
+        image_preprocessor: Optional[KimiImagePreprocessor] = None,
+        token_estimator: Optional[KimiTokenEstimator] = None,
+        auto_model_tier: Optional[bool] = None,
+        single_flight: Optional[KimiSingleFlight] = None,
+        base_url: Optional[str] = None,
+        transport: Optional[KimiTransport] = None,
+        upload_images: Optional[bool] = None,
+        file_cache: Optional[KimiFileCache] = None,
+        context_caching: Optional[bool] = None,
+        context_cache: Optional[KimiContextCache] = None,
+        context_cache_min_tokens: Optional[int] = None,
+        api_keys: Optional[List[str]] = None,
+        base_urls: Optional[List[str]] = None,
+        endpoint_pool: Optional[KimiEndpointPool] = None
+    ):
         """
         初始化 Kimi API 客户端
         
         Args:
             api_key: Kimi API 密钥，如果不提供则从环境变量 KIMI_API_KEY 读取
+            pool_connections: 共享连接池数量（可选），见 get_shared_session
+            pool_maxsize: 每个连接池的最大连接数（可选），见 get_shared_session
+            reuse_connections: 是否复用进程内共享的 keep-alive 连接，
+                为 False 时每次请求都新建连接（旧行为）
+            max_concurrency: 异步接口（achat 等）的最大并发请求数，
+                默认读取环境变量 KIMI_MAX_CONCURRENCY 或 8；相同上限的客户端共享同一个信号量
+            cache: 磁盘响应缓存（可选）。不提供时，若环境变量 KIMI_RESPONSE_CACHE=1
+                则使用进程内共享的默认缓存，否则不缓存
+            rpm: 每分钟最大请求数（可选），默认读取环境变量 KIMI_RPM，不设置则不限制
+            tpm: 每分钟最大 token 数（可选），默认读取环境变量 KIMI_TPM，不设置则不限制
+            rate_limiter: 自定义限流器（可选），默认使用按 API 密钥共享的进程级限流器；
+                使用多个密钥时每个密钥使用自己的进程级限流器
+            policy: 超时、重试与对冲策略（可选），默认使用 KimiRequestPolicy()（读取 KIMI_* 环境变量）
+            metrics: 调用指标（可选），默认使用进程内共享的指标；每次调用的排队、连接、首字节、总耗时、
+                字节数和 token 数计入 metrics 的直方图
+            image_preprocessor: 图片预处理器（可选），上传前缩小并重新编码图片。
+                不提供时，若设置了环境变量 KIMI_IMAGE_MAX_EDGE 则使用默认配置的预处理器
+            token_estimator: 请求 token 预估器（可选），用于选择上下文档位和限流预算
+            auto_model_tier: 是否按预估 token 数自动选择 8k / 32k / 128k 档位，
+                默认读取环境变量 KIMI_AUTO_MODEL_TIER（默认开启）；关闭时保持 self.model 的档位
+            single_flight: 进行中请求的合并器（可选）。不提供时，除非环境变量 KIMI_SINGLE_FLIGHT=0，
+                否则每个客户端使用自己的合并器
+            base_url: API 地址（可选），默认读取环境变量 KIMI_BASE_URL 或 https://api.moonshot.cn/v1，
+                可指向本地模拟服务（见 kimi_mock_server）
+            transport: HTTP 传输层（可选），默认使用基于 requests 和共享会话的 RequestsTransport；
+                设置了环境变量 KIMI_CASSETTE 时外层套上录制 / 回放传输层（见 kimi_cassette）
+            upload_images: 是否先通过 files 接口上传图片、在消息中以 ms://<file_id> 引用，
+                默认读取环境变量 KIMI_UPLOAD_IMAGES（默认关闭，图片以 base64 内联）
+            file_cache: 文件 ID 缓存（可选），开启 upload_images 时默认使用进程内共享的默认缓存
+            context_caching: 是否把开头的系统消息（静态前缀）放入 Moonshot 上下文缓存、以缓存 ID 引用，
+                默认读取环境变量 KIMI_CONTEXT_CACHE（默认关闭）
+            context_cache: 上下文缓存 ID 登记表（可选），开启 context_caching 时默认使用进程内共享的登记表
+            context_cache_min_tokens: 前缀预估 token 数低于该值时不使用上下文缓存，
+                默认读取环境变量 KIMI_CONTEXT_CACHE_MIN_TOKENS 或 0
+            api_keys: 多个 API 密钥（可选），请求分配给负载最低的健康密钥，
+                未传入 api_key 时默认读取环境变量 KIMI_API_KEYS（逗号分隔）
+            base_urls: 多个 API 地址（可选），未传入 base_url 时默认读取环境变量 KIMI_BASE_URLS（逗号分隔）；
+                与 api_keys 长度相同时一一对应，其中一个只有一项时与另一个的每一项组合
+            endpoint_pool: 自定义成员池（可选），提供时忽略 api_key / api_keys / base_url / base_urls
         """
-        self.api_key = api_key or os.getenv("KIMI_API_KEY")
-        if not self.api_key:
-            raise ValueError("API key is required. Please provide api_key or set KIMI_API_KEY environment variable.")
+        # 成员池：单个密钥和地址时只有一个成员，行为与之前相同
+        if endpoint_pool is None:
+            if api_keys is None and not api_key:
+                api_keys = [key.strip() for key in os.getenv("KIMI_API_KEYS", "").split(",") if key.strip()] or None
+            if base_urls is None and not base_url:
+                base_urls = [url.strip() for url in os.getenv("KIMI_BASE_URLS", "").split(",") if url.strip()] or None
+            api_keys = api_keys or [api_key or os.getenv("KIMI_API_KEY")]
+            base_urls = base_urls or [base_url or os.getenv("KIMI_BASE_URL") or "https://api.moonshot.cn/v1"]
+            if not all(api_keys):
+                raise ValueError("API key is required. Please provide api_key or set KIMI_API_KEY environment variable.")
+            if len(api_keys) == 1 and len(base_urls) == 1:
+                # 进程级限流器：同一 API 密钥的所有客户端共享 RPM / TPM 配额
+                endpoint_pool = KimiEndpointPool([
+                    KimiEndpoint(api_keys[0], base_urls[0], rate_limiter=rate_limiter, rpm=rpm, tpm=tpm)
+                ])
+            else:
+                endpoint_pool = KimiEndpointPool.from_config(api_keys, base_urls, rpm=rpm, tpm=tpm)
+        self.endpoint_pool = endpoint_pool
         
-        self.base_url = "https://api.moonshot.cn/v1"
+        # 第一个成员的配置，供单密钥场景和旧代码使用
+        primary = endpoint_pool.endpoints[0]
+        self.api_key = primary.api_key
+        self.base_url = primary.base_url
+        self.headers = primary.headers
+        self.rate_limiter = primary.rate_limiter
         self.model = "moonshot-v1-8k"  # 默认使用 8k 版本
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        
+        # HTTP 会话：默认使用进程内共享的连接池
+        self.reuse_connections = reuse_connections
+        self.session = get_shared_session(pool_connections, pool_maxsize) if reuse_connections else None
+        if transport is None:
+            transport = RequestsTransport(self.session)
+            transport = cassette_from_env(transport) or transport
+        self.transport = transport
+        
+        # 异步接口的并发上限
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("KIMI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        self.max_concurrency = max_concurrency
+        
+        # 响应缓存（可选）
+        if cache is None and os.getenv("KIMI_RESPONSE_CACHE", "").lower() in ("1", "true", "yes"):
+            cache = get_default_cache()
+        self.cache = cache
+        
+        # 超时 / 重试 / 对冲策略与调用指标
+        self.policy = policy or KimiRequestPolicy()
+        self.metrics = metrics or get_default_metrics()
+        
+        # 设置了 KIMI_METRICS_PORT 时在本机导出 Prometheus / JSON 指标（每个端口只启动一次）
+        metrics_port = os.getenv("KIMI_METRICS_PORT")
+        if metrics_port:
+            try:
+                start_metrics_server(int(metrics_port), metrics=self.metrics)
+            except OSError as e:
+                print(f"Kimi 指标导出服务启动失败: {str(e)}")
+        
+        # 图片预处理（可选）
+        if image_preprocessor is None and os.getenv("KIMI_IMAGE_MAX_EDGE"):
+            image_preprocessor = KimiImagePreprocessor()
+        self.image_preprocessor = image_preprocessor
+        
+        # 请求前的 token 预估与上下文档位选择
+        if auto_model_tier is None:
+            auto_model_tier = os.getenv("KIMI_AUTO_MODEL_TIER", "1").lower() in ("1", "true", "yes")
+        self.token_estimator = token_estimator or KimiTokenEstimator()
+        self.auto_model_tier = auto_model_tier
+        
+        # 合并同时进行的相同请求
+        if single_flight is None and os.getenv("KIMI_SINGLE_FLIGHT", "1").lower() in ("1", "true", "yes"):
+            single_flight = KimiSingleFlight()
+        self.single_flight = single_flight
+        
+        # 图片上传一次、按文件 ID 引用（可选）
+        if upload_images is None:
+            upload_images = os.getenv("KIMI_UPLOAD_IMAGES", "").lower() in ("1", "true", "yes")
+        if upload_images and file_cache is None:
+            file_cache = get_default_file_cache()
+        self.upload_images = upload_images
+        self.file_cache = file_cache
+        # 同一张图片同时被多个请求引用时只上传一次
+        self._upload_flight = KimiSingleFlight()
+        
+        # 静态前缀的上下文缓存（可选）
+        if context_caching is None:
+            context_caching = os.getenv("KIMI_CONTEXT_CACHE", "").lower() in ("1", "true", "yes")
+        if context_caching and context_cache is None:
+            context_cache = get_default_context_cache()
+        if context_cache_min_tokens is None:
+            context_cache_min_tokens = int(os.getenv("KIMI_CONTEXT_CACHE_MIN_TOKENS", 0))
+        self.context_caching = context_caching
+        self.context_cache = context_cache
+        self.context_cache_min_tokens = context_cache_min_tokens
+        # 同一前缀同时被多个请求使用时只创建一次缓存
+        self._context_cache_flight = KimiSingleFlight()
     
     def set_model(self, model: str):
         """
@@ -40,6 +329,9 @@ class KimiClient:
                 - moonshot-v1-128k (支持 128k 上下文)
                 - moonshot-v1-8k-vision-preview (支持视觉功能 8k)
                 - moonshot-v1-32k-vision-preview (支持视觉功能 32k)
+                
+        注意: 对 moonshot-v1 系列，每次请求会在此基础上选择视觉版本和上下文档位（见 _resolve_model），
+        不会修改 self.model。
         """
         self.model = model
     
@@ -53,18 +345,7 @@ class KimiClient:
         Returns:
             base64 编码的 data URL 格式字符串
         """
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        
-        # 获取图片扩展名（去掉点号）
-        ext = os.path.splitext(image_path)[1][1:].lower()
-        # 如果是 jpg，转换为 jpeg
-        if ext == 'jpg':
-            ext = 'jpeg'
-        
-        # 编码为 base64 并构建 data URL
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-        return f"data:image/{ext};base64,{base64_image}"
+        return self._image_source_from_path(image_path).to_data_url()
     
     def normalize_base64_image(self, image_input: str) -> str:
         """
@@ -78,13 +359,76 @@ class KimiClient:
         Returns:
             data URL 格式的字符串
         """
-        # 如果已经是 data URL 格式，直接返回
-        if image_input.startswith('data:image'):
-            return image_input
+        if self.image_preprocessor is None:
+            # 如果已经是 data URL 格式，直接返回
+            if image_input.startswith('data:image'):
+                return image_input
+            
+            # 如果是纯 base64 字符串，添加默认的 data URL 前缀
+            # 默认使用 png 格式
+            return f"data:image/png;base64,{image_input}"
+        
+        return self._image_source_from_base64(image_input).to_data_url()
+    
+    def _image_source_from_path(self, image_path: str) -> ImageSource:
+        """
+        根据图片文件创建延迟编码的 ImageSource（内部方法）
         
-        # 如果是纯 base64 字符串，添加默认的 data URL 前缀
-        # 默认使用 png 格式
-        return f"data:image/png;base64,{image_input}"
+        未启用预处理时只记录路径，发送请求时才分块读取和编码；
+        启用预处理时读取并处理图片，直接引用处理后的字节。
+        
+        Args:
+            image_path: 图片文件路径
+            
+        Returns:
+            ImageSource 实例
+        """
+        source = ImageSource.from_path(image_path)
+        if self.image_preprocessor is None:
+            return source
+        image_data, ext = self._preprocess_image(source.read_bytes(), source.fmt)
+        return ImageSource.from_bytes(image_data, ext)
+    
+    def _image_source_from_base64(self, image_input: str) -> ImageSource:
+        """
+        根据 base64 字符串或 data URL 创建 ImageSource（内部方法）
+        
+        Args:
+            image_input: data URL 或纯 base64 字符串（默认按 png 处理）
+            
+        Returns:
+            ImageSource 实例
+        """
+        source = ImageSource.from_base64(image_input)
+        if self.image_preprocessor is None:
+            return source
+        # 解码后预处理
+        image_data, ext = self._preprocess_image(source.read_bytes(), source.fmt)
+        return ImageSource.from_bytes(image_data, ext)
+    
+    def _preprocess_image(self, image_data: bytes, ext: str) -> Tuple[bytes, str]:
+        """
+        使用图片预处理器处理图片，处理的图片数和节省的字节数计入调用指标（内部方法）
+        
+        Args:
+            image_data: 原始图片字节
+            ext: 原始图片格式
+            
+        Returns:
+            (处理后的图片字节, 格式名)
+        """
+        try:
+            processed, fmt, stats = self.image_preprocessor.process(image_data)
+        except Exception as e:
+            # 无法识别的图片按原样上传
+            print(f"图片预处理失败，按原图上传: {str(e)}")
+            return image_data, ext
+        
+        # 每张图片都会经过预处理，批量任务中逐张输出日志过于频繁，只计入调用指标
+        self.metrics.incr("images_preprocessed")
+        if stats["saved_bytes"] > 0:
+            self.metrics.incr("image_bytes_saved", stats["saved_bytes"])
+        return processed, fmt
     
     def chat(
         self,
@@ -94,6 +438,8 @@ class KimiClient:
         system_prompt: Optional[str] = None,
         temperature: float = 0.3,
         max_tokens: int = 4000,
+        use_cache: bool = True,
+        extra_messages: Optional[List[Dict[str, Any]]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -106,7 +452,10 @@ class KimiClient:
             system_prompt: 系统提示词，定义 AI 的角色和行为（可选）
             temperature: 温度参数，控制输出随机性 (0-1)，越低越确定
             max_tokens: 最大生成 token 数
-            **kwargs: 其他 API 参数（如 top_p, n 等）
+            use_cache: 是否使用响应缓存（仅在配置了 cache 时生效），为 False 时跳过缓存读写；
+                同时控制是否与进行中的相同请求合并（single_flight）
+            extra_messages: 追加在用户消息之后的对话（可选），如上一轮的回复和针对它的追问
+            **kwargs: 其他 API 参数（如 top_p, n, response_format 等）
             
         Returns:
             包含完整响应信息的字典:
@@ -117,6 +466,110 @@ class KimiClient:
                 "model": str  # 使用的模型
             }
         """
+        messages = self._build_messages(prompt, image_paths, image_base64_list, system_prompt)
+        if extra_messages:
+            messages.extend(extra_messages)
+        kwargs["model"] = self._resolve_model(messages, max_tokens, kwargs.get("model"))
+        
+        # 查询响应缓存：键由模型、消息（含图片内容）和采样参数决定
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(self._build_payload(messages, temperature, max_tokens, **kwargs))
+            response = self.cache.get(cache_key)
+            if response is not None:
+                print(f"命中 Kimi 响应缓存: {cache_key[:12]}")
+                return self._build_chat_result(response)
+        
+        def call():
+            # 调用 API
+            response = self._call_api(messages, temperature, max_tokens, **kwargs)
+            
+            if cache_key is not None:
+                self.cache.set(cache_key, response)
+            return response
+        
+        if self.single_flight is None or not use_cache:
+            return self._build_chat_result(call())
+        
+        # 相同的请求正在进行时等待其结果，不重复发送
+        flight_key = cache_key
+        if flight_key is None:
+            flight_key = KimiResponseCache.make_key(self._build_payload(messages, temperature, max_tokens, **kwargs))
+        response, shared = self.single_flight.do(flight_key, call)
+        if shared:
+            self.metrics.incr("deduplicated")
+            print(f"合并进行中的相同 Kimi 请求: {flight_key[:12]}")
+        return self._build_chat_result(response)
+    
+    def _build_chat_result(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        将 API 响应整理为 chat 的返回值（内部方法）
+        
+        Args:
+            response: API 响应结果
+            
+        Returns:
+            {"content", "raw_response", "usage", "model"}
+        """
+        # 提取内容
+        content = self._extract_content(response)
+        
+        return {
+            "content": content,
+            "raw_response": response,
+            "usage": response.get("usage", {}),
+            "model": response.get("model", self.model)
+        }
+    
+    def chat_stream(
+        self,
+        prompt: str,
+        image_paths: Optional[Union[str, List[str]]] = None,
+        image_base64_list: Optional[Union[str, List[str]]] = None,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> "KimiStreamResponse":
+        """
+        流式调用 Kimi API，逐段返回生成的内容
+        
+        参数与 chat 相同。返回的 KimiStreamResponse 可直接迭代得到内容增量，
+        调用方可以在拿到所需内容后提前 close()，不必等待完整响应。
+        
+        Returns:
+            KimiStreamResponse 流式响应对象
+            
+        示例:
+            stream = client.chat_stream("请描述这张图片", image_paths="a.png")
+            for delta in stream:
+                print(delta, end="")
+            print(stream.usage)
+        """
+        messages = self._build_messages(prompt, image_paths, image_base64_list, system_prompt)
+        kwargs["model"] = self._resolve_model(messages, max_tokens, kwargs.get("model"))
+        chunks = self._call_api_stream(messages, temperature, max_tokens, **kwargs)
+        return KimiStreamResponse(chunks, model=kwargs["model"])
+    
+    def _build_messages(
+        self,
+        prompt: str,
+        image_paths: Optional[Union[str, List[str]]] = None,
+        image_base64_list: Optional[Union[str, List[str]]] = None,
+        system_prompt: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        构建请求消息列表（内部方法，chat 与 achat 共用）
+        
+        Args:
+            prompt: 用户提示词
+            image_paths: 图片路径或路径列表
+            image_base64_list: 图片 base64 编码或编码列表
+            system_prompt: 系统提示词
+            
+        Returns:
+            消息列表
+        """
         # 构建消息列表
         messages = []
         
@@ -131,18 +584,16 @@ class KimiClient:
         user_content = []
         
         # 处理图片输入（支持文件路径和 base64 两种方式）
-        has_images = False
-        
         # 处理文件路径方式的图片
         if image_paths:
-            has_images = True
             # 统一处理为列表
             if isinstance(image_paths, str):
                 image_paths = [image_paths]
             
             # 添加所有图片
+            # 图片以 ImageSource 形式放入消息，发送时才分块编码
             for image_path in image_paths:
-                image_url = self.encode_image(image_path)
+                image_url = self._image_source_from_path(image_path)
                 user_content.append({
                     "type": "image_url",
                     "image_url": {
@@ -152,14 +603,13 @@ class KimiClient:
         
         # 处理 base64 方式的图片
         if image_base64_list:
-            has_images = True
             # 统一处理为列表
             if isinstance(image_base64_list, str):
                 image_base64_list = [image_base64_list]
             
             # 添加所有 base64 图片
             for base64_img in image_base64_list:
-                image_url = self.normalize_base64_image(base64_img)
+                image_url = self._image_source_from_base64(base64_img)
                 user_content.append({
                     "type": "image_url",
                     "image_url": {
@@ -167,18 +617,6 @@ class KimiClient:
                     }
                 })
         
-        # 如果有图片，检查是否需要使用视觉模型
-        if has_images and 'vision' not in self.model:
-            # 自动切换到视觉模型
-            original_model = self.model
-            if '128k' in self.model:
-                self.model = "moonshot-v1-128k-vision-preview"
-            elif '32k' in self.model:
-                self.model = "moonshot-v1-32k-vision-preview"
-            else:
-                self.model = "moonshot-v1-8k-vision-preview"
-            print(f"检测到图片输入，已自动切换模型: {original_model} -> {self.model}")
-        
         # 添加文本提示词
         user_content.append({
             "type": "text",
@@ -191,18 +629,7 @@ class KimiClient:
             "content": user_content
         })
         
-        # 调用 API
-        response = self._call_api(messages, temperature, max_tokens, **kwargs)
-        
-        # 提取内容
-        content = self._extract_content(response)
-        
-        return {
-            "content": content,
-            "raw_response": response,
-            "usage": response.get("usage", {}),
-            "model": response.get("model", self.model)
-        }
+        return messages
     
     def chat_text_only(
         self,
@@ -362,6 +789,162 @@ class KimiClient:
             **kwargs
         )
     
+    async def achat(
+        self,
+        prompt: str,
+        image_paths: Optional[Union[str, List[str]]] = None,
+        image_base64_list: Optional[Union[str, List[str]]] = None,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        chat 的异步版本，可在 ComfyUI 的 async execute 节点中直接 await
+        
+        消息构建与 chat 完全一致；阻塞的 HTTP 请求放到共享线程池中执行，
+        并通过信号量限制同时进行的请求数（见 max_concurrency）。
+        
+        Args:
+            与 chat 相同
+            
+        Returns:
+            与 chat 相同的响应字典
+        """
+        return await self.arun(
+            self.chat,
+            prompt=prompt,
+            image_paths=image_paths,
+            image_base64_list=image_base64_list,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
+    async def arun(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在异步接口的共享线程池中执行阻塞调用，并受 max_concurrency 信号量限制
+        
+        用于把基于 KimiClient 的同步流程（如流式提取）接入事件循环。
+        
+        Args:
+            func: 阻塞的可调用对象
+            *args, **kwargs: 传给 func 的参数
+            
+        Returns:
+            func 的返回值
+        """
+        async with _get_async_semaphore(self.max_concurrency):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _get_async_executor(),
+                functools.partial(func, *args, **kwargs)
+            )
+    
+    async def achat_text_only(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        chat_text_only 的异步版本
+        """
+        return await self.achat(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
+    async def aanalyze_image(
+        self,
+        image_path: str,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        analyze_image 的异步版本
+        """
+        return await self.achat(
+            prompt=prompt,
+            image_paths=image_path,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
+    async def aanalyze_image_base64(
+        self,
+        image_base64: str,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        analyze_image_base64 的异步版本
+        """
+        return await self.achat(
+            prompt=prompt,
+            image_base64_list=image_base64,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
+    async def aanalyze_images(
+        self,
+        image_paths: List[str],
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        analyze_images 的异步版本
+        """
+        return await self.achat(
+            prompt=prompt,
+            image_paths=image_paths,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
+    async def aanalyze_images_base64(
+        self,
+        image_base64_list: List[str],
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        analyze_images_base64 的异步版本
+        """
+        return await self.achat(
+            prompt=prompt,
+            image_base64_list=image_base64_list,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+    
     def _call_api(
         self, 
         messages: List[Dict],
@@ -381,20 +964,584 @@ class KimiClient:
         Returns:
             API 响应结果
         """
-        url = f"{self.base_url}/chat/completions"
+        start = time.monotonic()
+        payload = self._build_payload(messages, temperature, max_tokens, **kwargs)
+        estimate = self._estimate_request(payload)
+        estimated_tokens = estimate["total_tokens"]
+        endpoint, probe_token = self.endpoint_pool.select(estimated_tokens)
+        try:
+            response = self._post_with_references(payload, estimated_tokens, endpoint=endpoint)
+            
+            # 响应体较大（长表格）时 orjson 解析明显更快
+            try:
+                result = kimi_json.loads(response.content)
+            except BaseException:
+                # 响应体损坏或被截断时拿不到 usage，退回预留的预算，避免限流器被持续占用
+                endpoint.rate_limiter.settle(estimated_tokens, 0)
+                raise
+        finally:
+            self.endpoint_pool.release(endpoint, probe_token)
+        usage = result.get("usage", {})
+        endpoint.rate_limiter.settle(estimated_tokens, usage.get("total_tokens"))
+        self._record_call(payload, estimate, response, usage, time.monotonic() - start, len(response.content))
+        return result
+    
+    def _call_api_stream(
+        self,
+        messages: List[Dict],
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        以流式（SSE）方式调用 Kimi API（内部方法）
         
-        payload = {
+        Args:
+            messages: 消息列表
+            temperature: 温度参数
+            max_tokens: 最大 token 数
+            **kwargs: 其他 API 参数
+            
+        Yields:
+            每个 SSE 事件解析后的数据块（chat.completion.chunk）
+        """
+        start = time.monotonic()
+        payload = self._build_payload(messages, temperature, max_tokens, stream=True, **kwargs)
+        estimate = self._estimate_request(payload)
+        estimated_tokens = estimate["total_tokens"]
+        endpoint, probe_token = self.endpoint_pool.select(estimated_tokens)
+        response = None
+        usage = {}
+        received_bytes = 0
+        try:
+            response = self._post_with_references(payload, estimated_tokens, stream=True, endpoint=endpoint)
+            for line in response.iter_lines(decode_unicode=False):
+                received_bytes += len(line) + 1
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                chunk = kimi_json.loads(data)
+                for choice in chunk.get("choices", []):
+                    if choice.get("usage"):
+                        usage = choice["usage"]
+                yield chunk
+        finally:
+            # 调用方提前停止读取时也要释放连接；未拿到 usage 时保留预估值
+            if response is not None:
+                response.close()
+                endpoint.rate_limiter.settle(estimated_tokens, usage.get("total_tokens"))
+                self._record_call(payload, estimate, response, usage, time.monotonic() - start, received_bytes)
+            self.endpoint_pool.release(endpoint, probe_token)
+    
+    def _estimate_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        预估一次请求消耗的 token 数（内部方法，用于 TPM 预算和调用指标）
+        
+        文本、图片（按尺寸）和最大生成数由 token_estimator 预估；响应返回后会用实际 usage 修正。
+        
+        Args:
+            payload: 请求体
+            
+        Returns:
+            token_estimator.estimate 的结果，total_tokens 为预估总数
+        """
+        return self.token_estimator.estimate(payload.get("messages", []), payload.get("max_tokens", 0))
+    
+    def _record_call(
+        self,
+        payload: Dict[str, Any],
+        estimate: Dict[str, Any],
+        response: requests.Response,
+        usage: Dict[str, Any],
+        total: float,
+        response_bytes: int
+    ):
+        """
+        记录一次调用的耗时、字节数和 token 数（内部方法）
+        
+        排队、连接、首字节耗时和请求体大小来自最后一次（成功的）尝试，见 _post_chat_completions / _send。
+        
+        Args:
+            payload: 请求体
+            estimate: 请求前的 token 预估
+            response: 响应对象
+            usage: 响应中的 usage
+            total: 调用总耗时（秒）
+            response_bytes: 响应体字节数
+        """
+        timing = getattr(response, "kimi_timing", None)
+        if not isinstance(timing, dict):
+            timing = {}
+        record = {
+            "model": payload.get("model"),
+            "stream": bool(payload.get("stream")),
+            "attempts": timing.get("attempts", 1),
+            "queue_wait": timing.get("queue_wait"),
+            "connect": timing.get("connect"),
+            "ttfb": timing.get("ttfb"),
+            "total": total,
+            "request_bytes": timing.get("request_bytes"),
+            "response_bytes": response_bytes,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "image_tokens": estimate.get("image_tokens")
+        }
+        self.metrics.record_request(record)
+        
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+        
+        request_kb = "-" if record["request_bytes"] is None else f"{record['request_bytes'] / 1024:.1f}KB"
+        print(
+            f"Kimi 调用耗时: 排队 {ms(record['queue_wait'])}，连接 {ms(record['connect'])}，"
+            f"首字节 {ms(record['ttfb'])}，总计 {ms(total)}；请求体 {request_kb}，"
+            f"token 提示 {record['prompt_tokens']} / 生成 {record['completion_tokens']} / 图片约 {record['image_tokens']}"
+        )
+    
+    def _resolve_model(
+        self,
+        messages: List[Dict],
+        max_tokens: int,
+        model: Optional[str] = None
+    ) -> str:
+        """
+        为单次请求确定模型（内部方法），不修改 self.model
+        
+        预估文本、图片和最大生成 token 数；有图片时使用视觉模型，
+        开启 auto_model_tier 时选择能容纳请求的最小上下文档位。显式传入 model 时直接使用。
+        
+        Args:
+            messages: 消息列表
+            max_tokens: 最大生成 token 数
+            model: 调用方显式指定的模型（可选）
+            
+        Returns:
+            本次请求使用的模型名称
+        """
+        estimate = self.token_estimator.estimate(messages, max_tokens)
+        if model is None:
+            model = self.token_estimator.select_model(self.model, estimate, self.auto_model_tier)
+        print(
+            f"Kimi 请求预估 token: 文本 {estimate['text_tokens']} + "
+            f"图片 {estimate['image_tokens']}（{estimate['image_count']} 张） + "
+            f"最大生成 {estimate['max_tokens']} = {estimate['total_tokens']}，使用模型 {model}"
+        )
+        return model
+    
+    def _build_payload(
+        self,
+        messages: List[Dict],
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        构建 chat/completions 请求体（内部方法）
+        """
+        return {
             "model": self.model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
             **kwargs  # 支持传入其他参数
         }
+    
+    def upload_file(self, image: ImageSource, purpose: str = "image", endpoint: Optional[KimiEndpoint] = None) -> str:
+        """
+        通过 files 接口上传图片
         
-        response = requests.post(url, headers=self.headers, json=payload)
+        Args:
+            image: 图片来源
+            purpose: 文件用途，图片为 "image"
+            endpoint: 上传到的成员（可选），默认第一个成员；文件 ID 只在该账号下有效
+            
+        Returns:
+            文件 ID，可在消息中以 ms://<file_id> 引用
+        """
+        endpoint = endpoint or self.endpoint_pool.endpoints[0]
+        files = {"file": (f"image.{image.fmt}", image.read_bytes(), f"image/{image.fmt}")}
+        response = self.transport.upload(
+            f"{endpoint.base_url}/files",
+            headers={"Authorization": f"Bearer {endpoint.api_key}"},
+            files=files,
+            data={"purpose": purpose},
+            timeout=self.policy.timeout()
+        )
         response.raise_for_status()
+        self.metrics.incr("uploads")
+        return response.json()["id"]
+    
+    def _image_file_id(self, image: ImageSource, endpoint: KimiEndpoint) -> Tuple[Optional[str], str]:
+        """
+        获取图片在指定成员账号下的文件 ID，未缓存时上传（内部方法）
         
-        return response.json()
+        Args:
+            image: 图片来源
+            endpoint: 发送请求的成员
+            
+        Returns:
+            (文件 ID, 缓存键)；上传失败时文件 ID 为 None，调用方改为内联 base64
+        """
+        key = self.file_cache.make_key(endpoint.namespace, image.digest())
+        file_id = self.file_cache.get(key)
+        if file_id is not None:
+            return file_id, key
+        
+        def upload():
+            # 等待期间可能已被其他线程上传
+            cached = self.file_cache.get(key)
+            if cached is not None:
+                return cached
+            uploaded = self.upload_file(image, endpoint=endpoint)
+            self.file_cache.set(key, uploaded)
+            print(f"已上传图片 {image.digest()[:12]}（{image.encoded_length() / 1024:.1f}KB）-> {uploaded}")
+            return uploaded
+        
+        try:
+            file_id, _ = self._upload_flight.do(key, upload)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"图片上传失败，改为内联 base64: {str(e)}")
+            return None, key
+        return file_id, key
+    
+    def _reference_uploaded_images(self, messages: List[Dict], endpoint: KimiEndpoint) -> Tuple[List[Dict], List[str]]:
+        """
+        把消息中的图片替换为 ms://<file_id> 引用（内部方法，不修改原消息）
+        
+        Args:
+            messages: 消息列表
+            endpoint: 发送请求的成员
+            
+        Returns:
+            (替换后的消息列表, 使用的文件 ID 缓存键)
+        """
+        keys = []
+        result = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                result.append(message)
+                continue
+            parts = []
+            for part in content or []:
+                image = part.get("image_url", {}).get("url") if part.get("type") == "image_url" else None
+                if isinstance(image, ImageSource):
+                    file_id, key = self._image_file_id(image, endpoint)
+                    if file_id is not None:
+                        keys.append(key)
+                        part = {**part, "image_url": {**part["image_url"], "url": f"ms://{file_id}"}}
+                parts.append(part)
+            result.append({**message, "content": parts})
+        return result, keys
+    
+    def create_context_cache(
+        self,
+        messages: List[Dict],
+        ttl: Optional[float] = None,
+        endpoint: Optional[KimiEndpoint] = None
+    ) -> str:
+        """
+        通过 caching 接口为消息前缀创建上下文缓存
+        
+        Args:
+            messages: 要缓存的前缀消息（通常是系统提示词）
+            ttl: 缓存有效期（秒），默认使用 context_cache 的设置
+            endpoint: 创建缓存的成员（可选），默认第一个成员；缓存 ID 只在该账号下有效
+            
+        Returns:
+            缓存 ID，可在消息中以 {"role": "cache", "content": "cache_id=<id>"} 引用
+        """
+        endpoint = endpoint or self.endpoint_pool.endpoints[0]
+        if ttl is None:
+            ttl = self.context_cache.ttl if self.context_cache is not None else 3600
+        body = kimi_json.dumps_bytes({
+            # 上下文缓存按模型系列创建，可被同系列的 8k / 32k / 128k 模型引用
+            "model": "moonshot-v1",
+            "messages": messages,
+            "ttl": int(ttl)
+        })
+        response = self.transport.post(
+            f"{endpoint.base_url}/caching",
+            headers=endpoint.headers,
+            data=body,
+            stream=False,
+            timeout=self.policy.timeout()
+        )
+        response.raise_for_status()
+        self.metrics.incr("context_caches")
+        return kimi_json.loads(response.content)["id"]
+    
+    def _reference_context_cache(self, messages: List[Dict], endpoint: KimiEndpoint) -> Tuple[List[Dict], Optional[str]]:
+        """
+        把开头的系统消息替换为上下文缓存引用，未缓存时先创建（内部方法，不修改原消息）
+        
+        Args:
+            messages: 消息列表
+            endpoint: 发送请求的成员
+            
+        Returns:
+            (替换后的消息列表, 使用的登记表缓存键)；未使用上下文缓存时缓存键为 None
+        """
+        prefix = []
+        for message in messages:
+            if message.get("role") != "system" or not isinstance(message.get("content"), str):
+                break
+            prefix.append(message)
+        if not prefix or len(prefix) == len(messages):
+            return messages, None
+        prefix_tokens = sum(self.token_estimator.estimate_text(message["content"]) for message in prefix)
+        if prefix_tokens < self.context_cache_min_tokens:
+            return messages, None
+        
+        key = self.context_cache.make_key(endpoint.namespace, prefix)
+        cache_id = self.context_cache.get(key)
+        if cache_id is None:
+            if self.context_cache.failed_recently(key):
+                return messages, None
+            
+            def create():
+                # 等待期间可能已被其他线程创建
+                cached = self.context_cache.get(key)
+                if cached is not None:
+                    return cached
+                created = self.create_context_cache(prefix, endpoint=endpoint)
+                self.context_cache.set(key, created)
+                print(f"已创建 Kimi 上下文缓存 {key[-12:]}（约 {prefix_tokens} token）-> {created}")
+                return created
+            
+            try:
+                cache_id, _ = self._context_cache_flight.do(key, create)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                self.context_cache.set(key, None)
+                print(f"创建上下文缓存失败，改为直接发送系统提示词: {str(e)}")
+                return messages, None
+        
+        self.metrics.incr("context_cache_hits")
+        cache_message = {"role": "cache", "content": f"cache_id={cache_id};reset_ttl={int(self.context_cache.ttl)}"}
+        return [cache_message] + messages[len(prefix):], key
+    
+    def _post_with_references(
+        self,
+        payload: Dict[str, Any],
+        estimated_tokens: int = 0,
+        stream: bool = False,
+        endpoint: Optional[KimiEndpoint] = None
+    ) -> requests.Response:
+        """
+        发送请求，按配置以文件 ID 引用图片、以上下文缓存引用静态前缀（内部方法）
+        
+        图片只在第一次使用时上传，之后的请求（包括重试、对冲，以及 HTML / JSON 两种提取）只发送引用；
+        开启 context_caching 时，相同的系统提示词前缀只在创建缓存时发送一次。
+        服务端不再识别引用（400 / 404）时清除对应的文件 ID / 缓存 ID，本次改为内联内容重新发送。
+        文件 ID 和缓存 ID 只在创建它们的账号下有效，因此按成员分别上传 / 创建。
+        """
+        endpoint = endpoint or self.endpoint_pool.endpoints[0]
+        messages = payload["messages"]
+        keys = []
+        cache_key = None
+        if self.upload_images:
+            messages, keys = self._reference_uploaded_images(messages, endpoint)
+        if self.context_caching:
+            messages, cache_key = self._reference_context_cache(messages, endpoint)
+        if not keys and cache_key is None:
+            return self._post_chat_completions(payload, estimated_tokens, stream, endpoint=endpoint)
+        
+        try:
+            return self._post_chat_completions(
+                {**payload, "messages": messages}, estimated_tokens, stream, endpoint=endpoint
+            )
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (400, 404):
+                raise
+            for key in keys:
+                self.file_cache.delete(key)
+            if cache_key is not None:
+                self.context_cache.delete(cache_key)
+            print(f"文件 / 缓存引用被拒绝（HTTP {e.response.status_code}），已清除缓存的 ID 并改为内联发送")
+            return self._post_chat_completions(payload, estimated_tokens, stream, endpoint=endpoint)
+    
+    def _post_chat_completions(
+        self,
+        payload: Dict[str, Any],
+        estimated_tokens: int = 0,
+        stream: bool = False,
+        endpoint: Optional[KimiEndpoint] = None
+    ) -> requests.Response:
+        """
+        按请求策略发送 chat/completions 请求（内部方法）
+        
+        每次尝试前先向成员的限流器申请 RPM / TPM 配额；连接错误、超时以及 429 / 5xx 按策略指数退避重试，
+        429 会按 Retry-After 暂停限流器后重新排队；超过整体截止时间或重试次数后抛出最后一次的错误。
+        没有得到成功响应的尝试（包括抛出其他异常的尝试）退回预留的 TPM 预算，避免出错时预算被持续占用。
+        每次尝试的结果计入成员的熔断器（429 与其他客户端错误不计为成员故障）。
+        
+        Args:
+            payload: 请求体
+            estimated_tokens: 预估 token 数（用于 TPM 预算）
+            stream: 是否以流式方式读取响应体
+            endpoint: 发送请求的成员（可选），默认第一个成员
+            
+        Returns:
+            requests 响应对象
+        """
+        endpoint = endpoint or self.endpoint_pool.endpoints[0]
+        url = f"{endpoint.base_url}/chat/completions"
+        policy = self.policy
+        deadline = time.monotonic() + policy.deadline if policy.deadline and policy.deadline > 0 else None
+        
+        attempt = 0
+        queue_wait = 0.0
+        while True:
+            queue_wait += endpoint.rate_limiter.acquire(estimated_tokens)
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            
+            response = None
+            error = None
+            try:
+                response = self._send_with_hedge(
+                    url, payload, stream, policy.timeout(remaining), estimated_tokens, endpoint
+                )
+            except requests.Timeout as e:
+                self.metrics.incr("timeouts")
+                error = e
+            except requests.ConnectionError as e:
+                self.metrics.incr("connection_errors")
+                error = e
+            except BaseException:
+                endpoint.rate_limiter.settle(estimated_tokens, 0)
+                raise
+            
+            if response is None:
+                self.endpoint_pool.record(endpoint, False)
+            elif response.status_code != 429:
+                self.endpoint_pool.record(endpoint, response.status_code < 500 and response.status_code not in (401, 403))
+            
+            if response is not None and response.status_code < 400:
+                response.kimi_timing = {**response.kimi_timing, "queue_wait": queue_wait, "attempts": attempt + 1}
+                return response
+            
+            # 失败的尝试不作为最终结果，退回本次预留的预算
+            endpoint.rate_limiter.settle(estimated_tokens, 0)
+            
+            retry_after = None
+            if response is not None:
+                retryable = policy.should_retry_status(response.status_code)
+                if response.status_code == 429:
+                    self.metrics.incr("throttled")
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            else:
+                retryable = True
+            
+            delay = policy.backoff(attempt, retry_after)
+            out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+            if not retryable or attempt >= policy.max_retries or out_of_time:
+                self.metrics.incr("failures")
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+            
+            reason = f"HTTP {response.status_code}" if response is not None else type(error).__name__
+            print(f"Kimi API 请求失败（{reason}），{delay:.1f} 秒后重试（第 {attempt + 1} 次）")
+            self.metrics.incr("retries")
+            if response is not None:
+                response.close()
+            if response is not None and response.status_code == 429:
+                # 暂停限流器，让所有排队的调用方一起等待
+                endpoint.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+    
+    def _send(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        stream: bool,
+        timeout: Tuple[float, float],
+        headers: Optional[Dict[str, str]] = None
+    ) -> requests.Response:
+        """
+        发送一次 HTTP 请求并记录耗时（内部方法）
+        
+        请求体以 StreamingJSONPayload 分块写出，图片的 base64 编码边发送边生成，
+        不会在内存中拼出完整的 JSON 字符串。
+        """
+        self.metrics.incr("requests")
+        body = StreamingJSONPayload(payload)
+        start = time.monotonic()
+        response = self.transport.post(url, headers=headers or self.headers, data=body, stream=stream, timeout=timeout)
+        elapsed = time.monotonic() - start
+        if response.status_code < 400 and not stream:
+            # 只统计完整响应的耗时，作为对冲阈值的依据
+            self.metrics.observe_latency(elapsed)
+        
+        # 传输层未提供首字节耗时时：流式请求返回时只读取了响应头，耗时即首字节耗时
+        timing = getattr(response, "kimi_timing", None)
+        timing = dict(timing) if isinstance(timing, dict) else {}
+        timing["request_bytes"] = len(body)
+        if timing.get("ttfb") is None and stream:
+            timing["ttfb"] = elapsed
+        response.kimi_timing = timing
+        return response
+    
+    def _send_with_hedge(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        stream: bool,
+        timeout: Tuple[float, float],
+        estimated_tokens: int = 0,
+        endpoint: Optional[KimiEndpoint] = None
+    ) -> requests.Response:
+        """
+        发送请求，必要时发送对冲请求（内部方法）
+        
+        主请求超过对冲阈值仍未返回时，再向同一成员发送一个相同的请求，使用先成功返回的结果，
+        另一个请求返回后直接关闭，其预留的 TPM 预算退回。流式请求不做对冲。
+        """
+        endpoint = endpoint or self.endpoint_pool.endpoints[0]
+        delay = self.policy.hedge_delay(
+            self.metrics.latency_percentile(self.policy.hedge_percentile),
+            self.metrics.latency_samples
+        )
+        if delay is None or stream:
+            return self._send(url, payload, stream, timeout, endpoint.headers)
+        
+        executor = _get_hedge_executor()
+        primary = executor.submit(self._send, url, payload, stream, timeout, endpoint.headers)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        
+        # 对冲请求同样占用 RPM / TPM 配额
+        endpoint.rate_limiter.acquire(estimated_tokens)
+        self.metrics.incr("hedges")
+        hedge = executor.submit(self._send, url, payload, stream, timeout, endpoint.headers)
+        
+        pending = {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 400:
+                    winner = future
+                    break
+        
+        # 只有一个请求作为结果返回（两个都失败时交给重试逻辑处理主请求的结果），
+        # 另一个请求的预算退回，响应返回后关闭以释放连接
+        endpoint.rate_limiter.settle(estimated_tokens, 0)
+        if winner is None:
+            winner = primary
+        elif winner is hedge:
+            self.metrics.incr("hedge_wins")
+        for future in (primary, hedge):
+            if future is not winner:
+                future.add_done_callback(
+                    lambda f: f.exception() is None and f.result().close()
+                )
+        return winner.result()
     
     def _extract_content(self, response: Dict[str, Any]) -> str:
         """
@@ -411,6 +1558,106 @@ class KimiClient:
         return ""
 
 
+class KimiStreamResponse:
+    """
+    流式响应对象
+    
+    迭代时逐段返回内容增量，同时累积完整内容、token 使用情况和结束原因。
+    """
+    
+    def __init__(self, chunks: Iterator[Dict[str, Any]], model: str):
+        """
+        Args:
+            chunks: _call_api_stream 返回的数据块迭代器
+            model: 请求使用的模型
+        """
+        self._chunks = chunks
+        self.model = model
+        self.content = ""
+        self.usage: Dict[str, Any] = {}
+        self.finish_reason: Optional[str] = None
+    
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            self.model = chunk.get("model", self.model)
+            if chunk.get("usage"):
+                self.usage = chunk["usage"]
+            for choice in chunk.get("choices", []):
+                # Moonshot 在最后一个数据块的 choice 中附带 usage
+                if choice.get("usage"):
+                    self.usage = choice["usage"]
+                if choice.get("finish_reason"):
+                    self.finish_reason = choice["finish_reason"]
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    self.content += delta
+                    yield delta
+    
+    def close(self):
+        """提前结束读取并释放底层连接"""
+        self._chunks.close()
+    
+    def to_result(self) -> Dict[str, Any]:
+        """
+        转换为与 chat 返回值相同结构的字典
+        
+        Returns:
+            {"content", "raw_response", "usage", "model"}，raw_response 为根据流式数据拼装的完整响应
+        """
+        return {
+            "content": self.content,
+            "raw_response": {
+                "model": self.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.content},
+                    "finish_reason": self.finish_reason
+                }],
+                "usage": self.usage
+            },
+            "usage": self.usage,
+            "model": self.model
+        }
+
+
+def _registry_value(value: Any) -> Any:
+    """把 get_client 的参数值转换为可哈希的区分键：可哈希的值（包括按对象区分的实例）原样使用，列表 / 字典等使用 repr"""
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def get_client(api_key: Optional[str] = None, **kwargs) -> KimiClient:
+    """
+    获取指定 API 密钥对应的进程级共享客户端
+    
+    同一密钥且 kwargs（KimiClient 构造参数）相同的调用方（如并发执行的 ComfyUI 节点）共用一个已预热的客户端；
+    kwargs 不同时创建另一个客户端，不会拿到按其他配置创建的客户端（连接池仍由 get_shared_session 共享）。
+    
+    Args:
+        api_key: Kimi API 密钥，如果不提供则从环境变量 KIMI_API_KEYS（多个密钥）或 KIMI_API_KEY 读取
+        **kwargs: 传给 KimiClient 的其他参数，作为共享客户端的区分键之一
+        
+    Returns:
+        KimiClient 实例
+    """
+    # 未传入密钥时，配置了 KIMI_API_KEYS 的进程共享一个多密钥客户端
+    shared_key = api_key or os.getenv("KIMI_API_KEYS") or os.getenv("KIMI_API_KEY")
+    if not shared_key:
+        raise ValueError("API key is required. Please provide api_key or set KIMI_API_KEY environment variable.")
+    registry_key = (shared_key,) + tuple(
+        (name, _registry_value(value)) for name, value in sorted(kwargs.items())
+    )
+    with _shared_clients_lock:
+        client = _shared_clients.get(registry_key)
+        if client is None:
+            client = KimiClient(api_key=api_key, **kwargs)
+            _shared_clients[registry_key] = client
+        return client
+
+
 # 使用示例
 if __name__ == "__main__":
     # 尝试加载 .env 文件中的环境变量
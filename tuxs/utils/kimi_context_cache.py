@@ -0,0 +1,156 @@
+"""
+Kimi 上下文缓存 ID 登记表
+记录静态提示词前缀（系统提示词、JSON 模板、提取规则）在 Moonshot 上下文缓存中对应的缓存 ID，
+相同前缀的请求只需发送缓存引用，不再重复传输和处理前缀
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List
+
+
+# 缓存有效期（秒），可通过环境变量 KIMI_CONTEXT_CACHE_TTL 覆盖；每次引用时服务端会重置有效期
+DEFAULT_CONTEXT_CACHE_TTL = 3600
+
+# 创建失败的前缀在这段时间内不再尝试创建缓存（秒）
+DEFAULT_FAILURE_TTL = 300
+
+
+class KimiContextCache:
+    """线程安全的上下文缓存 ID 登记表（进程内，按账号和前缀内容哈希区分）"""
+    
+    def __init__(self, ttl: Optional[float] = None, failure_ttl: float = DEFAULT_FAILURE_TTL):
+        """
+        初始化登记表
+        
+        Args:
+            ttl: 缓存有效期（秒），默认读取环境变量 KIMI_CONTEXT_CACHE_TTL 或 1 小时；
+                创建缓存和每次引用时都以此值重置服务端的有效期
+            failure_ttl: 创建失败后多久内不再重试（秒）
+        """
+        if ttl is None:
+            ttl = float(os.getenv("KIMI_CONTEXT_CACHE_TTL", DEFAULT_CONTEXT_CACHE_TTL))
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.hits = 0
+        self.misses = 0
+        
+        self._lock = threading.Lock()
+        # key -> (缓存 ID，创建失败时为 None, 本地过期时间)
+        self._entries: Dict[str, tuple] = {}
+    
+    @staticmethod
+    def make_key(namespace: str, messages: List[Dict[str, Any]]) -> str:
+        """
+        计算前缀的缓存键
+        
+        前缀按 JSON 规范化后取 SHA-256，只要系统提示词和模板逐字节相同就得到相同的键；
+        缓存只在创建它的账号和 API 地址下有效，因此键包含 namespace 的哈希。
+        
+        Args:
+            namespace: 账号标识，如 API 密钥 + base_url
+            messages: 前缀消息列表
+            
+        Returns:
+            缓存键
+        """
+        account = hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:16]
+        prefix = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return f"{account}:{hashlib.sha256(prefix.encode('utf-8')).hexdigest()}"
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存 ID，过期的条目视为未命中并删除
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            缓存 ID，未命中或最近创建失败时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None or entry[0] is None:
+                self.misses += 1
+                return None
+            # 每次引用都会重置服务端有效期，本地同步延长
+            self._entries[key] = (entry[0], time.time() + self.ttl)
+            self.hits += 1
+            return entry[0]
+    
+    def failed_recently(self, key: str) -> bool:
+        """
+        该前缀最近是否创建失败（失败期间直接内联发送前缀）
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            是否处于失败冷却期
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] is None and entry[1] > time.time()
+    
+    def set(self, key: str, cache_id: Optional[str]):
+        """
+        记录缓存 ID
+        
+        Args:
+            key: 缓存键
+            cache_id: 服务端返回的缓存 ID；为 None 表示创建失败，failure_ttl 内不再重试
+        """
+        ttl = self.ttl if cache_id is not None else self.failure_ttl
+        with self._lock:
+            self._entries[key] = (cache_id, time.time() + ttl)
+    
+    def delete(self, key: str):
+        """
+        删除缓存 ID（例如服务端已不再识别该缓存）
+        
+        Args:
+            key: 缓存键
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取登记表统计信息
+        
+        Returns:
+            {"hits", "misses", "entries", "ttl"}
+        """
+        with self._lock:
+            now = time.time()
+            entries = sum(1 for cache_id, expires in self._entries.values() if cache_id is not None and expires > now)
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "ttl": self.ttl
+            }
+
+
+# 进程内共享的默认登记表
+_default_context_cache: Optional[KimiContextCache] = None
+_default_context_cache_lock = threading.Lock()
+
+
+def get_default_context_cache() -> KimiContextCache:
+    """
+    获取进程内共享的默认上下文缓存登记表（有效期由环境变量决定）
+    
+    Returns:
+        KimiContextCache 实例
+    """
+    global _default_context_cache
+    with _default_context_cache_lock:
+        if _default_context_cache is None:
+            _default_context_cache = KimiContextCache()
+        return _default_context_cache
@@ -0,0 +1,261 @@
+"""
+Kimi 多密钥 / 多地址负载均衡
+把请求分配给负载最低的健康成员（API 密钥 + 地址），每个成员使用自己的 RPM / TPM 限流器，
+连续失败的成员由熔断器暂时移出轮换
+"""
+import os
+import sys
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_rate_limiter import KimiRateLimiter, get_rate_limiter
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_rate_limiter import KimiRateLimiter, get_rate_limiter
+
+
+DEFAULT_BASE_URL = "https://api.moonshot.cn/v1"
+
+# 熔断器默认配置，可通过环境变量 KIMI_CIRCUIT_FAILURES / KIMI_CIRCUIT_COOLDOWN 覆盖
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+
+
+class KimiEndpoint:
+    """负载均衡池中的一个成员：API 密钥、地址、限流器以及熔断状态"""
+    
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        rate_limiter: Optional[KimiRateLimiter] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None
+    ):
+        """
+        初始化成员
+        
+        Args:
+            api_key: Kimi API 密钥
+            base_url: API 地址，默认 https://api.moonshot.cn/v1
+            rate_limiter: 限流器（可选），默认使用按 API 密钥共享的进程级限流器
+            rpm: 每分钟最大请求数（可选），见 get_rate_limiter
+            tpm: 每分钟最大 token 数（可选），见 get_rate_limiter
+        """
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self.rate_limiter = rate_limiter or get_rate_limiter(api_key, rpm=rpm, tpm=tpm)
+        
+        # 以下状态由 KimiEndpointPool 在锁内维护
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        # 当前探测请求的令牌，只有持有该令牌的调用在 release 时结束探测
+        self.probe_token = 0
+        self.last_used = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.circuit_opens = 0
+    
+    @property
+    def namespace(self) -> str:
+        """账号标识（文件 ID 和上下文缓存只在创建它们的账号和地址下有效）"""
+        return f"{self.api_key}@{self.base_url}"
+    
+    @property
+    def name(self) -> str:
+        """用于日志的名称，不包含完整密钥"""
+        digest = hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()[:8]
+        return f"{digest}@{self.base_url}"
+
+
+class KimiEndpointPool:
+    """
+    线程安全的成员池
+    
+    - select(): 选择负载最低的健康成员（限流等待时间最短、进行中请求最少），半开状态下同时返回探测令牌
+    - release(): 请求结束后归还进行中计数，持有探测令牌的调用同时结束探测
+    - record(): 记录一次尝试的结果，连续失败达到阈值时熔断，冷却后放行一个探测请求
+    """
+    
+    def __init__(
+        self,
+        endpoints: List[KimiEndpoint],
+        failure_threshold: Optional[int] = None,
+        cooldown: Optional[float] = None
+    ):
+        """
+        初始化成员池
+        
+        Args:
+            endpoints: 成员列表（至少一个）
+            failure_threshold: 连续失败多少次后熔断，默认读取环境变量 KIMI_CIRCUIT_FAILURES 或 5
+            cooldown: 熔断后多少秒再放行探测请求，默认读取环境变量 KIMI_CIRCUIT_COOLDOWN 或 30
+        """
+        if not endpoints:
+            raise ValueError("KimiEndpointPool requires at least one endpoint.")
+        if failure_threshold is None:
+            failure_threshold = int(os.getenv("KIMI_CIRCUIT_FAILURES", DEFAULT_FAILURE_THRESHOLD))
+        if cooldown is None:
+            cooldown = float(os.getenv("KIMI_CIRCUIT_COOLDOWN", DEFAULT_COOLDOWN))
+        
+        self.endpoints = list(endpoints)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(
+        cls,
+        api_keys: List[str],
+        base_urls: Optional[List[str]] = None,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        **kwargs
+    ) -> "KimiEndpointPool":
+        """
+        由密钥列表和地址列表创建成员池
+        
+        两个列表长度相同时一一对应；其中一个只有一项时与另一个的每一项组合。
+        
+        Args:
+            api_keys: API 密钥列表
+            base_urls: API 地址列表（可选），默认 https://api.moonshot.cn/v1
+            rpm: 每个密钥的每分钟最大请求数（可选）
+            tpm: 每个密钥的每分钟最大 token 数（可选）
+            **kwargs: 传给 KimiEndpointPool 的其他参数
+            
+        Returns:
+            KimiEndpointPool 实例
+        """
+        base_urls = base_urls or [DEFAULT_BASE_URL]
+        if len(api_keys) == len(base_urls):
+            pairs = list(zip(api_keys, base_urls))
+        elif len(api_keys) == 1:
+            pairs = [(api_keys[0], url) for url in base_urls]
+        elif len(base_urls) == 1:
+            pairs = [(key, base_urls[0]) for key in api_keys]
+        else:
+            raise ValueError("api_keys and base_urls must have the same length, or one of them must have a single item.")
+        return cls([KimiEndpoint(key, url, rpm=rpm, tpm=tpm) for key, url in pairs], **kwargs)
+    
+    def _available(self, endpoint: KimiEndpoint, now: float) -> bool:
+        """成员是否可以接收请求（熔断关闭，或冷却结束且没有进行中的探测）"""
+        if endpoint.open_until == 0.0:
+            return True
+        return now >= endpoint.open_until and not endpoint.probing
+    
+    def select(self, estimated_tokens: int = 0) -> Tuple[KimiEndpoint, Optional[int]]:
+        """
+        选择负载最低的健康成员，并计入一个进行中请求（不占用限流配额）
+        
+        按 (限流预估等待秒数, 进行中请求数, 最近使用时间) 排序；所有成员都在熔断中时选择最早结束冷却的成员。
+        
+        Args:
+            estimated_tokens: 本次请求预估消耗的 token 数
+            
+        Returns:
+            (选中的成员, 探测令牌)：本次请求是半开状态的探测请求时返回令牌，否则为 None；
+            请求结束后需调用 release(成员, 探测令牌)；限流配额由调用方在每次尝试前申请
+        """
+        # 限流器有自己的锁，先在池锁外读取等待时间
+        waits = {id(endpoint): endpoint.rate_limiter.estimate_wait(estimated_tokens) for endpoint in self.endpoints}
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if self._available(endpoint, now)]
+            if candidates:
+                endpoint = min(
+                    candidates,
+                    key=lambda e: (round(waits[id(e)], 1), e.in_flight, e.last_used)
+                )
+            else:
+                endpoint = min(self.endpoints, key=lambda e: e.open_until)
+                if len(self.endpoints) > 1:
+                    print(f"Kimi 所有成员都在熔断中，仍尝试 {endpoint.name}")
+            probe_token = None
+            if endpoint.open_until and now >= endpoint.open_until:
+                # 冷却结束：半开状态，只放行这一个探测请求
+                endpoint.probing = True
+                endpoint.probe_token += 1
+                probe_token = endpoint.probe_token
+            endpoint.in_flight += 1
+            endpoint.last_used = now
+            return endpoint, probe_token
+    
+    def release(self, endpoint: KimiEndpoint, probe_token: Optional[int] = None):
+        """
+        请求结束（响应读取完毕或失败）后归还进行中计数
+        
+        Args:
+            endpoint: select 返回的成员
+            probe_token: select 返回的探测令牌
+        """
+        with self._lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            # 探测请求未记录结果就结束（如调用方提前关闭流）时，允许下一个请求继续探测；
+            # 其他请求结束时不影响进行中的探测
+            if probe_token is not None and probe_token == endpoint.probe_token:
+                endpoint.probing = False
+    
+    def record(self, endpoint: KimiEndpoint, success: bool):
+        """
+        记录一次尝试的结果
+        
+        成功时关闭熔断并清零连续失败数；失败（连接错误、超时、5xx、401 / 403）累计到阈值，
+        或半开状态的探测失败时熔断 cooldown 秒。
+        
+        Args:
+            endpoint: 发送请求的成员
+            success: 是否成功
+        """
+        with self._lock:
+            endpoint.total_requests += 1
+            probing = endpoint.probing
+            endpoint.probing = False
+            if success:
+                endpoint.consecutive_failures = 0
+                endpoint.open_until = 0.0
+                return
+            endpoint.total_failures += 1
+            endpoint.consecutive_failures += 1
+            if probing or endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                endpoint.circuit_opens += 1
+                print(
+                    f"Kimi 成员 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，"
+                    f"熔断 {self.cooldown:g} 秒"
+                )
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        获取每个成员的状态
+        
+        Returns:
+            [{"name", "in_flight", "requests", "failures", "circuit_open", "circuit_opens", "rate_limiter"}]
+        """
+        with self._lock:
+            now = time.monotonic()
+            result = [{
+                "name": endpoint.name,
+                "in_flight": endpoint.in_flight,
+                "requests": endpoint.total_requests,
+                "failures": endpoint.total_failures,
+                "circuit_open": endpoint.open_until > now,
+                "circuit_opens": endpoint.circuit_opens
+            } for endpoint in self.endpoints]
+        for item, endpoint in zip(result, self.endpoints):
+            item["rate_limiter"] = endpoint.rate_limiter.stats()
+        return result
+    
+    def __len__(self) -> int:
+        return len(self.endpoints)
@@ -0,0 +1,160 @@
+"""
+Kimi 文件 ID 缓存
+记录已通过 files 接口上传的图片（按内容哈希）对应的文件 ID，同一张图片只上传一次
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Dict, Any
+
+
+# 默认有效期，可通过环境变量 KIMI_FILE_CACHE_TTL 覆盖
+DEFAULT_FILE_CACHE_TTL = 24 * 3600  # 1 天
+
+
+class KimiFileCache:
+    """基于 SQLite 的文件 ID 缓存（按账号和图片内容哈希区分）"""
+    
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None):
+        """
+        初始化文件 ID 缓存
+        
+        Args:
+            path: SQLite 数据库文件路径，默认为 KIMI_CACHE_DIR（或 ~/.cache/tuxs）下的 kimi_file_cache.sqlite3；
+                传入 ":memory:" 时只在进程内有效
+            ttl: 文件 ID 有效期（秒），过期后重新上传，默认读取环境变量 KIMI_FILE_CACHE_TTL 或 1 天；
+                <= 0 表示永不过期
+        """
+        if path is None:
+            cache_dir = os.getenv("KIMI_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "tuxs")
+            path = os.path.join(cache_dir, "kimi_file_cache.sqlite3")
+        if ttl is None:
+            ttl = float(os.getenv("KIMI_FILE_CACHE_TTL", DEFAULT_FILE_CACHE_TTL))
+        
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            if path != ":memory:":
+                # WAL 模式允许多个 ComfyUI 进程同时读写
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "key TEXT PRIMARY KEY, "
+                "file_id TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+    
+    @staticmethod
+    def make_key(namespace: str, digest: str) -> str:
+        """
+        计算缓存键
+        
+        文件 ID 只在上传它的账号和 API 地址下有效，因此键包含 namespace（由 API 密钥和地址派生，不保存明文密钥）。
+        
+        Args:
+            namespace: 账号标识，如 API 密钥 + base_url
+            digest: 图片内容的 SHA-256
+            
+        Returns:
+            缓存键
+        """
+        account = hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:16]
+        return f"{account}:{digest}"
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取文件 ID，过期的条目视为未命中并删除
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            文件 ID，未命中时返回 None
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT file_id, created_at FROM files WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl > 0 and time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM files WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+    
+    def set(self, key: str, file_id: str):
+        """
+        写入文件 ID
+        
+        Args:
+            key: 缓存键
+            file_id: 上传后返回的文件 ID
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (key, file_id, created_at) VALUES (?, ?, ?)",
+                (key, file_id, time.time())
+            )
+            if self.ttl > 0:
+                self._conn.execute("DELETE FROM files WHERE created_at < ?", (time.time() - self.ttl,))
+    
+    def delete(self, key: str):
+        """
+        删除文件 ID（例如服务端已不再识别该文件）
+        
+        Args:
+            key: 缓存键
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE key = ?", (key,))
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+        
+        Returns:
+            {"hits", "misses", "entries", "ttl", "path"}
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "ttl": self.ttl,
+                "path": self.path
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+# 进程内共享的默认文件 ID 缓存
+_default_file_cache: Optional[KimiFileCache] = None
+_default_file_cache_lock = threading.Lock()
+
+
+def get_default_file_cache() -> KimiFileCache:
+    """
+    获取进程内共享的默认文件 ID 缓存（路径和有效期由环境变量决定）
+    
+    Returns:
+        KimiFileCache 实例
+    """
+    global _default_file_cache
+    with _default_file_cache_lock:
+        if _default_file_cache is None:
+            _default_file_cache = KimiFileCache()
+        return _default_file_cache
@@ -0,0 +1,123 @@
+"""
+Kimi 视觉请求的图片预处理
+在 base64 编码上传前缩小图片尺寸、可选转为灰度或调色板，并重新编码为体积最小的可接受格式
+"""
+import io
+import os
+from typing import Optional, Dict, Any, Tuple, Iterable
+
+from PIL import Image, features
+
+
+class KimiImagePreprocessor:
+    """上传前的图片预处理器"""
+    
+    def __init__(
+        self,
+        max_long_edge: Optional[int] = None,
+        color_mode: Optional[str] = None,
+        formats: Iterable[str] = ("png", "webp", "jpeg"),
+        quality: int = 85,
+        quality_floor: int = 70,
+        upload_bandwidth: Optional[float] = None
+    ):
+        """
+        初始化预处理器
+        
+        Args:
+            max_long_edge: 长边最大像素数，超过时等比缩小；默认读取环境变量 KIMI_IMAGE_MAX_EDGE 或 1600，
+                <= 0 表示不缩放
+            color_mode: 颜色转换方式（可选）:
+                - None: 保持原样
+                - "grayscale": 转为灰度
+                - "palette": 转为 256 色调色板（仅对 PNG / WebP 有效，JPEG 候选会转回 RGB）
+            formats: 参与比较的输出格式，按体积最小者选用（png / webp / jpeg）
+            quality: 有损格式（WebP / JPEG）使用的质量
+            quality_floor: 有损格式允许的最低质量，quality 低于该值时按该值编码
+            upload_bandwidth: 用于估算上传耗时的带宽（字节/秒），默认读取环境变量
+                KIMI_UPLOAD_BANDWIDTH 或 1MB/s
+        """
+        if max_long_edge is None:
+            max_long_edge = int(os.getenv("KIMI_IMAGE_MAX_EDGE", 1600))
+        if upload_bandwidth is None:
+            upload_bandwidth = float(os.getenv("KIMI_UPLOAD_BANDWIDTH", 1024 * 1024))
+        if color_mode not in (None, "grayscale", "palette"):
+            raise ValueError(f"不支持的 color_mode: {color_mode}")
+        
+        self.max_long_edge = max_long_edge
+        self.color_mode = color_mode
+        self.formats = [fmt.lower() for fmt in formats if fmt.lower() != "webp" or features.check("webp")]
+        self.quality = max(quality, quality_floor)
+        self.upload_bandwidth = upload_bandwidth
+    
+    def process(self, data: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+        """
+        预处理图片字节
+        
+        Args:
+            data: 原始图片字节
+            
+        Returns:
+            (处理后的图片字节, 格式名如 "png" / "webp" / "jpeg", 统计信息字典)
+            若重新编码后没有变小且无需缩放，则原样返回原始字节
+        """
+        with Image.open(io.BytesIO(data)) as image:
+            original_format = (image.format or "png").lower()
+            original_size = image.size
+            image.load()
+            
+            resized = False
+            if self.max_long_edge and self.max_long_edge > 0 and max(image.size) > self.max_long_edge:
+                image = image.copy()
+                image.thumbnail((self.max_long_edge, self.max_long_edge), Image.LANCZOS)
+                resized = True
+            
+            image = self._convert_color(image)
+            candidates = [(fmt, self._encode(image, fmt)) for fmt in self.formats]
+        
+        best_format, best_data = min(candidates, key=lambda item: len(item[1]))
+        if not resized and self.color_mode is None and len(best_data) >= len(data):
+            best_format, best_data = original_format, data
+        
+        saved = len(data) - len(best_data)
+        stats = {
+            "original_bytes": len(data),
+            "processed_bytes": len(best_data),
+            "saved_bytes": saved,
+            "original_size": original_size,
+            "processed_size": image.size,
+            "original_format": original_format,
+            "processed_format": best_format,
+            # base64 会让上传体积增加约 1/3
+            "estimated_upload_seconds_saved": saved * 4 / 3 / self.upload_bandwidth
+        }
+        return best_data, best_format, stats
+    
+    def _convert_color(self, image: Image.Image) -> Image.Image:
+        """按 color_mode 转换颜色，并把不常见的模式统一为 RGB / RGBA"""
+        if self.color_mode == "grayscale":
+            return image.convert("LA" if "A" in image.getbands() else "L")
+        if self.color_mode == "palette":
+            return image.convert("RGB").quantize(colors=256)
+        if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            return image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        return image
+    
+    def _encode(self, image: Image.Image, fmt: str) -> bytes:
+        """把图片编码为指定格式"""
+        buffer = io.BytesIO()
+        if fmt == "png":
+            image.save(buffer, format="PNG", optimize=True)
+        elif fmt == "webp":
+            image.save(buffer, format="WEBP", quality=self.quality, method=6)
+        elif fmt == "jpeg":
+            # JPEG 不支持透明通道和调色板，透明部分按白色背景合成
+            if image.mode in ("RGBA", "LA", "P"):
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            image.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+        else:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        return buffer.getvalue()
@@ -0,0 +1,78 @@
+"""
+Kimi 请求 / 响应使用的 JSON 编解码
+安装了 orjson 时使用 orjson，否则回退到标准库 json；两者输出格式一致（UTF-8、不转义非 ASCII 字符）
+
+设置环境变量 KIMI_JSON_CODEC=stdlib 可强制使用标准库
+"""
+import os
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.getenv("KIMI_JSON_CODEC", "").lower() == "stdlib":
+    orjson = None
+
+# 当前使用的编解码器名称
+CODEC = "orjson" if orjson is not None else "json"
+
+
+def dumps_bytes(obj: Any, indent: Optional[int] = None, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    序列化为 UTF-8 字节串
+    
+    Args:
+        obj: 要序列化的对象
+        indent: 缩进空格数，None 表示紧凑输出（orjson 只支持 2 空格缩进，其他值使用标准库）
+        default: 无法序列化的对象的转换函数
+        
+    Returns:
+        JSON 字节串
+    """
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_INDENT_2 if indent == 2 else 0
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # 非字符串键、超出 64 位的整数等 orjson 不支持的情况交给标准库处理
+            pass
+    if indent is None:
+        return json.dumps(obj, ensure_ascii=False, default=default, separators=(",", ":")).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, default=default, indent=indent).encode("utf-8")
+
+
+def dumps(obj: Any, indent: Optional[int] = None, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    序列化为字符串，参数同 dumps_bytes
+    
+    Returns:
+        JSON 字符串
+    """
+    return dumps_bytes(obj, indent=indent, default=default).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """
+    解析 JSON
+    
+    Args:
+        data: JSON 字符串或字节串
+        
+    Returns:
+        解析结果
+        
+    Raises:
+        json.JSONDecodeError: 内容不是合法的 JSON（orjson 的异常也是其子类）
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity 等标准库接受的扩展写法再交给标准库解析
+            pass
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
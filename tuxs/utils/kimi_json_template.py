@@ -0,0 +1,571 @@
+"""
+按 JSON 模板校验和修复提取结果
+- repair_json_text: 修复常见的格式问题（多余的逗号、被截断的结尾），尽量保留已完整输出的行
+- validate_against_template: 按模板的结构规整数据，能在本地修复的（缺少字段、数字写成字符串等）直接修复，
+  无法修复的行 / 字段以路径列出，由调用方只针对这些位置重新询问模型
+- expand_compact_rows: 把紧凑的表格输出（表头 + 制表符分隔的数据行）展开为模板的 JSON 结构
+- KimiRowStreamParser: 增量解析流式输出，每一行完成时立即返回
+"""
+import re
+import json
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from . import kimi_json
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils import kimi_json
+
+
+# 截断修复时最多尝试的截断位置数
+MAX_REPAIR_ATTEMPTS = 64
+
+# 路径中的下标，如 data[3]
+_PATH_TOKEN = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+
+def parse_template(json_template: Union[str, Dict, list]) -> Union[Dict, list, None]:
+    """
+    把模板转换为字典或列表
+    
+    Args:
+        json_template: JSON 模板（字符串、字典或列表）
+        
+    Returns:
+        模板对象，字符串不是合法 JSON 时返回 None（无法校验结构）
+    """
+    if isinstance(json_template, (dict, list)):
+        return json_template
+    try:
+        template = json.loads(json_template)
+    except (TypeError, ValueError):
+        return None
+    return template if isinstance(template, (dict, list)) else None
+
+
+def _can_cut(stack: list) -> bool:
+    """当前位置是否可以截断：位于数组中，或位于不属于任何数组的对象中"""
+    return not stack or stack[-1] == "]" or "]" not in stack
+
+
+def repair_json_text(text: str) -> Any:
+    """
+    解析可能有格式问题的 JSON 文本
+    
+    依次尝试：直接解析、去掉对象 / 数组结尾多余的逗号、在最后一个完整的值之后截断并补齐括号
+    （用于输出被截断的情况，已完整输出的行都会保留）。
+    
+    Args:
+        text: JSON 文本
+        
+    Returns:
+        解析结果
+        
+    Raises:
+        json.JSONDecodeError: 无法修复
+    """
+    try:
+        return kimi_json.loads(text)
+    except json.JSONDecodeError as e:
+        error = e
+    
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    try:
+        return kimi_json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    
+    # 记录每个可以安全截断的位置（逗号之前、括号闭合之后）以及此时未闭合的括号；
+    # 数组中的对象（表格的行）不在内部截断，被截断的行整行丢弃，避免补空后看起来像完整的行
+    cuts = []
+    stack = []
+    in_string = False
+    escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if _can_cut(stack):
+                cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch == "," and stack and _can_cut(stack):
+            cuts.append((i, "".join(reversed(stack))))
+    
+    for end, closing in reversed(cuts[-MAX_REPAIR_ATTEMPTS:]):
+        try:
+            return kimi_json.loads(text[:end] + closing)
+        except json.JSONDecodeError:
+            continue
+    raise error
+
+
+def _default(template: Any) -> Any:
+    """模板中某个值缺失时的默认值（与提示词约定一致：缺失的字段使用空字符串）"""
+    if isinstance(template, dict):
+        return {key: _default(value) for key, value in template.items()}
+    if isinstance(template, list):
+        return []
+    return ""
+
+
+def _conform(value: Any, template: Any, path: str, keys: list, failures: List[Dict[str, Any]]) -> Any:
+    """把 value 规整为模板的结构，无法修复的位置追加到 failures，并原样保留该位置的值"""
+    if isinstance(template, dict):
+        if not isinstance(value, dict):
+            failures.append({"path": path, "keys": keys, "reason": "应为 JSON 对象"})
+            return value
+        missing = [key for key in template if key not in value]
+        unknown = [key for key in value if key not in template]
+        if missing and unknown:
+            # 同时缺少和多出字段，通常是字段名写错或列错位，不能简单补空
+            failures.append({
+                "path": path,
+                "keys": keys,
+                "reason": f"字段名与模板不一致：缺少 {', '.join(missing)}，多出 {', '.join(unknown)}"
+            })
+            return value
+        return {
+            key: _conform(value[key], sub, f"{path}.{key}" if path else key, keys + [key], failures)
+            if key in value else _default(sub)
+            for key, sub in template.items()
+        }
+    
+    if isinstance(template, list):
+        if not isinstance(value, list):
+            failures.append({"path": path, "keys": keys, "reason": "应为 JSON 数组"})
+            return value
+        if not template:
+            return value
+        rows = []
+        for index, item in enumerate(value):
+            row_path = f"{path}[{index}]"
+            row_failures: List[Dict[str, Any]] = []
+            rows.append(_conform(item, template[0], row_path, keys + [index], row_failures))
+            if row_failures:
+                # 行内的问题按整行重新询问
+                failures.append({
+                    "path": row_path,
+                    "keys": keys + [index],
+                    "reason": "；".join(f"{f['path']}: {f['reason']}" for f in row_failures)
+                })
+                rows[-1] = item
+        return rows
+    
+    # 标量：嵌套结构无法修复，其余按模板的类型转换
+    if isinstance(value, (dict, list)):
+        failures.append({"path": path, "keys": keys, "reason": "应为单个值"})
+        return value
+    if value is None:
+        return "" if isinstance(template, str) else value
+    if isinstance(template, str) and not isinstance(value, str):
+        return json.dumps(value) if isinstance(value, bool) else str(value)
+    if isinstance(template, (int, float)) and not isinstance(template, bool) and isinstance(value, str):
+        try:
+            number = float(value.replace(",", ""))
+        except ValueError:
+            return value
+        return int(number) if isinstance(template, int) and number.is_integer() else number
+    return value
+
+
+def validate_against_template(data: Any, template: Union[Dict, list]) -> Tuple[Any, List[Dict[str, Any]]]:
+    """
+    按模板校验并修复数据
+    
+    本地修复：缺少的字段补空字符串、多出的字段删除、数字与字符串按模板的类型转换、null 转为空字符串。
+    无法修复：类型不符（对象 / 数组 / 单个值）、字段名与模板不一致，这些位置保留原值并在返回的列表中给出。
+    数组中某一行有问题时以整行为单位给出（如 data[3]）。
+    
+    Args:
+        data: 解析得到的数据
+        template: 模板（字典或列表），数组模板的第一项作为每一行的模板
+        
+    Returns:
+        (修复后的数据, 无法修复的位置列表 [{"path", "keys", "reason"}])；
+        path 为空字符串表示整体结构不符
+    """
+    failures: List[Dict[str, Any]] = []
+    repaired = _conform(data, template, "", [], failures)
+    return repaired, failures
+
+
+def parse_path(path: str) -> list:
+    """
+    把 "data[3].name" 形式的路径解析为键列表 ["data", 3, "name"]
+    
+    Args:
+        path: 路径
+        
+    Returns:
+        键列表
+    """
+    return [int(index) if index else name for name, index in _PATH_TOKEN.findall(path)]
+
+
+def template_at(template: Any, keys: list) -> Any:
+    """
+    获取路径对应的模板片段
+    
+    Args:
+        template: 完整模板
+        keys: 键列表
+        
+    Returns:
+        模板片段，路径不在模板中时返回 None
+    """
+    for key in keys:
+        if isinstance(key, int):
+            if not isinstance(template, list) or not template:
+                return None
+            template = template[0]
+        else:
+            if not isinstance(template, dict) or key not in template:
+                return None
+            template = template[key]
+    return template
+
+
+def set_at(data: Any, keys: list, value: Any) -> bool:
+    """
+    按路径替换数据中的值
+    
+    Args:
+        data: 数据
+        keys: 键列表（不能为空）
+        value: 新值
+        
+    Returns:
+        是否替换成功（路径不存在时返回 False）
+    """
+    try:
+        for key in keys[:-1]:
+            data = data[key]
+        if isinstance(keys[-1], int) and not (isinstance(data, list) and keys[-1] < len(data)):
+            return False
+        data[keys[-1]] = value
+        return True
+    except (KeyError, IndexError, TypeError):
+        return False
+
+
+def compact_layout(template: Union[Dict, list, None]) -> Optional[Dict[str, Any]]:
+    """
+    判断模板能否使用紧凑的表格输出（表头 + 分隔符分隔的数据行）
+    
+    适用于：顶层为行模板数组，或顶层对象中恰好有一个行模板数组、其余字段都是单个值；
+    行模板必须是只包含单个值的对象。
+    
+    Args:
+        template: 模板
+        
+    Returns:
+        {"rows_key": 数组字段名（顶层为数组时为 None）, "columns": 列名列表, "fields": 表格外的字段名列表}，
+        不适用时返回 None
+    """
+    if isinstance(template, list):
+        rows_key, rows, fields = None, template, []
+    elif isinstance(template, dict):
+        list_keys = [key for key, value in template.items() if isinstance(value, list)]
+        if len(list_keys) != 1:
+            return None
+        rows_key = list_keys[0]
+        rows = template[rows_key]
+        fields = [key for key in template if key != rows_key]
+        if any(isinstance(template[key], dict) for key in fields):
+            return None
+    else:
+        return None
+    
+    if not rows or not isinstance(rows[0], dict) or not rows[0]:
+        return None
+    if any(isinstance(value, (dict, list)) for value in rows[0].values()):
+        return None
+    return {"rows_key": rows_key, "columns": list(rows[0].keys()), "fields": fields}
+
+
+def _split_cells(line: str) -> List[str]:
+    """按制表符拆分一行；模型改用 Markdown 表格（| 分隔）时同样支持"""
+    if "\t" in line:
+        return [cell.strip() for cell in line.split("\t")]
+    line = line.strip()
+    if line.startswith("|") and line.endswith("|"):
+        line = line[1:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+class _CompactRowReader:
+    """逐行读取紧凑的表格输出：表格外的字段行、表头行和数据行"""
+    
+    def __init__(self, template: Union[Dict, list]):
+        self.layout = compact_layout(template)
+        self.columns = self.layout["columns"]
+        self.fields: Dict[str, str] = {}
+        self.header: Optional[List[str]] = None
+    
+    def feed_line(self, line: str) -> Any:
+        """
+        读取一行
+        
+        Args:
+            line: 一行文本（不含换行符）
+            
+        Returns:
+            数据行（以列名为键的字典；值比表头多时为原始的值列表），其他行返回 None
+        """
+        stripped = line.strip()
+        if not stripped or stripped.startswith("```"):
+            return None
+        if self.header is None and stripped.startswith("@"):
+            name, _, value = stripped[1:].partition("\t")
+            if name.strip() in self.layout["fields"]:
+                self.fields[name.strip()] = value.strip()
+                return None
+        cells = _split_cells(line)
+        if all(not cell or set(cell) <= set("-: ") for cell in cells):
+            # Markdown 表格的分隔行
+            return None
+        if self.header is None:
+            if set(cells) & set(self.columns):
+                self.header = cells
+                return None
+            self.header = self.columns
+        if len(cells) > len(self.header):
+            return cells
+        cells += [""] * (len(self.header) - len(cells))
+        return {name: value for name, value in zip(self.header, cells) if name in self.columns}
+
+
+def expand_compact_rows(text: str, template: Union[Dict, list]) -> Any:
+    """
+    把紧凑的表格输出展开为模板的 JSON 结构
+    
+    输入格式：可选的 "@字段名<TAB>值" 行（表格外的字段），然后是表头行和数据行，值用制表符分隔。
+    列按表头的列名对应，模型调整了列的顺序也能正确展开；缺少表头时按模板的列顺序对应。
+    行末的空值被省略时补空；值比表头多的行保留为原始的值列表，由模板校验报告并追问。
+    
+    Args:
+        text: 模型输出的文本
+        template: 模板（compact_layout 不为 None）
+        
+    Returns:
+        与模板结构相同的数据，没有任何可识别的内容时返回 None
+    """
+    reader = _CompactRowReader(template)
+    rows = [row for row in map(reader.feed_line, text.splitlines()) if row is not None]
+    if reader.header is None and not reader.fields:
+        return None
+    return _assemble(template, reader.layout["rows_key"], rows, reader.fields)
+
+
+def _assemble(template: Union[Dict, list], rows_key: Optional[str], rows: list, fields: Dict[str, Any]) -> Any:
+    """按模板的结构组装行和表格外的字段，缺少的字段使用默认值"""
+    if rows_key is None:
+        return rows
+    return {
+        key: rows if key == rows_key else fields.get(key, _default(sub))
+        for key, sub in template.items()
+    }
+
+
+def rows_key_of(template: Union[Dict, list, None]) -> Optional[str]:
+    """
+    获取模板中行数组所在的字段名
+    
+    Args:
+        template: 模板
+        
+    Returns:
+        顶层为数组时返回 None；顶层对象中有 "data" 数组时返回 "data"，否则返回第一个数组字段；
+        模板无法解析时按约定返回 "data"
+    """
+    if isinstance(template, list):
+        return None
+    if not isinstance(template, dict):
+        return "data"
+    list_keys = [key for key, value in template.items() if isinstance(value, list)]
+    if "data" in list_keys or not list_keys:
+        return "data"
+    return list_keys[0]
+
+
+class KimiRowStreamParser:
+    """
+    增量解析流式输出中的表格行
+    
+    每输入一段内容增量，返回其中新完成的行：JSON 输出在行对象的右括号到达时返回，
+    紧凑输出（output_format="tsv"）在行末的换行到达时返回。输出被截断时已完成的行都会保留，
+    可用 result() 组装为模板的结构。
+    
+    返回的行已按模板做本地修复（见 validate_against_template），但尚未经过追问修正，最终结果以提取结果为准。
+    """
+    
+    def __init__(self, template: Union[Dict, list, None], compact: bool = False):
+        """
+        初始化解析器
+        
+        Args:
+            template: 模板（字典、列表或无法解析时为 None）
+            compact: 是否为紧凑输出（模板须满足 compact_layout）
+        """
+        self.template = template
+        self.compact = compact
+        self.rows: List[Any] = []
+        self.rows_key = rows_key_of(template)
+        self.row_template = template_at(template, ([self.rows_key] if self.rows_key else []) + [0])
+        
+        # 紧凑输出：按行读取，_pending 为尚未收到换行的最后一行
+        self._reader = _CompactRowReader(template) if compact else None
+        self._pending = ""
+        
+        # JSON 输出：已收到的全部文本、扫描位置和括号栈
+        self._text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._rows_depth: Optional[int] = None
+        self._row_start: Optional[int] = None
+        self._closed = False
+    
+    def feed(self, text: str) -> List[Tuple[int, Any]]:
+        """
+        输入一段内容增量
+        
+        Args:
+            text: 流式返回的内容增量
+            
+        Returns:
+            新完成的行列表 [(行号, 行数据)]，行号从 0 开始
+        """
+        if self.compact:
+            lines = (self._pending + text).split("\n")
+            self._pending = lines.pop()
+            return self._emit_lines(lines)
+        
+        self._text += text
+        emitted = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            if self._closed:
+                break
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+            elif ch == '"':
+                if self._stack:
+                    self._in_string = True
+                    self._string_start = i
+            elif ch == ":" and len(self._stack) == 1:
+                self._key = self._last_string
+            elif ch == "," and len(self._stack) == 1:
+                self._key = None
+            elif ch in "{[":
+                self._stack.append(ch)
+                if self._rows_depth is None and ch == "[" and (
+                    (self.rows_key is None and len(self._stack) == 1)
+                    or (len(self._stack) == 2 and self._stack[0] == "{" and self._key == self.rows_key)
+                ):
+                    self._rows_depth = len(self._stack)
+                elif ch == "{" and self._rows_depth is not None and len(self._stack) == self._rows_depth + 1:
+                    self._row_start = i
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if self._row_start is not None and len(self._stack) == self._rows_depth:
+                    row = self._parse_row(text[self._row_start:i + 1])
+                    self._row_start = None
+                    if row is not None:
+                        emitted.append(self._emit(row))
+                if not self._stack:
+                    self._closed = True
+        self._pos = len(text)
+        return emitted
+    
+    def finish(self, complete: bool = True) -> List[Tuple[int, Any]]:
+        """
+        输出结束时调用
+        
+        Args:
+            complete: 输出是否正常结束；被截断（finish_reason 为 "length"）时紧凑输出的最后一行不完整，不返回
+            
+        Returns:
+            新完成的行列表 [(行号, 行数据)]
+        """
+        if not self.compact or not self._pending:
+            return []
+        pending, self._pending = self._pending, ""
+        return self._emit_lines([pending]) if complete else []
+    
+    def extend(self, rows: list) -> List[Tuple[int, Any]]:
+        """
+        追加从其他回复（如续写）中得到的完整行，行号接在已完成的行之后
+        
+        Args:
+            rows: 行列表
+            
+        Returns:
+            追加的行列表 [(行号, 行数据)]
+        """
+        return [self._emit(row) for row in rows]
+    
+    def result(self) -> Any:
+        """
+        把已完成的行组装为模板的结构（行以外的字段在 JSON 输出中使用默认值）
+        
+        Returns:
+            与模板结构相同的数据
+        """
+        if not isinstance(self.template, (dict, list)):
+            return {"data": list(self.rows)}
+        fields = self._reader.fields if self._reader is not None else {}
+        return _assemble(self.template, self.rows_key, list(self.rows), fields)
+    
+    def _emit_lines(self, lines: List[str]) -> List[Tuple[int, Any]]:
+        """读取紧凑输出的若干完整行"""
+        emitted = []
+        for line in lines:
+            row = self._reader.feed_line(line)
+            if row is not None:
+                emitted.append(self._emit(row))
+        return emitted
+    
+    @staticmethod
+    def _parse_row(text: str) -> Any:
+        """解析一个行对象，格式有误时尝试修复，仍无法解析时返回 None"""
+        try:
+            return repair_json_text(text)
+        except json.JSONDecodeError:
+            return None
+    
+    def _emit(self, row: Any) -> Tuple[int, Any]:
+        """按行模板做本地修复（无法修复时保留原值），记录并返回 (行号, 行数据)"""
+        if self.row_template is not None:
+            failures: List[Dict[str, Any]] = []
+            conformed = _conform(row, self.row_template, "", [], failures)
+            if not failures:
+                row = conformed
+        self.rows.append(row)
+        return len(self.rows) - 1, row
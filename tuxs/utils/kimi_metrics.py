@@ -0,0 +1,331 @@
+"""
+Kimi API 调用指标
+记录请求、重试、对冲等计数、最近的请求耗时，以及每次调用的耗时 / 字节数 / token 直方图，
+可导出为 Prometheus 文本格式或 JSON
+"""
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple
+
+
+# 直方图的桶上界
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+# 直方图名称 -> (调用记录中的字段, 桶上界, 说明)
+HISTOGRAMS: Dict[str, Tuple[str, tuple, str]] = {
+    "queue_wait_seconds": ("queue_wait", LATENCY_BUCKETS, "等待限流配额的时间"),
+    "connect_seconds": ("connect", LATENCY_BUCKETS, "新建连接（TCP + TLS）耗时，复用连接时不计入"),
+    "ttfb_seconds": ("ttfb", LATENCY_BUCKETS, "发出请求到收到响应头的时间"),
+    "total_seconds": ("total", LATENCY_BUCKETS, "一次调用的总耗时（含排队和重试）"),
+    "request_bytes": ("request_bytes", BYTES_BUCKETS, "请求体字节数"),
+    "response_bytes": ("response_bytes", BYTES_BUCKETS, "响应体字节数"),
+    "prompt_tokens": ("prompt_tokens", TOKEN_BUCKETS, "提示词 token 数（usage）"),
+    "completion_tokens": ("completion_tokens", TOKEN_BUCKETS, "生成 token 数（usage）"),
+    "image_tokens": ("image_tokens", TOKEN_BUCKETS, "图片 token 数（按图片尺寸预估）")
+}
+
+
+class _Histogram:
+    """累积桶直方图（与 Prometheus histogram 相同的语义）"""
+    
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+    
+    def cumulative(self) -> List[int]:
+        """每个桶上界对应的累积计数"""
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶上界估算分位数，超出最大桶时返回 None（即 +Inf）"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return None
+
+
+class KimiMetrics:
+    """线程安全的 Kimi API 调用指标"""
+    
+    def __init__(self, latency_window: int = 500, request_window: int = 200):
+        """
+        初始化指标
+        
+        Args:
+            latency_window: 保留最近多少次成功请求的耗时，用于计算分位数
+            request_window: 保留最近多少次调用的详细记录（见 recent_requests）
+        """
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "requests": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "throttled": 0,
+            "timeouts": 0,
+            "connection_errors": 0,
+            "failures": 0,
+            "deduplicated": 0,
+            "uploads": 0,
+            "context_caches": 0,
+            "context_cache_hits": 0,
+            "images_preprocessed": 0,
+            "image_bytes_saved": 0
+        }
+        self._latencies = deque(maxlen=latency_window)
+        # (直方图名称, 模型) -> 直方图
+        self._histograms: Dict[Tuple[str, str], _Histogram] = {}
+        self._requests = deque(maxlen=request_window)
+    
+    def incr(self, name: str, value: int = 1):
+        """
+        增加计数
+        
+        Args:
+            name: 计数名称
+            value: 增加值
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+    
+    def observe_latency(self, seconds: float):
+        """
+        记录一次成功请求的耗时
+        
+        Args:
+            seconds: 耗时秒数
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """
+        计算最近请求耗时的分位数
+        
+        Args:
+            percentile: 分位数 (0-1)
+            
+        Returns:
+            耗时秒数，无样本时返回 None
+        """
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[index]
+    
+    @property
+    def latency_samples(self) -> int:
+        """耗时样本数"""
+        with self._lock:
+            return len(self._latencies)
+    
+    def record_request(self, record: Dict[str, Any]):
+        """
+        记录一次调用的耗时、字节数和 token 数，并计入按模型区分的直方图
+        
+        Args:
+            record: 调用记录，字段见 HISTOGRAMS（queue_wait、connect、ttfb、total、request_bytes、
+                response_bytes、prompt_tokens、completion_tokens、image_tokens），另含 model 等；
+                值为 None 的字段不计入直方图
+        """
+        model = record.get("model") or "unknown"
+        with self._lock:
+            self._requests.append(dict(record))
+            for name, (field, buckets, _) in HISTOGRAMS.items():
+                value = record.get(field)
+                if value is None:
+                    continue
+                histogram = self._histograms.get((name, model))
+                if histogram is None:
+                    histogram = self._histograms[(name, model)] = _Histogram(buckets)
+                histogram.observe(value)
+    
+    def recent_requests(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取最近的调用记录
+        
+        Args:
+            limit: 最多返回多少条（最新的在最后），默认全部
+            
+        Returns:
+            调用记录列表
+        """
+        with self._lock:
+            records = list(self._requests)
+        return records[-limit:] if limit else records
+    
+    def histograms(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        获取直方图快照
+        
+        Returns:
+            {直方图名称: {模型: {"count", "sum", "mean", "p50", "p95", "buckets": {上界: 累积计数}}}}；
+            p50 / p95 按桶上界估算，超出最大桶时为 None
+        """
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (name, model), histogram in sorted(self._histograms.items()):
+                result.setdefault(name, {})[model] = {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else None,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "buckets": {str(bound): total for bound, total in zip(histogram.buckets, histogram.cumulative())}
+                }
+        return result
+    
+    def to_json(self, indent: Optional[int] = None) -> str:
+        """
+        导出计数、耗时分位数和直方图的 JSON 快照
+        
+        Args:
+            indent: 缩进空格数（可选）
+            
+        Returns:
+            JSON 字符串
+        """
+        return json.dumps({**self.snapshot(), "histograms": self.histograms()}, ensure_ascii=False, indent=indent)
+    
+    def to_prometheus(self, prefix: str = "kimi") -> str:
+        """
+        导出为 Prometheus 文本格式（计数为 <prefix>_<name>_total，直方图按 model 标签区分）
+        
+        Args:
+            prefix: 指标名前缀
+            
+        Returns:
+            Prometheus exposition 格式的文本
+        """
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = sorted(self._histograms.items())
+            for name, value in counters.items():
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            
+            described = set()
+            for (name, model), histogram in histograms:
+                metric = f"{prefix}_{name}"
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {metric} {HISTOGRAMS[name][2]}")
+                    lines.append(f"# TYPE {metric} histogram")
+                label = model.replace("\\", "\\\\").replace('"', '\\"')
+                for bound, total in zip(histogram.buckets, histogram.cumulative()):
+                    lines.append(f'{metric}_bucket{{model="{label}",le="{bound:g}"}} {total}')
+                lines.append(f'{metric}_bucket{{model="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{model="{label}"}} {histogram.sum:g}')
+                lines.append(f'{metric}_count{{model="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取当前指标快照
+        
+        Returns:
+            计数字典，附带 latency_p50 / latency_p95（秒）
+        """
+        with self._lock:
+            result: Dict[str, Any] = dict(self._counters)
+        result["latency_p50"] = self.latency_percentile(0.5)
+        result["latency_p95"] = self.latency_percentile(0.95)
+        return result
+
+
+# 进程内共享的默认指标
+_default_metrics = KimiMetrics()
+
+
+def get_default_metrics() -> KimiMetrics:
+    """
+    获取进程内共享的默认指标（所有未指定 metrics 的 KimiClient 共用）
+    
+    Returns:
+        KimiMetrics 实例
+    """
+    return _default_metrics
+
+
+# 已启动的指标导出服务，按端口区分
+_metrics_servers: Dict[int, ThreadingHTTPServer] = {}
+_metrics_servers_lock = threading.Lock()
+
+
+def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+    metrics: Optional[KimiMetrics] = None
+) -> ThreadingHTTPServer:
+    """
+    在后台线程启动指标导出服务（同一端口只启动一次）
+    
+    GET /metrics 返回 Prometheus 文本格式，GET /metrics.json 返回 JSON 快照。
+    
+    Args:
+        port: 监听端口
+        host: 监听地址，默认只监听本机
+        metrics: 导出的指标，默认进程内共享的默认指标
+        
+    Returns:
+        HTTP 服务对象
+    """
+    metrics = metrics or get_default_metrics()
+    
+    class Handler(BaseHTTPRequestHandler):
+        """指标导出请求处理"""
+        
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/metrics":
+                body = metrics.to_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body = metrics.to_json().encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    with _metrics_servers_lock:
+        server = _metrics_servers.get(port)
+        if server is None:
+            server = ThreadingHTTPServer((host, port), Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _metrics_servers[port] = server
+            print(f"Kimi 指标导出服务已启动: http://{host}:{server.server_address[1]}/metrics")
+        return server
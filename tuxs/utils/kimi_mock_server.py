@@ -0,0 +1,478 @@
+"""
+本地模拟的 Moonshot API 服务
+实现 /v1/chat/completions（含 SSE 流式响应）、/v1/files 上传和 /v1/caching 上下文缓存，支持可配置的延迟分布、429 / 5xx 故障注入和预设的表格回复，
+用于在不消耗额度的情况下离线测试、压测和分析整个提取流程
+
+命令行启动:
+    python -m tuxs.utils.kimi_mock_server --port 8765 --latency lognormal:0.0,0.5 --error-rate 0.05
+然后设置 KIMI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, Callable, Union
+
+
+# 预设的表格 JSON 回复（KimiTableToJSON）
+CANNED_TABLE_JSON = {
+    "title": "示例表格",
+    "data": [
+        {"name": "张三", "age": 28, "department": "研发部"},
+        {"name": "李四", "age": 32, "department": "市场部"},
+        {"name": "王五", "age": 25, "department": "财务部"}
+    ]
+}
+
+# 预设的紧凑表格回复（KimiTableToJSON 的 output_format="tsv"）
+CANNED_TABLE_TSV = "\n".join(
+    [f"@title\t{CANNED_TABLE_JSON['title']}", "\t".join(CANNED_TABLE_JSON["data"][0])]
+    + ["\t".join(str(value) for value in row.values()) for row in CANNED_TABLE_JSON["data"]]
+)
+
+# 预设的表格 HTML 回复（KimiTableToHTML）
+CANNED_TABLE_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+table { border-collapse: collapse; }
+th, td { border: 1px solid #333; padding: 4px 8px; }
+</style>
+</head>
+<body>
+<table>
+<tr><th>姓名</th><th>年龄</th><th>部门</th></tr>
+<tr><td>张三</td><td>28</td><td>研发部</td></tr>
+<tr><td>李四</td><td>32</td><td>市场部</td></tr>
+<tr><td>王五</td><td>25</td><td>财务部</td></tr>
+</table>
+</body>
+</html>"""
+
+
+def parse_latency(spec: Union[None, float, str, Callable[[], float]], rng: random.Random) -> Callable[[], float]:
+    """
+    解析延迟分布，返回每次调用生成一个延迟秒数的函数
+    
+    Args:
+        spec: 延迟分布:
+            - None / 0: 无延迟
+            - 数字: 固定延迟（秒）
+            - "fixed:0.5"
+            - "uniform:0.2,1.0": 均匀分布
+            - "normal:0.8,0.2": 正态分布（均值, 标准差），负值按 0 处理
+            - "lognormal:-0.5,0.6": 对数正态分布（mu, sigma），长尾延迟
+            - "exponential:0.5": 指数分布（均值）
+            - 可调用对象: 直接使用
+        rng: 随机数生成器
+        
+    Returns:
+        生成延迟秒数的函数
+    """
+    if spec is None:
+        return lambda: 0.0
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    
+    name, _, args = spec.partition(":")
+    params = [float(value) for value in args.split(",") if value.strip()]
+    if name == "fixed":
+        return lambda: params[0]
+    if name == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if name == "normal":
+        return lambda: max(0.0, rng.gauss(params[0], params[1]))
+    if name == "lognormal":
+        return lambda: rng.lognormvariate(params[0], params[1])
+    if name == "exponential":
+        return lambda: rng.expovariate(1.0 / params[0])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+class KimiMockServer:
+    """本地模拟的 Moonshot /v1/chat/completions、/v1/files 与 /v1/caching 服务"""
+    
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Union[None, float, str, Callable[[], float]] = None,
+        stream_chunk_delay: float = 0.0,
+        stream_chunk_size: int = 16,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        error_rate: float = 0.0,
+        error_statuses: tuple = (500, 502, 503),
+        responder: Optional[Callable[[Dict[str, Any]], str]] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        初始化模拟服务
+        
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            latency: 返回响应（流式时为首个数据块）前的延迟分布，见 parse_latency
+            stream_chunk_delay: 流式响应中相邻数据块的间隔秒数
+            stream_chunk_size: 流式响应中每个数据块的字符数
+            rate_limit_rate: 返回 429 的概率 (0-1)
+            retry_after: 429 响应的 Retry-After 秒数
+            error_rate: 返回 5xx 的概率 (0-1)
+            error_statuses: 注入的 5xx 状态码，随机选取
+            responder: 根据请求体生成回复内容的函数（可选），默认按提示词返回预设的表格 JSON 或 HTML
+            seed: 随机种子（可选），固定后延迟和故障注入可复现
+        """
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.latency = parse_latency(latency, self.rng)
+        self.stream_chunk_delay = stream_chunk_delay
+        self.stream_chunk_size = stream_chunk_size
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.responder = responder or self.default_responder
+        
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "streams": 0, "uploads": 0, "caches": 0
+        }
+        # 已上传的文件：file_id -> 字节数
+        self._files: Dict[str, int] = {}
+        # 已创建的上下文缓存：cache_id -> 缓存的消息
+        self._caches: Dict[str, list] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        """服务的 API 地址（传给 KimiClient 的 base_url）"""
+        return f"http://{self.host}:{self.port}/v1"
+    
+    def start(self) -> "KimiMockServer":
+        """
+        在后台线程中启动服务
+        
+        Returns:
+            self
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """停止服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def __enter__(self) -> "KimiMockServer":
+        return self.start()
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        获取请求统计
+        
+        Returns:
+            {"requests", "ok", "rate_limited", "errors", "streams", "uploads", "caches"}
+        """
+        with self._lock:
+            return dict(self._stats)
+    
+    def expire_files(self):
+        """删除所有已上传的文件，模拟服务端文件过期（之后引用这些文件的请求返回 400）"""
+        with self._lock:
+            self._files.clear()
+    
+    def _store_file(self, size: int) -> str:
+        with self._lock:
+            file_id = f"file-mock-{self._stats['uploads']:06d}"
+            self._files[file_id] = size
+            self._stats["uploads"] += 1
+        return file_id
+    
+    def expire_caches(self):
+        """删除所有上下文缓存，模拟缓存过期（之后引用这些缓存的请求返回 400）"""
+        with self._lock:
+            self._caches.clear()
+    
+    def _store_cache(self, messages: list) -> str:
+        with self._lock:
+            cache_id = f"cache-mock-{self._stats['caches']:06d}"
+            self._caches[cache_id] = messages
+            self._stats["caches"] += 1
+        return cache_id
+    
+    def _expand_cache(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """把 role 为 cache 的消息展开为缓存的消息，引用了不存在的缓存时返回 None"""
+        messages = []
+        for message in payload.get("messages", []):
+            if message.get("role") != "cache":
+                messages.append(message)
+                continue
+            options = dict(item.split("=", 1) for item in message.get("content", "").split(";") if "=" in item)
+            with self._lock:
+                cached = self._caches.get(options.get("cache_id"))
+            if cached is None:
+                return None
+            messages.extend(cached)
+        return {**payload, "messages": messages}
+    
+    def _missing_files(self, payload: Dict[str, Any]) -> list:
+        """请求中引用了但不存在的文件 ID"""
+        missing = []
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            if not isinstance(content, list):
+                continue
+            for part in content:
+                url = part.get("image_url", {}).get("url", "") if part.get("type") == "image_url" else ""
+                if url.startswith("ms://"):
+                    with self._lock:
+                        if url[len("ms://"):] not in self._files:
+                            missing.append(url)
+        return missing
+    
+    def _incr(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+    
+    def _draw(self) -> Optional[int]:
+        """按注入概率决定本次请求的故障状态码，None 表示正常返回"""
+        with self._lock:
+            value = self.rng.random()
+            status = self.rng.choice(self.error_statuses) if self.error_statuses else 500
+        if value < self.rate_limit_rate:
+            return 429
+        if value < self.rate_limit_rate + self.error_rate:
+            return status
+        return None
+    
+    @staticmethod
+    def default_responder(payload: Dict[str, Any]) -> str:
+        """
+        默认回复：提示词要求 HTML 时返回预设的 HTML 表格，要求制表符分隔的数据行时返回预设的紧凑表格，
+        否则返回预设的表格 JSON（请求 JSON 模式 response_format={"type": "json_object"} 时不带代码块）
+        
+        Args:
+            payload: 请求体
+            
+        Returns:
+            回复内容
+        """
+        text = json.dumps(payload.get("messages", []), ensure_ascii=False)
+        if "HTML" in text or "html" in text:
+            return f"```html\n{CANNED_TABLE_HTML}\n```"
+        if "制表符" in text and not payload.get("response_format"):
+            return CANNED_TABLE_TSV
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps(CANNED_TABLE_JSON, ensure_ascii=False)
+        return f"```json\n{json.dumps(CANNED_TABLE_JSON, ensure_ascii=False, indent=2)}\n```"
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            """模拟接口的请求处理"""
+            
+            protocol_version = "HTTP/1.1"
+            # 头部和正文分多次写出，关闭 Nagle 以免 keep-alive 连接上出现延迟确认
+            disable_nagle_algorithm = True
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                server._incr("requests")
+                
+                if self.path.rstrip("/") == "/v1/files":
+                    # 不解析 multipart，按请求体大小记录
+                    file_id = server._store_file(length)
+                    self._send_json(200, {
+                        "id": file_id,
+                        "object": "file",
+                        "bytes": length,
+                        "created_at": int(time.time()),
+                        "filename": "image",
+                        "purpose": "image",
+                        "status": "ok"
+                    })
+                    return
+                if self.path.rstrip("/") == "/v1/caching":
+                    try:
+                        messages = json.loads(body)["messages"]
+                    except (ValueError, KeyError):
+                        self._send_json(400, {"error": {"message": "invalid caching request", "type": "invalid_request_error"}})
+                        return
+                    cache_id = server._store_cache(messages)
+                    self._send_json(200, {
+                        "id": cache_id,
+                        "object": "context_cache.object",
+                        "status": "ready",
+                        "created_at": int(time.time()),
+                        "tokens": len(json.dumps(messages, ensure_ascii=False)) // 4
+                    })
+                    return
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                    return
+                expanded = server._expand_cache(payload)
+                if expanded is None:
+                    self._send_json(400, {"error": {"message": "context cache not found", "type": "invalid_request_error"}})
+                    return
+                payload = expanded
+                missing = server._missing_files(payload)
+                if missing:
+                    self._send_json(400, {"error": {"message": f"file not found: {missing[0]}", "type": "invalid_request_error"}})
+                    return
+                
+                delay = server.latency()
+                if delay > 0:
+                    time.sleep(delay)
+                
+                status = server._draw()
+                if status == 429:
+                    server._incr("rate_limited")
+                    self._send_json(
+                        429,
+                        {"error": {"message": "rate limit reached", "type": "rate_limit_reached_error"}},
+                        {"Retry-After": f"{server.retry_after:g}"}
+                    )
+                    return
+                if status is not None:
+                    server._incr("errors")
+                    self._send_json(status, {"error": {"message": "injected server error", "type": "server_error"}})
+                    return
+                
+                content = server.responder(payload)
+                # 模拟服务按字符计 token，超出 max_tokens 时截断并返回 finish_reason="length"
+                finish_reason = "stop"
+                max_tokens = payload.get("max_tokens")
+                if isinstance(max_tokens, int) and 0 < max_tokens < len(content):
+                    content = content[:max_tokens]
+                    finish_reason = "length"
+                model = payload.get("model", "moonshot-v1-8k")
+                usage = {
+                    "prompt_tokens": max(1, length // 4),
+                    "completion_tokens": len(content),
+                    "total_tokens": max(1, length // 4) + len(content)
+                }
+                server._incr("ok")
+                if payload.get("stream"):
+                    server._incr("streams")
+                    self._send_stream(content, model, usage, finish_reason)
+                else:
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": finish_reason
+                        }],
+                        "usage": usage
+                    })
+            
+            def _send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(raw)
+            
+            def _send_stream(self, content: str, model: str, usage: Dict[str, int], finish_reason: str = "stop"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    size = max(1, server.stream_chunk_size)
+                    pieces = [content[i:i + size] for i in range(0, len(content), size)]
+                    for index, piece in enumerate(pieces):
+                        choice = {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                        if index == len(pieces) - 1:
+                            # Moonshot 在最后一个数据块的 choice 中返回 usage
+                            choice["finish_reason"] = finish_reason
+                            choice["usage"] = usage
+                        self._write_event(json.dumps(
+                            {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model, "choices": [choice]},
+                            ensure_ascii=False
+                        ))
+                        if server.stream_chunk_delay > 0:
+                            time.sleep(server.stream_chunk_delay)
+                    self._write_event("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前关闭连接（例如已拿到完整 JSON）
+                    self.close_connection = True
+            
+            def _write_event(self, data: str):
+                raw = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+                self.wfile.flush()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="本地模拟的 Moonshot API 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default=None, help="延迟分布，如 0.5 / uniform:0.2,1.0 / lognormal:-0.5,0.6")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    
+    latency = args.latency
+    if latency is not None and ":" not in latency:
+        latency = float(latency)
+    
+    server = KimiMockServer(
+        host=args.host,
+        port=args.port,
+        latency=latency,
+        stream_chunk_delay=args.stream_chunk_delay,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        seed=args.seed
+    ).start()
+    print(f"模拟 Moonshot 服务已启动: {server.base_url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+表格提取的输出 token 预算
+根据模板（每行的字段数和值的长度）与图片中检测到的表格行数估算输出大小，
+在预留安全余量后作为 max_tokens：小表格不预留过多的生成预算（降低限流预算和长尾延迟），大表格不被截断
+"""
+import io
+import os
+import sys
+import json
+import math
+import base64
+from typing import Optional, Dict, Any, Union
+
+from PIL import Image
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_token_estimator import KimiTokenEstimator
+    from .kimi_json_template import compact_layout, rows_key_of, template_at
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_token_estimator import KimiTokenEstimator
+    from utils.kimi_json_template import compact_layout, rows_key_of, template_at
+
+
+# 检测行数时图片高度的上限（像素），更高的图片先等比缩小
+_DETECT_MAX_HEIGHT = 2000
+
+# 亮度低于该值的像素视为笔画或线条
+_INK_THRESHOLD = 160
+
+# 某一像素行中深色像素的比例超过该值时视为横向表格线或深色填充，而不是文字
+_RULE_RATIO = 0.6
+
+# 模板中的示例值为空时，按此字符数估算一个值
+_DEFAULT_VALUE_CHARS = 4
+
+
+class KimiOutputBudget:
+    """根据模板和图片估算表格提取的 max_tokens"""
+    
+    def __init__(
+        self,
+        token_estimator: Optional[KimiTokenEstimator] = None,
+        safety_margin: Optional[float] = None,
+        min_tokens: int = 256,
+        max_tokens: Optional[int] = None,
+        default_rows: int = 30
+    ):
+        """
+        初始化预算估算器
+        
+        Args:
+            token_estimator: 文本 token 预估器（可选），默认使用 KimiTokenEstimator()
+            safety_margin: 在估算值之上预留的比例，默认读取环境变量 KIMI_MAX_TOKENS_MARGIN 或 0.3
+            min_tokens: max_tokens 的下限
+            max_tokens: max_tokens 的上限，默认读取环境变量 KIMI_MAX_TOKENS_LIMIT 或 8000；
+                超出上限的表格由 KimiTableToJSON 的截断续写补齐
+            default_rows: 无法从图片检测行数时假定的行数
+        """
+        if safety_margin is None:
+            safety_margin = float(os.getenv("KIMI_MAX_TOKENS_MARGIN", 0.3))
+        if max_tokens is None:
+            max_tokens = int(os.getenv("KIMI_MAX_TOKENS_LIMIT", 8000))
+        
+        self.token_estimator = token_estimator or KimiTokenEstimator()
+        self.safety_margin = safety_margin
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.default_rows = default_rows
+    
+    def estimate_rows(self, image_path: Optional[str] = None, image_base64: Optional[str] = None) -> Optional[int]:
+        """
+        从图片估算表格的行数（包括表头）
+        
+        按像素行统计深色像素的比例：占满整行的横线（表格线、深色填充）视为分隔，
+        高于竖线基线的连续像素行视为一行文字，文字行的段数即为行数的估计。单元格内换行会使估计偏大，这对预算是安全的。
+        
+        Args:
+            image_path: 图片文件路径
+            image_base64: 图片 base64 字符串（可以包含 data URL 前缀）
+            
+        Returns:
+            行数，图片无法读取或没有检测到文字行时返回 None
+        """
+        try:
+            if image_path is not None:
+                image = Image.open(image_path)
+            elif image_base64:
+                if image_base64.startswith("data:"):
+                    image_base64 = image_base64.split(",", 1)[1]
+                image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+            else:
+                return None
+            with image:
+                gray = image.convert("L")
+        except Exception:
+            return None
+        
+        width, height = gray.size
+        if height > _DETECT_MAX_HEIGHT:
+            width = max(1, round(width * _DETECT_MAX_HEIGHT / height))
+            height = _DETECT_MAX_HEIGHT
+            gray = gray.resize((width, height), Image.BOX)
+        
+        # 深色像素为 255，缩成一列后每个像素即为该行深色像素的比例
+        ink = gray.point(lambda value: 255 if value < _INK_THRESHOLD else 0)
+        ratios = [value / 255 for value in ink.resize((1, height), Image.BOX).tobytes()]
+        
+        # 竖向表格线使每一行都有少量深色像素，以非横线行的最小比例作为基线
+        baseline = min((ratio for ratio in ratios if ratio < _RULE_RATIO), default=0.0)
+        bands = 0
+        run = 0
+        for ratio in ratios + [0.0]:
+            if baseline + 0.01 < ratio < _RULE_RATIO:
+                run += 1
+                continue
+            # 过矮的段视为噪点
+            if run >= 3:
+                bands += 1
+            run = 0
+        return bands or None
+    
+    def row_tokens(self, template: Union[Dict, list, None], compact: bool = False) -> int:
+        """
+        估算输出一行数据的 token 数
+        
+        Args:
+            template: 模板，行模板中的示例值用于估算值的长度
+            compact: 是否为紧凑输出（制表符分隔的一行值）
+            
+        Returns:
+            token 数
+        """
+        row = template_at(template, ([rows_key_of(template)] if isinstance(template, dict) else []) + [0])
+        if not isinstance(row, dict) or not row:
+            return self.token_estimator.estimate_text(json.dumps(row, ensure_ascii=False)) + 8
+        values = {key: str(value) if str(value) else "x" * _DEFAULT_VALUE_CHARS for key, value in row.items()}
+        if compact:
+            text = "\t".join(values.values()) + "\n"
+        else:
+            # 按带缩进的格式估算（模型输出紧凑 JSON 时实际更少）
+            text = json.dumps(values, ensure_ascii=False, indent=2).replace("\n", "\n    ") + ",\n"
+        return self.token_estimator.estimate_text(text)
+    
+    def overhead_tokens(self, template: Union[Dict, list, None], compact: bool = False) -> int:
+        """
+        估算行以外的输出（表格外的字段、表头、括号和代码块标记）的 token 数
+        
+        Args:
+            template: 模板
+            compact: 是否为紧凑输出
+            
+        Returns:
+            token 数
+        """
+        layout = compact_layout(template) if compact else None
+        if layout is not None:
+            lines = [f"@{key}\t{template[key]}" for key in layout["fields"]] + ["\t".join(layout["columns"])]
+            return self.token_estimator.estimate_text("\n".join(lines)) + 8
+        if isinstance(template, dict):
+            rows_key = rows_key_of(template)
+            outer = {key: ([] if key == rows_key else value) for key, value in template.items()}
+            return self.token_estimator.estimate_text(json.dumps(outer, ensure_ascii=False, indent=2)) + 16
+        return 16
+    
+    def budget(
+        self,
+        template: Union[Dict, list, None],
+        image_path: Optional[str] = None,
+        image_base64: Optional[str] = None,
+        compact: bool = False
+    ) -> Dict[str, Any]:
+        """
+        估算一次提取的 max_tokens
+        
+        Args:
+            template: 模板
+            image_path: 图片文件路径
+            image_base64: 图片 base64 字符串
+            compact: 是否为紧凑输出
+            
+        Returns:
+            {
+                "rows": int,  # 估计的行数
+                "rows_detected": bool,  # 行数是否从图片检测得到（否则为 default_rows）
+                "row_tokens": int,  # 每行的 token 数
+                "max_tokens": int  # 含安全余量、限制在 [min_tokens, max_tokens] 内的预算
+            }
+        """
+        rows = self.estimate_rows(image_path, image_base64)
+        detected = rows is not None
+        if rows is None:
+            rows = self.default_rows
+        row_tokens = self.row_tokens(template, compact)
+        estimate = self.overhead_tokens(template, compact) + rows * row_tokens
+        max_tokens = math.ceil(estimate * (1 + self.safety_margin))
+        return {
+            "rows": rows,
+            "rows_detected": detected,
+            "row_tokens": row_tokens,
+            "max_tokens": max(self.min_tokens, min(self.max_tokens, max_tokens))
+        }
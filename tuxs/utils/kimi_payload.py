@@ -0,0 +1,237 @@
+"""
+低拷贝的 Kimi 请求体构建
+图片以 ImageSource 形式留在消息中，发送时按块增量进行 base64 编码，
+请求体以「JSON 前缀 + base64 分块 + JSON 后缀」的形式流式写出，避免在内存中保留多份完整副本
+"""
+import os
+import sys
+import uuid
+import base64
+import hashlib
+from typing import Optional, Dict, Any, List, Union, Iterator
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from . import kimi_json
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils import kimi_json
+
+
+# 每次读取的原始字节数（3 的倍数，保证分块编码结果可以直接拼接）
+DEFAULT_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class ImageSource:
+    """
+    延迟编码的图片来源
+    
+    支持三种来源：文件路径、原始字节、base64 字符串（可带 data URL 前缀）。
+    发送请求时通过 iter_data_url() 分块输出 data URL，不会一次性生成完整的 base64 字符串。
+    """
+    
+    def __init__(
+        self,
+        fmt: str = "png",
+        path: Optional[str] = None,
+        data: Optional[bytes] = None,
+        base64_data: Optional[str] = None
+    ):
+        """
+        一般通过 from_path / from_bytes / from_base64 创建
+        
+        Args:
+            fmt: 图片格式（png / jpeg / webp 等），用于 data URL 的 MIME 类型
+            path: 图片文件路径
+            data: 图片原始字节
+            base64_data: 图片 base64 字符串（不含 data URL 前缀）
+        """
+        if sum(source is not None for source in (path, data, base64_data)) != 1:
+            raise ValueError("ImageSource 需要且只能提供 path、data、base64_data 中的一个")
+        self.fmt = fmt
+        self.path = path
+        self.data = data
+        self.base64_data = base64_data
+        self._digest: Optional[str] = None
+    
+    @classmethod
+    def from_path(cls, path: str) -> "ImageSource":
+        """从文件路径创建，格式取自扩展名"""
+        ext = os.path.splitext(path)[1][1:].lower()
+        if ext == "jpg":
+            ext = "jpeg"
+        return cls(fmt=ext, path=path)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes, fmt: str = "png") -> "ImageSource":
+        """从原始字节创建（不复制数据）"""
+        return cls(fmt=fmt, data=data)
+    
+    @classmethod
+    def from_base64(cls, image_input: str) -> "ImageSource":
+        """
+        从 base64 字符串创建
+        
+        Args:
+            image_input: data URL（data:image/xxx;base64,xxx）或纯 base64 字符串（默认按 png 处理）
+        """
+        fmt = "png"
+        if image_input.startswith("data:image"):
+            header, _, image_input = image_input.partition(",")
+            fmt = header[len("data:image/"):].split(";")[0] or "png"
+        # base64 字母表内的字符在 JSON 中无需转义；含换行等空白时需要先去掉
+        if any(ch in image_input for ch in "\r\n\t "):
+            image_input = "".join(image_input.split())
+        return cls(fmt=fmt, base64_data=image_input)
+    
+    @property
+    def prefix(self) -> str:
+        """data URL 前缀"""
+        return f"data:image/{self.fmt};base64,"
+    
+    def encoded_length(self) -> int:
+        """
+        data URL 的总字节数（不生成内容即可计算）
+        
+        Returns:
+            字节数
+        """
+        if self.base64_data is not None:
+            return len(self.prefix) + len(self.base64_data)
+        size = os.path.getsize(self.path) if self.path is not None else len(self.data)
+        return len(self.prefix) + 4 * ((size + 2) // 3)
+    
+    def iter_raw(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        分块输出图片原始字节
+        
+        Args:
+            chunk_size: 每块字节数
+            
+        Yields:
+            原始字节块
+        """
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        elif self.data is not None:
+            view = memoryview(self.data)
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size]
+        else:
+            # 4 个 base64 字符对应 3 个字节
+            step = chunk_size // 3 * 4
+            for start in range(0, len(self.base64_data), step):
+                yield base64.b64decode(self.base64_data[start:start + step])
+    
+    def iter_data_url(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        分块输出 data URL（ASCII 字节）
+        
+        Args:
+            chunk_size: 每次编码的原始字节数，需为 3 的倍数
+            
+        Yields:
+            data URL 字节块
+        """
+        yield self.prefix.encode("ascii")
+        if self.base64_data is not None:
+            step = chunk_size // 3 * 4
+            for start in range(0, len(self.base64_data), step):
+                yield self.base64_data[start:start + step].encode("ascii")
+            return
+        for chunk in self.iter_raw(chunk_size):
+            yield base64.b64encode(chunk)
+    
+    def read_bytes(self) -> bytes:
+        """读取完整的图片原始字节（会生成一份完整副本）"""
+        if self.data is not None:
+            return bytes(self.data)
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return base64.b64decode(self.base64_data)
+    
+    def to_data_url(self) -> str:
+        """生成完整的 data URL 字符串（会生成一份完整副本）"""
+        return b"".join(self.iter_data_url()).decode("ascii")
+    
+    def digest(self) -> str:
+        """
+        图片内容的 SHA-256（基于原始字节，与来源形式无关），增量计算并缓存
+        
+        Returns:
+            十六进制哈希字符串
+        """
+        if self._digest is None:
+            sha = hashlib.sha256()
+            for chunk in self.iter_raw():
+                sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+    
+    def __repr__(self) -> str:
+        return f"ImageSource(fmt={self.fmt!r}, sha256={self.digest()[:12]})"
+
+
+def json_default(obj: Any) -> Any:
+    """
+    json.dumps 的 default 钩子：ImageSource 序列化为内容哈希（用于缓存键等指纹计算）
+    """
+    if isinstance(obj, ImageSource):
+        return f"{obj.prefix}sha256:{obj.digest()}"
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StreamingJSONPayload:
+    """
+    流式写出的 JSON 请求体
+    
+    请求体先序列化一次（图片位置替换为占位符），发送时依次输出 JSON 片段和图片的 base64 分块。
+    实现了 __len__，requests 会据此设置 Content-Length；每次迭代都会重新生成内容，重试时可重复发送。
+    """
+    
+    def __init__(self, payload: Dict[str, Any], chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            payload: 请求体，图片以 ImageSource 对象出现在任意位置
+            chunk_size: 图片分块编码的原始字节数
+        """
+        self.chunk_size = chunk_size
+        images: List[ImageSource] = []
+        token = uuid.uuid4().hex
+        
+        def default(obj):
+            if isinstance(obj, ImageSource):
+                images.append(obj)
+                return f"__tuxs_image_{token}_{len(images) - 1}__"
+            raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+        
+        serialized = kimi_json.dumps_bytes(payload, default=default)
+        
+        self._parts: List[Union[bytes, ImageSource]] = []
+        for index, image in enumerate(images):
+            before, serialized = serialized.split(f"__tuxs_image_{token}_{index}__".encode("ascii"), 1)
+            self._parts.append(before)
+            self._parts.append(image)
+        self._parts.append(serialized)
+        
+        self._length = sum(
+            part.encoded_length() if isinstance(part, ImageSource) else len(part)
+            for part in self._parts
+        )
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, ImageSource):
+                yield from part.iter_data_url(self.chunk_size)
+            elif part:
+                yield part
@@ -0,0 +1,229 @@
+"""
+Kimi API 客户端限流器
+基于令牌桶同时限制每分钟请求数（RPM）和每分钟 token 数（TPM），调用方按到达顺序排队
+"""
+import os
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+
+class _TokenBucket:
+    """按固定速率补充的令牌桶，余额允许为负（表示透支，需要等待补回）"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def wait_time(self, amount: float) -> float:
+        """余额达到 amount 还需要等待的秒数（需先调用 refill）"""
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class KimiRateLimiter:
+    """
+    RPM / TPM 双令牌桶限流器
+    
+    - acquire(): 按到达顺序（FIFO）排队，直到请求数和 token 预算都足够时放行
+    - settle(): 响应返回后用 usage 中的实际 token 数修正预估值，多退少补
+    - pause(): 收到 429 时按 Retry-After 暂停所有调用方
+    """
+    
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        """
+        初始化限流器
+        
+        Args:
+            rpm: 每分钟最大请求数，默认读取环境变量 KIMI_RPM；为空或 0 表示不限制
+            tpm: 每分钟最大 token 数，默认读取环境变量 KIMI_TPM；为空或 0 表示不限制
+        """
+        if rpm is None:
+            rpm = int(os.getenv("KIMI_RPM", 0))
+        if tpm is None:
+            tpm = int(os.getenv("KIMI_TPM", 0))
+        
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = _TokenBucket(rpm) if rpm else None
+        self._tokens = _TokenBucket(tpm) if tpm else None
+        
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._paused_until = 0.0
+        
+        # 统计信息
+        self.total_acquired = 0
+        self.total_wait_seconds = 0.0
+        self.throttled_responses = 0
+    
+    def acquire(self, estimated_tokens: int = 0) -> float:
+        """
+        申请一次请求配额，配额不足时阻塞等待
+        
+        Args:
+            estimated_tokens: 本次请求预估消耗的 token 数（提示词 + 最大生成数）
+            
+        Returns:
+            实际等待的秒数
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            
+            while True:
+                if ticket != self._serving:
+                    # 前面还有调用方在排队
+                    self._cond.wait()
+                    continue
+                
+                now = time.monotonic()
+                wait = max(0.0, self._paused_until - now)
+                if self._requests is not None:
+                    self._requests.refill(now)
+                    wait = max(wait, self._requests.wait_time(1))
+                if self._tokens is not None:
+                    self._tokens.refill(now)
+                    wait = max(wait, self._tokens.wait_time(estimated_tokens))
+                
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+            
+            if self._requests is not None:
+                self._requests.tokens -= 1
+            if self._tokens is not None:
+                self._tokens.tokens -= estimated_tokens
+            
+            self._serving += 1
+            self.total_acquired += 1
+            waited = time.monotonic() - start
+            self.total_wait_seconds += waited
+            self._cond.notify_all()
+        
+        return waited
+    
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """
+        用响应中的实际 token 数修正 TPM 预算
+        
+        Args:
+            estimated_tokens: acquire 时使用的预估 token 数
+            actual_tokens: usage.total_tokens，未知时传 None（保留预估值）
+        """
+        if self._tokens is None or actual_tokens is None:
+            return
+        with self._cond:
+            self._tokens.tokens = min(self._tokens.capacity, self._tokens.tokens + estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+    
+    def pause(self, seconds: float):
+        """
+        暂停放行新请求（例如收到 429 后按 Retry-After 等待）
+        
+        Args:
+            seconds: 暂停秒数
+        """
+        with self._cond:
+            self.throttled_responses += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+    
+    def estimate_wait(self, estimated_tokens: int = 0) -> float:
+        """
+        预估现在申请配额需要等待的秒数（不占用配额，用于在多个密钥之间选择）
+        
+        Args:
+            estimated_tokens: 本次请求预估消耗的 token 数
+            
+        Returns:
+            预估等待秒数，排队中的调用方按每个请求至少占用一个 RPM 配额计入
+        """
+        with self._cond:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            queued = self._next_ticket - self._serving
+            if self._requests is not None:
+                self._requests.refill(now)
+                wait = max(wait, self._requests.wait_time(1 + queued))
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                wait = max(wait, self._tokens.wait_time(estimated_tokens))
+            return wait
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取限流统计信息
+        
+        Returns:
+            {"rpm", "tpm", "acquired", "queued", "total_wait_seconds", "throttled_responses"}
+        """
+        with self._cond:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "acquired": self.total_acquired,
+                "queued": self._next_ticket - self._serving,
+                "total_wait_seconds": self.total_wait_seconds,
+                "throttled_responses": self.throttled_responses
+            }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 响应头
+    
+    Args:
+        value: 秒数或 HTTP 日期格式的字符串
+        
+    Returns:
+        需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# 进程内共享的限流器，按 API 密钥区分（配额按账号计算）
+_rate_limiters: Dict[str, KimiRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> KimiRateLimiter:
+    """
+    获取指定 API 密钥对应的进程级限流器
+    
+    同一密钥的所有 KimiClient 共享一个限流器；首次创建时的 rpm / tpm 生效。
+    
+    Args:
+        api_key: Kimi API 密钥
+        rpm: 每分钟最大请求数（可选）
+        tpm: 每分钟最大 token 数（可选）
+        
+    Returns:
+        KimiRateLimiter 实例
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(api_key)
+        if limiter is None:
+            limiter = KimiRateLimiter(rpm=rpm, tpm=tpm)
+            _rate_limiters[api_key] = limiter
+        return limiter
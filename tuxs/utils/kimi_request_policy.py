@@ -0,0 +1,128 @@
+"""
+Kimi API 请求策略
+定义连接/读取超时、整体截止时间、带抖动的指数退避重试，以及可选的对冲请求（hedged request）
+"""
+import os
+import random
+from typing import Optional, Tuple, Iterable
+
+
+class KimiRequestPolicy:
+    """Kimi API 请求的超时、重试与对冲策略"""
+    
+    def __init__(
+        self,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        jitter: bool = True,
+        retry_statuses: Iterable[int] = (429, 500, 502, 503, 504),
+        hedge: bool = False,
+        hedge_after: Optional[float] = None,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20
+    ):
+        """
+        初始化请求策略
+        
+        Args:
+            connect_timeout: 建立连接的超时秒数，默认读取环境变量 KIMI_CONNECT_TIMEOUT 或 10
+            read_timeout: 两次读取数据之间的最长等待秒数，默认读取环境变量 KIMI_READ_TIMEOUT 或 120
+            deadline: 单次调用（含所有重试）的整体截止秒数，默认读取环境变量 KIMI_DEADLINE 或 300；
+                <= 0 表示不限制
+            max_retries: 最大重试次数，默认读取环境变量 KIMI_MAX_RETRIES 或 3
+            backoff_base: 指数退避的基础秒数，第 n 次重试的上限为 backoff_base * 2^n
+            backoff_max: 单次退避的最大秒数
+            jitter: 是否使用全抖动（在 0 到退避上限之间随机取值），避免大量请求同时重试
+            retry_statuses: 需要重试的 HTTP 状态码
+            hedge: 是否启用对冲请求：请求超过阈值仍未返回时再发一个相同请求，取先返回的结果
+            hedge_after: 对冲阈值秒数；不提供时使用最近请求耗时的 hedge_percentile 分位数
+            hedge_percentile: 自动阈值使用的分位数，默认 p95
+            hedge_min_samples: 自动阈值至少需要的耗时样本数，样本不足时不发送对冲请求
+        """
+        if connect_timeout is None:
+            connect_timeout = float(os.getenv("KIMI_CONNECT_TIMEOUT", 10))
+        if read_timeout is None:
+            read_timeout = float(os.getenv("KIMI_READ_TIMEOUT", 120))
+        if deadline is None:
+            deadline = float(os.getenv("KIMI_DEADLINE", 300))
+        if max_retries is None:
+            max_retries = int(os.getenv("KIMI_MAX_RETRIES", 3))
+        
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_statuses = set(retry_statuses)
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+    
+    def timeout(self, remaining: Optional[float] = None) -> Tuple[float, float]:
+        """
+        计算本次尝试使用的 (连接超时, 读取超时)
+        
+        Args:
+            remaining: 距离整体截止时间的剩余秒数（可选）
+            
+        Returns:
+            requests 的 timeout 参数
+        """
+        if remaining is None:
+            return (self.connect_timeout, self.read_timeout)
+        remaining = max(remaining, 0.001)
+        return (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+    
+    def should_retry_status(self, status_code: int) -> bool:
+        """
+        判断 HTTP 状态码是否需要重试
+        
+        Args:
+            status_code: HTTP 状态码
+            
+        Returns:
+            是否重试
+        """
+        return status_code in self.retry_statuses
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        计算第 attempt 次重试前的等待秒数
+        
+        Args:
+            attempt: 已失败的次数（从 0 开始）
+            retry_after: 服务端通过 Retry-After 给出的等待秒数（可选），优先使用
+            
+        Returns:
+            等待秒数
+        """
+        if retry_after is not None:
+            return retry_after
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap) if self.jitter else cap
+    
+    def hedge_delay(self, latency_percentile: Optional[float], samples: int) -> Optional[float]:
+        """
+        计算发送对冲请求前的等待秒数
+        
+        Args:
+            latency_percentile: 最近请求耗时的 hedge_percentile 分位数（秒）
+            samples: 耗时样本数
+            
+        Returns:
+            等待秒数；不发送对冲请求时返回 None
+        """
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if latency_percentile is None or samples < self.hedge_min_samples:
+            return None
+        return latency_percentile
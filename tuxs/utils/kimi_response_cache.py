@@ -0,0 +1,217 @@
+"""
+Kimi API 响应缓存
+基于 SQLite 的内容寻址缓存，进程重启后依然有效，支持 TTL 和按总大小的 LRU 淘汰
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Dict, Any
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_payload import json_default
+    from . import kimi_json
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_payload import json_default
+    from utils import kimi_json
+
+
+# 默认缓存配置，可通过环境变量覆盖
+DEFAULT_CACHE_TTL = 7 * 24 * 3600  # 7 天
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+
+
+class KimiResponseCache:
+    """基于 SQLite 的 Kimi API 响应缓存"""
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        初始化响应缓存
+        
+        Args:
+            path: SQLite 数据库文件路径，默认为 KIMI_CACHE_DIR（或 ~/.cache/tuxs）下的 kimi_response_cache.sqlite3
+            ttl: 缓存有效期（秒），默认读取环境变量 KIMI_CACHE_TTL 或 7 天；<= 0 表示永不过期
+            max_bytes: 缓存总大小上限（字节），超出后按最近访问时间淘汰，
+                默认读取环境变量 KIMI_CACHE_MAX_BYTES 或 256MB
+        """
+        if path is None:
+            cache_dir = os.getenv("KIMI_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "tuxs")
+            path = os.path.join(cache_dir, "kimi_response_cache.sqlite3")
+        if ttl is None:
+            ttl = float(os.getenv("KIMI_CACHE_TTL", DEFAULT_CACHE_TTL))
+        if max_bytes is None:
+            max_bytes = int(os.getenv("KIMI_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+        
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            # WAL 模式允许多个 ComfyUI 进程同时读写
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "response BLOB NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)"
+            )
+    
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """
+        根据请求体计算缓存键
+        
+        请求体包含模型、消息（图片以内容哈希参与计算）和采样参数，
+        序列化时对键排序，保证相同请求得到相同的哈希。
+        
+        Args:
+            payload: chat/completions 请求体
+        
+        Returns:
+            SHA-256 十六进制字符串
+        """
+        # 固定使用标准库，保证是否安装 orjson 的进程得到相同的缓存键
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=json_default)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存的响应，过期的条目视为未命中并删除
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            缓存的 API 响应，未命中时返回 None
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            
+            if row is not None and self.ttl > 0 and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        
+        return kimi_json.loads(row[0])
+    
+    def set(self, key: str, response: Dict[str, Any]):
+        """
+        写入响应，并在超出大小上限时淘汰最久未访问的条目
+        
+        Args:
+            key: 缓存键
+            response: API 响应
+        """
+        data = kimi_json.dumps_bytes(response)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now)
+            )
+            self._evict()
+    
+    def _evict(self):
+        """删除过期条目，并按 LRU 顺序淘汰直到总大小不超过上限（需在持有锁时调用）"""
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall()
+        expired = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            expired.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+    
+    def clear(self):
+        """清空全部缓存并重置计数"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+        
+        Returns:
+            {"hits", "misses", "hit_rate", "entries", "size_bytes", "max_bytes", "ttl", "path"}
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "size_bytes": size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "path": self.path
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+# 进程内共享的默认缓存
+_default_cache: Optional[KimiResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> KimiResponseCache:
+    """
+    获取进程内共享的默认响应缓存（路径和限制由环境变量决定）
+    
+    Returns:
+        KimiResponseCache 实例
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = KimiResponseCache()
+        return _default_cache
@@ -0,0 +1,74 @@
+"""
+Kimi 请求的 single-flight 合并
+相同指纹的请求同时进行时只发送一次，其余调用方等待并共享同一个结果
+"""
+import copy
+import threading
+from typing import Optional, Dict, Any, Callable, Tuple
+
+
+class _Call:
+    """一次进行中的调用"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class KimiSingleFlight:
+    """按请求指纹合并进行中的相同请求（线程安全）"""
+    
+    def __init__(self):
+        """初始化"""
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+    
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行 func；若相同 key 的调用正在进行，则等待其完成并共享结果
+        
+        Args:
+            key: 请求指纹
+            func: 实际发送请求的函数
+            
+        Returns:
+            (结果, 是否为共享结果)。共享结果是深拷贝，调用方可以自由修改；
+            发起请求的调用抛出异常时，等待的调用方会收到同一个异常
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            else:
+                leader = False
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+        
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # 先移除再唤醒：之后到达的相同请求会重新发起（或命中响应缓存）
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+    
+    def in_flight(self) -> int:
+        """
+        当前进行中的不同请求数
+        
+        Returns:
+            请求数
+        """
+        with self._lock:
+            return len(self._calls)
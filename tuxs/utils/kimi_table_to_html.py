@@ -3,39 +3,55 @@ Kimi API 工具类 - 根据图片表格内容生成 HTML 代码
 """
 import os
 import sys
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
 
 # 处理相对导入，支持直接运行和作为模块导入
 try:
-    from .kimi_client import KimiClient
+    from .kimi_client import KimiClient, get_client
+    from .kimi_batch_manifest import KimiBatchManifest
 except ImportError:
     # 如果相对导入失败，尝试绝对导入
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.kimi_client import KimiClient
+    from utils.kimi_client import KimiClient, get_client
+    from utils.kimi_batch_manifest import KimiBatchManifest
 
 class KimiTableToHTML:
     """使用 Kimi API 将图片表格转换为 HTML 代码的工具类"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # 系统提示词
+    SYSTEM_PROMPT = "你是一个专业的前端开发专家，擅长将表格内容转换为结构化的 HTML 代码。要求样式必须与图片一模一样"
+    
+    # 默认用户提示词
+    DEFAULT_PROMPT = """请仔细分析这张图片中的表格内容，然后生成对应的 HTML 代码。要求：
+1. 准确识别表格的行和列结构
+2. 保留所有单元格的内容和合并关系
+3. 生成规范的 HTML table 代码
+4. 添加基本的 CSS 样式使表格美观
+5. 确保代码可以直接使用
+
+请只返回完整的 HTML 代码，包含 <style> 标签的样式定义。"""
+    
+    def __init__(self, api_key: Optional[str] = None, client: Optional[KimiClient] = None):
         """
         初始化 Kimi API 客户端
         
         Args:
             api_key: Kimi API 密钥，如果不提供则从环境变量 KIMI_API_KEY 读取
+            client: 底层 KimiClient（可选），默认使用按 API 密钥共享的进程级客户端
         """
-        # 使用 KimiClient 作为底层客户端
-        self.client = KimiClient(api_key=api_key)
-        # 默认使用视觉模型
-        self.client.set_model("moonshot-v1-8k-vision-preview")
+        # 使用 KimiClient 作为底层客户端，同一密钥的实例共享连接池
+        self.client = client or get_client(api_key)
+        # 默认由 KimiClient 按请求选择视觉模型和上下文档位
+        self.model: Optional[str] = None
     
     def set_model(self, model: str):
         """
-        设置使用的模型版本
+        设置使用的模型版本（只影响当前实例，不修改共享的 KimiClient）
         
         Args:
             model: 模型名称 (moonshot-v1-8k-vision-preview, moonshot-v1-32k-vision-preview 等)
         """
-        self.client.set_model(model)
+        self.model = model
     
     def encode_image(self, image_path: str) -> str:
         """
@@ -66,7 +82,9 @@ class KimiTableToHTML:
         image_path: str,
         custom_prompt: Optional[str] = None,
         temperature: float = 0.3,
-        max_tokens: int = 4000
+        max_tokens: int = 4000,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None
     ) -> Dict[str, Any]:
         """
         将表格图片转换为 HTML 代码
@@ -76,33 +94,110 @@ class KimiTableToHTML:
             custom_prompt: 自定义提示词，如果不提供则使用默认提示词
             temperature: 温度参数，控制输出随机性 (0-1)
             max_tokens: 最大生成 token 数
+            stream: 是否使用流式响应，读到 </html> 后立即停止
+            on_progress: 流式模式下的进度回调，参数为 (内容增量, 已接收的完整内容)
             
         Returns:
             包含 HTML 代码和原始响应的字典
         """
-        # 构建默认提示词
-        if custom_prompt is None:
-            custom_prompt = """请仔细分析这张图片中的表格内容，然后生成对应的 HTML 代码。要求：
-1. 准确识别表格的行和列结构
-2. 保留所有单元格的内容和合并关系
-3. 生成规范的 HTML table 代码
-4. 添加基本的 CSS 样式使表格美观
-5. 确保代码可以直接使用
-
-请只返回完整的 HTML 代码，包含 <style> 标签的样式定义。"""
+        result = self._request(
+            custom_prompt if custom_prompt is not None else self.DEFAULT_PROMPT,
+            image_path,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress
+        )
+        
+        return self._build_result(result, image_path)
+    
+    async def atable_image_to_html(
+        self, 
+        image_path: str,
+        custom_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        table_image_to_html 的异步版本，请求在 KimiClient 的异步线程池中执行
+        
+        Args:
+            与 table_image_to_html 相同
+            
+        Returns:
+            与 table_image_to_html 相同的结果字典
+        """
+        result = await self.client.arun(
+            self._request,
+            custom_prompt if custom_prompt is not None else self.DEFAULT_PROMPT,
+            image_path,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress
+        )
+        
+        return self._build_result(result, image_path)
+    
+    def _request(
+        self,
+        prompt: str,
+        image_path: str,
+        temperature: float = 0.3,
+        max_tokens: int = 4000,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        调用 KimiClient 获取模型回复（内部方法）
         
-        # 系统提示词
-        system_prompt = "你是一个专业的前端开发专家，擅长将表格内容转换为结构化的 HTML 代码。要求样式必须与图片一模一样"
+        流式模式下读到 </html> 即关闭连接，不再等待模型输出结尾的说明文字。
+        
+        Returns:
+            与 KimiClient.chat 返回值结构相同的字典
+        """
+        if not stream:
+            return self.client.chat(
+                prompt=prompt,
+                image_paths=image_path,
+                system_prompt=self.SYSTEM_PROMPT,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                model=self.model
+            )
         
-        # 使用 KimiClient 调用 API
-        result = self.client.chat(
-            prompt=custom_prompt,
+        response = self.client.chat_stream(
+            prompt=prompt,
             image_paths=image_path,
-            system_prompt=system_prompt,
+            system_prompt=self.SYSTEM_PROMPT,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            model=self.model
         )
+        try:
+            for delta in response:
+                if on_progress:
+                    on_progress(delta, response.content)
+                # 只检查末尾窗口，避免每次都扫描全部内容
+                if "</html>" in response.content[-(len(delta) + 7):].lower():
+                    break
+        finally:
+            response.close()
+        return response.to_result()
+    
+    def _build_result(self, result: Dict[str, Any], image_path: str) -> Dict[str, Any]:
+        """
+        根据 KimiClient 的响应构建转换结果
         
+        Args:
+            result: KimiClient.chat 的返回值
+            image_path: 图片文件路径
+            
+        Returns:
+            包含 HTML 代码和原始响应的字典
+        """
         # 提取 HTML 代码
         html_code = self._extract_html(result["content"])
         
@@ -124,14 +219,15 @@ class KimiTableToHTML:
             提取的 HTML 代码
         """
         # 尝试提取代码块中的 HTML
+        # 流式提前结束时代码块可能没有结尾的 ```
         if "```html" in content:
             start = content.find("```html") + 7
             end = content.find("```", start)
-            return content[start:end].strip()
+            return content[start:end if end != -1 else None].strip()
         elif "```" in content:
             start = content.find("```") + 3
             end = content.find("```", start)
-            return content[start:end].strip()
+            return content[start:end if end != -1 else None].strip()
         else:
             return content.strip()
     
@@ -150,25 +246,46 @@ class KimiTableToHTML:
         self, 
         image_paths: list,
         output_dir: str,
-        custom_prompt: Optional[str] = None
+        custom_prompt: Optional[str] = None,
+        resume: bool = True
     ) -> list:
         """
         批量转换多张表格图片为 HTML
         
+        每张图片的内容哈希、状态、输出路径和 token 用量记录在 output_dir 的进度清单中（见 KimiBatchManifest），
+        中断后重新运行时跳过已完成的图片，只重试失败和新增的图片。
+        
         Args:
             image_paths: 图片文件路径列表
             output_dir: 输出目录
             custom_prompt: 自定义提示词
+            resume: 是否跳过进度清单中已完成、且图片内容和提示词都未变化的图片，
+                为 False 时全部重新转换（清单仍会更新）
             
         Returns:
-            转换结果列表
+            转换结果列表，跳过的图片带有 "skipped": True
         """
         results = []
         
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
+        manifest = KimiBatchManifest(output_dir)
+        params = KimiBatchManifest.fingerprint(custom_prompt, self.model)
         
         for i, image_path in enumerate(image_paths):
+            digest = KimiBatchManifest.file_hash(image_path)
+            entry = manifest.completed(image_path, digest, params) if resume else None
+            if entry is not None:
+                results.append({
+                    "image_path": image_path,
+                    "output_path": entry["output_path"],
+                    "success": True,
+                    "usage": entry.get("usage", {}),
+                    "skipped": True
+                })
+                print(f"- 已跳过（已完成）: {image_path} -> {entry['output_path']}")
+                continue
+            
             try:
                 # 转换图片
                 result = self.table_image_to_html(image_path, custom_prompt)
@@ -179,16 +296,20 @@ class KimiTableToHTML:
                 
                 # 保存 HTML
                 self.save_html(result["html_code"], output_path)
+                usage = result.get("usage") or {}
+                manifest.record(image_path, digest, params, "done", output_path, usage)
                 
                 results.append({
                     "image_path": image_path,
                     "output_path": output_path,
-                    "success": True
+                    "success": True,
+                    "usage": usage
                 })
                 
                 print(f"✓ 已转换: {image_path} -> {output_path}")
                 
             except Exception as e:
+                manifest.record(image_path, digest, params, "failed", error=str(e))
                 results.append({
                     "image_path": image_path,
                     "output_path": None,
@@ -4,40 +4,215 @@ Kimi API 工具类 - 根据图片表格内容和JSON模板提取结构化数据
 import os
 import sys
 import json
-from typing import Optional, Dict, Any, Union
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, Union, Callable, Tuple, List, Iterator
+
+import requests
 
 # 处理相对导入，支持直接运行和作为模块导入
 try:
-    from .kimi_client import KimiClient
+    from .kimi_client import KimiClient, get_client
+    from .kimi_batch_manifest import KimiBatchManifest
+    from .kimi_output_budget import KimiOutputBudget
+    from . import kimi_json
+    from .kimi_json_template import (
+        parse_template, repair_json_text, validate_against_template, set_at, compact_layout, expand_compact_rows,
+        rows_key_of, KimiRowStreamParser
+    )
 except ImportError:
     # 如果相对导入失败，尝试绝对导入
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.kimi_client import KimiClient
+    from utils.kimi_client import KimiClient, get_client
+    from utils.kimi_batch_manifest import KimiBatchManifest
+    from utils.kimi_output_budget import KimiOutputBudget
+    from utils import kimi_json
+    from utils.kimi_json_template import (
+        parse_template, repair_json_text, validate_against_template, set_at, compact_layout, expand_compact_rows,
+        rows_key_of, KimiRowStreamParser
+    )
+
+
+# 关闭自动估算时的默认最大生成 token 数
+DEFAULT_MAX_TOKENS = 4000
+
+
+class _JSONValueTracker:
+    """跟踪流式文本中第一个顶层 JSON 值是否已经闭合"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+        self.complete = False
+    
+    def feed(self, text: str) -> bool:
+        """
+        输入一段新文本
+        
+        Args:
+            text: 流式返回的内容增量
+            
+        Returns:
+            顶层 JSON 值是否已闭合
+        """
+        for ch in text:
+            if self.complete:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch in "{[":
+                self.depth += 1
+                self.started = True
+            elif ch in "}]" and self.started:
+                self.depth -= 1
+                self.complete = self.depth == 0
+            elif ch == '"' and self.started:
+                self.in_string = True
+        return self.complete
 
 
 class KimiTableToJSON:
     """使用 Kimi API 将图片表格按照 JSON 模板提取为结构化数据的工具类"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # 系统提示词
+    SYSTEM_PROMPT = "你是一个专业的数据提取专家，擅长从图片表格中准确提取结构化数据。你必须严格按照给定的 JSON 模板格式返回数据。"
+    
+    # 静态前缀：系统提示词 + JSON 模板 + 提取规则，{template_str} 会被替换为 JSON 模板。
+    # 同一模板的所有请求前缀逐字节相同，可被 KimiClient 的上下文缓存复用；随图片变化的内容只放在用户消息中
+    DEFAULT_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
+
+【JSON 数据模板】
+```json
+{template_str}
+```
+
+【提取要求】
+1. 严格按照 JSON 模板的结构提取数据
+2. 准确识别表格中的每一行数据
+3. 确保字段名与模板完全一致
+4. 数值类型的数据保持为字符串格式（与模板一致）
+5. 如果某个字段在图片中不存在，使用空字符串 ""
+
+【输出要求】
+请只返回提取后的 JSON 数据，不要包含任何其他说明文字。
+JSON 数据必须是有效的、可解析的格式。"""
+    
+    # 默认用户提示词（跟在图片之后）
+    USER_PROMPT = "请仔细分析这张图片中的表格内容，然后按照上述 JSON 数据模板提取表格数据。"
+    
+    # 紧凑输出（output_format="tsv"）的静态前缀：模型只输出表头和制表符分隔的数据行，不重复每一行的字段名，
+    # 由 expand_compact_rows 在本地展开为模板的 JSON 结构
+    COMPACT_PROMPT_TEMPLATE = "你是一个专业的数据提取专家，擅长从图片表格中准确提取结构化数据。" + """
+
+【表头】
+{header}
+
+【示例行】
+{example}
+{fields}
+【输出格式】
+1. 先原样输出上面的表头（一行），列名之间用制表符（TAB）分隔
+2. 之后每行对应表格中的一行数据，值的顺序与表头一致，用制表符分隔
+3. 某个值在图片中不存在时留空，但保留分隔符
+4. 值中不要包含制表符和换行
+5. 示例行只用于说明值的格式，不要输出示例行
+
+【输出要求】
+请只输出表头和数据行，不要使用代码块，不要包含任何其他说明文字。"""
+    
+    # 紧凑输出的用户提示词
+    COMPACT_USER_PROMPT = "请仔细分析这张图片中的表格内容，然后按照上述格式输出表头和数据行。"
+    
+    # 只重新询问不符合模板的行 / 字段，{issues} 会被替换为位置和原因列表
+    REPAIR_PROMPT = """上面回复中以下位置的数据不符合要求（位置中的行号从 0 开始计数）：
+{issues}
+
+请重新识别图片中对应的内容，只返回一个 JSON 对象：键为上面列出的位置（如 "data[3]"），值为该位置修正后的完整数据（表格的一行是以列名为键的对象），不要返回其他位置。"""
+    
+    # 回复无法解析或整体结构不符时重新提取
+    RETRY_PROMPT = "上面的回复{reason}。请重新按照 JSON 数据模板提取表格数据，只返回有效的 JSON 数据。"
+    COMPACT_RETRY_PROMPT = "上面的回复不符合输出格式。请重新按照上述格式输出表头和数据行，不要包含其他内容。"
+    
+    # 回复达到 max_tokens 被截断时续写剩余的行，{count} 和 {last_row} 会被替换为已完整输出的行数和最后一行
+    CONTINUE_PROMPT = """上面的回复因长度限制被截断，已完整输出 {count} 行，最后一个完整的行是：
+{last_row}
+
+请继续提取这一行之后剩余的行，不要重复已输出的行。只返回与 JSON 数据模板结构相同的 JSON 数据，其中的行数组只包含剩余的行。"""
+    COMPACT_CONTINUE_PROMPT = """上面的回复因长度限制被截断，已完整输出 {count} 行数据，最后一个完整的行是：
+{last_row}
+
+请继续输出这一行之后剩余的数据行，不要重复已输出的行，不要输出表头，格式与上面相同。"""
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        client: Optional[KimiClient] = None,
+        json_mode: Optional[bool] = None,
+        max_repairs: Optional[int] = None,
+        output_format: Optional[str] = None,
+        max_continuations: Optional[int] = None,
+        adaptive_max_tokens: Optional[bool] = None,
+        output_budget: Optional[KimiOutputBudget] = None
+    ):
         """
         初始化 Kimi API 客户端
         
         Args:
             api_key: Kimi API 密钥，如果不提供则从环境变量 KIMI_API_KEY 读取
+            client: 底层 KimiClient（可选），默认使用按 API 密钥共享的进程级客户端
+            json_mode: 模板为 JSON 对象时是否请求 JSON 输出格式（response_format={"type": "json_object"}），
+                默认读取环境变量 KIMI_JSON_MODE（默认开启）；接口不支持时自动关闭
+            max_repairs: 结果不符合模板时最多追问几轮（只追问不符合的行 / 字段），
+                默认读取环境变量 KIMI_JSON_MAX_REPAIRS 或 1，0 表示不追问
+            output_format: 模型的输出格式，默认读取环境变量 KIMI_TABLE_OUTPUT_FORMAT 或 "json"：
+                - "json": 按 JSON 模板输出
+                - "tsv": 只输出表头和制表符分隔的数据行，在本地展开为模板的 JSON 结构，
+                  不重复每一行的字段名，输出 token 明显减少；模板不是简单的行列结构或使用自定义提示词时按 "json" 处理
+            max_continuations: 回复达到 max_tokens 被截断时最多续写几次（只请求剩余的行，与已输出的行拼接），
+                默认读取环境变量 KIMI_JSON_MAX_CONTINUATIONS 或 2，0 表示不续写
+            adaptive_max_tokens: 调用时未指定 max_tokens 时，是否根据模板（每行的字段数和值的长度）和图片中检测到的行数
+                估算 max_tokens，默认读取环境变量 KIMI_ADAPTIVE_MAX_TOKENS（默认开启）；关闭时使用 4000
+            output_budget: max_tokens 估算器（可选），默认使用 KimiOutputBudget()
         """
-        # 使用 KimiClient 作为底层客户端
-        self.client = KimiClient(api_key=api_key)
-        # 默认使用视觉模型
-        self.client.set_model("moonshot-v1-8k-vision-preview")
+        # 使用 KimiClient 作为底层客户端，同一密钥的实例共享连接池
+        self.client = client or get_client(api_key)
+        # 默认由 KimiClient 按请求选择视觉模型和上下文档位
+        self.model: Optional[str] = None
+        
+        if json_mode is None:
+            json_mode = os.getenv("KIMI_JSON_MODE", "1").lower() in ("1", "true", "yes")
+        if max_repairs is None:
+            max_repairs = int(os.getenv("KIMI_JSON_MAX_REPAIRS", 1))
+        if output_format is None:
+            output_format = os.getenv("KIMI_TABLE_OUTPUT_FORMAT", "json").lower()
+        if output_format not in ("json", "tsv"):
+            raise ValueError(f"Unsupported output_format: {output_format}")
+        if max_continuations is None:
+            max_continuations = int(os.getenv("KIMI_JSON_MAX_CONTINUATIONS", 2))
+        if adaptive_max_tokens is None:
+            adaptive_max_tokens = os.getenv("KIMI_ADAPTIVE_MAX_TOKENS", "1").lower() in ("1", "true", "yes")
+        self.json_mode = json_mode
+        self.max_repairs = max_repairs
+        self.output_format = output_format
+        self.max_continuations = max_continuations
+        self.adaptive_max_tokens = adaptive_max_tokens
+        self.output_budget = output_budget or KimiOutputBudget()
     
     def set_model(self, model: str):
         """
-        设置使用的模型版本
+        设置使用的模型版本（只影响当前实例，不修改共享的 KimiClient）
         
         Args:
             model: 模型名称 (moonshot-v1-8k-vision-preview, moonshot-v1-32k-vision-preview 等)
         """
-        self.client.set_model(model)
+        self.model = model
     
     def extract_table_data(
         self,
@@ -45,7 +220,10 @@ class KimiTableToJSON:
         json_template: Union[str, Dict, list],
         custom_prompt: Optional[str] = None,
         temperature: float = 0.1,
-        max_tokens: int = 4000
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        on_row: Optional[Callable[[int, Any], None]] = None
     ) -> Dict[str, Any]:
         """
         根据 JSON 模板从图片表格中提取数据
@@ -58,59 +236,27 @@ class KimiTableToJSON:
                 - 列表: Python 列表对象
             custom_prompt: 自定义提示词，如果不提供则使用默认提示词
             temperature: 温度参数，控制输出随机性 (0-1)，建议使用低温度保证准确性
-            max_tokens: 最大生成 token 数
+            max_tokens: 最大生成 token 数，默认根据模板和图片中的行数估算（见 adaptive_max_tokens）
+            stream: 是否使用流式响应，顶层 JSON 闭合后立即停止读取
+            on_progress: 流式模式下的进度回调，参数为 (内容增量, 已接收的完整内容)
+            on_row: 每完成一行表格数据时的回调（可选），参数为 (行号, 行数据)；流式模式下在该行的内容到达时立即调用，
+                可以先处理前面的行。行数据已做本地修复，追问修正后的最终数据以返回的 json_data 为准
             
         Returns:
             包含提取的 JSON 数据和原始响应的字典
         """
-        # 将 JSON 模板转换为字符串
-        if isinstance(json_template, (dict, list)):
-            template_str = json.dumps(json_template, ensure_ascii=False, indent=2)
-        else:
-            template_str = json_template
-        
-        # 构建默认提示词
-        if custom_prompt is None:
-            custom_prompt = f"""请仔细分析这张图片中的表格内容，然后按照以下 JSON 数据模板提取表格数据。
-
-【JSON 数据模板】
-```json
-{template_str}
-```
-
-【提取要求】
-1. 严格按照 JSON 模板的结构提取数据
-2. 准确识别表格中的每一行数据
-3. 确保字段名与模板完全一致
-4. 数值类型的数据保持为字符串格式（与模板一致）
-5. 如果某个字段在图片中不存在，使用空字符串 ""
-
-【输出要求】
-请只返回提取后的 JSON 数据，不要包含任何其他说明文字。
-JSON 数据必须是有效的、可解析的格式。"""
-        
-        # 系统提示词
-        system_prompt = "你是一个专业的数据提取专家，擅长从图片表格中准确提取结构化数据。你必须严格按照给定的 JSON 模板格式返回数据。"
-        
-        # 使用 KimiClient 调用 API
-        result = self.client.chat(
-            prompt=custom_prompt,
+        result = self._extract(
+            json_template,
+            custom_prompt,
             image_paths=image_path,
-            system_prompt=system_prompt,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress,
+            on_row=on_row
         )
         
-        # 提取 JSON 数据
-        json_data = self._extract_json(result["content"])
-        
-        return {
-            "json_data": json_data,
-            "raw_content": result["content"],
-            "raw_response": result["raw_response"],
-            "image_path": image_path,
-            "usage": result["usage"]
-        }
+        return self._build_result(result, image_path=image_path)
     
     def extract_from_template_file(
         self,
@@ -118,7 +264,7 @@ JSON 数据必须是有效的、可解析的格式。"""
         template_file_path: str,
         custom_prompt: Optional[str] = None,
         temperature: float = 0.1,
-        max_tokens: int = 4000
+        max_tokens: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         从 JSON 模板文件读取模板，然后提取图片数据
@@ -128,7 +274,7 @@ JSON 数据必须是有效的、可解析的格式。"""
             template_file_path: JSON 模板文件路径
             custom_prompt: 自定义提示词
             temperature: 温度参数
-            max_tokens: 最大 token 数
+            max_tokens: 最大 token 数，默认自动估算
             
         Returns:
             包含提取的 JSON 数据和原始响应的字典
@@ -152,7 +298,10 @@ JSON 数据必须是有效的、可解析的格式。"""
         json_template: Union[str, Dict, list],
         custom_prompt: Optional[str] = None,
         temperature: float = 0.1,
-        max_tokens: int = 4000
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        on_row: Optional[Callable[[int, Any], None]] = None
     ) -> Dict[str, Any]:
         """
         根据 JSON 模板从 base64 编码的图片中提取数据
@@ -165,60 +314,593 @@ JSON 数据必须是有效的、可解析的格式。"""
                 - 列表: Python 列表对象
             custom_prompt: 自定义提示词，如果不提供则使用默认提示词
             temperature: 温度参数，控制输出随机性 (0-1)，建议使用低温度保证准确性
-            max_tokens: 最大生成 token 数
+            max_tokens: 最大生成 token 数，默认根据模板和图片中的行数估算（见 adaptive_max_tokens）
+            stream: 是否使用流式响应，顶层 JSON 闭合后立即停止读取
+            on_progress: 流式模式下的进度回调，参数为 (内容增量, 已接收的完整内容)
+            on_row: 每完成一行表格数据时的回调（可选），参数为 (行号, 行数据)；流式模式下在该行的内容到达时立即调用，
+                可以先处理前面的行。行数据已做本地修复，追问修正后的最终数据以返回的 json_data 为准
             
         Returns:
             包含提取的 JSON 数据和原始响应的字典
         """
-        # 将 JSON 模板转换为字符串
-        if isinstance(json_template, (dict, list)):
-            template_str = json.dumps(json_template, ensure_ascii=False, indent=2)
-        else:
-            template_str = json_template
+        # 直接使用 base64 图片调用，无需创建临时文件
+        result = self._extract(
+            json_template,
+            custom_prompt,
+            image_base64=image_base64,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress,
+            on_row=on_row
+        )
         
-        # 构建默认提示词
-        if custom_prompt is None:
-            custom_prompt = f"""请仔细分析这张图片中的表格内容，然后按照以下 JSON 数据模板提取表格数据。
-
-【JSON 数据模板】
-```json
-{template_str}
-```
-
-【提取要求】
-1. 严格按照 JSON 模板的结构提取数据
-2. 准确识别表格中的每一行数据
-3. 确保字段名与模板完全一致
-4. 数值类型的数据保持为字符串格式（与模板一致）
-5. 如果某个字段在图片中不存在，使用空字符串 ""
-
-【输出要求】
-请只返回提取后的 JSON 数据，不要包含任何其他说明文字。
-JSON 数据必须是有效的、可解析的格式。"""
+        return self._build_result(result, image_path="base64_image", image_source="base64")
+    
+    async def aextract_table_data(
+        self,
+        image_path: str,
+        json_template: Union[str, Dict, list],
+        custom_prompt: Optional[str] = None,
+        temperature: float = 0.1,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        on_row: Optional[Callable[[int, Any], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        extract_table_data 的异步版本，请求在 KimiClient 的异步线程池中执行
+        
+        Args:
+            与 extract_table_data 相同
+            
+        Returns:
+            与 extract_table_data 相同的结果字典
+        """
+        result = await self.client.arun(
+            self._extract,
+            json_template,
+            custom_prompt,
+            image_paths=image_path,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress,
+            on_row=on_row
+        )
+        
+        return self._build_result(result, image_path=image_path)
+    
+    async def aextract_table_data_from_base64(
+        self,
+        image_base64: str,
+        json_template: Union[str, Dict, list],
+        custom_prompt: Optional[str] = None,
+        temperature: float = 0.1,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        on_row: Optional[Callable[[int, Any], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        extract_table_data_from_base64 的异步版本，请求在 KimiClient 的异步线程池中执行
+        
+        Args:
+            与 extract_table_data_from_base64 相同
+            
+        Returns:
+            与 extract_table_data_from_base64 相同的结果字典
+        """
+        result = await self.client.arun(
+            self._extract,
+            json_template,
+            custom_prompt,
+            image_base64=image_base64,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=stream,
+            on_progress=on_progress,
+            on_row=on_row
+        )
+        
+        return self._build_result(result, image_path="base64_image", image_source="base64")
+    
+    def _request(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        image_paths: Optional[str] = None,
+        image_base64: Optional[str] = None,
+        temperature: float = 0.1,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        json_output: bool = False,
+        extra_messages: Optional[List[Dict[str, Any]]] = None,
+        compact_output: bool = False
+    ) -> Dict[str, Any]:
+        """
+        调用 KimiClient 获取模型回复（内部方法）
         
-        # 系统提示词
-        system_prompt = "你是一个专业的数据提取专家，擅长从图片表格中准确提取结构化数据。你必须严格按照给定的 JSON 模板格式返回数据。"
+        流式模式下一旦第一个顶层 JSON 值闭合就关闭连接，不再等待模型输出结尾的说明文字
+        （JSON 输出格式和紧凑输出下没有结尾文字，读取到响应结束）。
+        json_output 为 True 且开启了 json_mode 时请求 JSON 输出格式；接口以 400 拒绝、且错误信息指向
+        response_format / json_object 时关闭 json_mode 并重发，其他 400 错误（图片无效、上下文过长等）原样抛出。
         
-        # 直接使用 KimiClient 的 base64 图片调用方法
-        result = self.client.chat(
-            prompt=custom_prompt,
+        Returns:
+            与 KimiClient.chat 返回值结构相同的字典
+        """
+        kwargs = {"model": self.model}
+        if json_output and self.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        stop_at_json_end = not compact_output and "response_format" not in kwargs
+        
+        try:
+            return self._send_request(
+                prompt, system_prompt, image_paths, image_base64, temperature, max_tokens,
+                stream, on_progress, extra_messages, stop_at_json_end, kwargs
+            )
+        except requests.HTTPError as e:
+            if (
+                "response_format" not in kwargs
+                or e.response is None
+                or e.response.status_code != 400
+                or not self._rejects_response_format(e.response)
+            ):
+                raise
+            print(f"Kimi 接口不支持 JSON 输出格式，改为普通文本输出: {str(e)}")
+            self.json_mode = False
+            del kwargs["response_format"]
+            return self._send_request(
+                prompt, system_prompt, image_paths, image_base64, temperature, max_tokens,
+                stream, on_progress, extra_messages, True, kwargs
+            )
+    
+    @staticmethod
+    def _rejects_response_format(response: requests.Response) -> bool:
+        """
+        判断 400 响应是否因为接口不支持 JSON 输出格式（内部方法）
+        
+        Args:
+            response: 被拒绝的响应
+            
+        Returns:
+            错误信息中提到 response_format 或 json_object 时返回 True
+        """
+        try:
+            text = response.text.lower()
+        except Exception:
+            # 响应体已关闭或读取失败时无法判断，按其他错误处理
+            return False
+        return "response_format" in text or "json_object" in text
+    
+    def _send_request(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        image_paths: Optional[str],
+        image_base64: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        on_progress: Optional[Callable[[str, str], None]],
+        extra_messages: Optional[List[Dict[str, Any]]],
+        stop_at_json_end: bool,
+        kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """发送一次请求（内部方法），参数见 _request"""
+        if not stream:
+            return self.client.chat(
+                prompt=prompt,
+                image_paths=image_paths,
+                image_base64_list=image_base64,
+                system_prompt=system_prompt or self.SYSTEM_PROMPT,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                extra_messages=extra_messages,
+                **kwargs
+            )
+        
+        response = self.client.chat_stream(
+            prompt=prompt,
+            image_paths=image_paths,
             image_base64_list=image_base64,
-            system_prompt=system_prompt,
+            system_prompt=system_prompt or self.SYSTEM_PROMPT,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            **kwargs
+        )
+        # JSON 输出格式下 JSON 闭合即内容结尾，读完剩余的数据块以拿到 usage 并保留 keep-alive 连接
+        tracker = _JSONValueTracker() if stop_at_json_end else None
+        try:
+            for delta in response:
+                if on_progress:
+                    on_progress(delta, response.content)
+                if tracker is not None and tracker.feed(delta):
+                    break
+        finally:
+            response.close()
+        return response.to_result()
+    
+    def _extract(
+        self,
+        json_template: Union[str, Dict, list],
+        custom_prompt: Optional[str] = None,
+        image_paths: Optional[str] = None,
+        image_base64: Optional[str] = None,
+        temperature: float = 0.1,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        on_row: Optional[Callable[[int, Any], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        请求模型提取数据，按模板校验，并只针对不符合模板的行 / 字段追问（内部方法）
+        
+        能在本地修复的问题（格式错误、缺少字段、数字与字符串类型不符等）直接修复；
+        无法修复的行在同一对话中追问，只让模型重新输出这些行，不重新生成整张表。
+        紧凑输出模式下先把表头和数据行展开为模板的 JSON 结构，再做同样的校验。
+        提供 on_row 时用 KimiRowStreamParser 增量解析回复，每完成一行就回调；
+        回复被截断时保留已完整输出的行，并续写剩余的行（见 _continue_rows）。
+        
+        Returns:
+            KimiClient.chat 的返回值，另加 "json_data"、"validation_errors"、"repairs"、"output_format"、"truncated"、
+            "continuations"；"usage" 为包括续写和追问在内的 token 合计
+        """
+        template = parse_template(json_template)
+        compact = self.output_format == "tsv" and custom_prompt is None and compact_layout(template) is not None
+        if compact:
+            system_prompt, prompt = self._build_compact_prompt(template)
+            parse = lambda text: expand_compact_rows(text, template)
+        else:
+            system_prompt, prompt = self._build_prompt(json_template, custom_prompt)
+            parse = self._extract_json
+        
+        if max_tokens is None:
+            max_tokens = self._budget_max_tokens(template, image_paths, image_base64, compact)
+        
+        request = {
+            "system_prompt": system_prompt,
+            "image_paths": image_paths,
+            "image_base64": image_base64,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        parser = KimiRowStreamParser(template, compact) if on_row else None
+        progress = on_progress
+        if parser is not None and stream:
+            def progress(delta: str, content: str):
+                for index, row in parser.feed(delta):
+                    on_row(index, row)
+                if on_progress:
+                    on_progress(delta, content)
+        
+        # JSON 输出格式只能返回对象，数组模板仍使用普通文本输出
+        result = self._request(
+            prompt,
+            stream=stream,
+            on_progress=progress,
+            json_output=isinstance(template, dict) and not compact,
+            compact_output=compact,
+            **request
+        )
+        usage = dict(result["usage"] or {})
+        truncated = self._finish_reason(result) == "length"
+        if parser is not None:
+            rows = parser.finish(complete=not truncated) if stream else (
+                parser.feed(result["content"]) + parser.finish(complete=not truncated)
+            )
+            for index, row in rows:
+                on_row(index, row)
+        json_data = parse(self._drop_partial_line(result["content"]) if compact and truncated else result["content"])
+        if json_data is None and truncated:
+            # 回复被截断且无法整体解析：保留已完整输出的行
+            if parser is None:
+                parser = KimiRowStreamParser(template, compact)
+                parser.feed(result["content"])
+            if parser.rows:
+                json_data = parser.result()
+        
+        content = result["content"]
+        continuations = 0
+        if truncated and template is not None and self.max_continuations > 0:
+            truncated, continuations = self._continue_rows(
+                prompt, request, template, compact, json_data, content, usage, parser, on_row
+            )
+            if continuations:
+                # 追问时以拼接后的完整数据作为上下文，行号与 json_data 一致
+                content = json.dumps(json_data, ensure_ascii=False)
+        
+        failures: List[Dict[str, Any]] = []
+        repairs = 0
+        while template is not None:
+            if json_data is None:
+                failures = [{"path": "", "keys": [], "reason": "不是有效的 JSON"}]
+            else:
+                json_data, failures = validate_against_template(json_data, template)
+            if not failures or repairs >= self.max_repairs:
+                break
+            repairs += 1
+            
+            whole = any(not failure["keys"] for failure in failures)
+            if whole and compact:
+                followup = self.COMPACT_RETRY_PROMPT
+            elif whole:
+                reason = "不是有效的 JSON" if json_data is None else "整体结构与模板不一致"
+                followup = self.RETRY_PROMPT.format(reason=reason)
+            else:
+                issues = "\n".join(f"- {failure['path']}: {failure['reason']}" for failure in failures)
+                followup = self.REPAIR_PROMPT.format(issues=issues)
+                print(f"JSON 模板校验: {len(failures)} 处不符合模板，只重新询问这些位置")
+            
+            # 整体重新提取时沿用原来的输出格式，追问个别行时以 JSON 对象返回
+            retry_compact = whole and compact
+            reply = self._request(
+                prompt,
+                extra_messages=[
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": followup}
+                ],
+                json_output=isinstance(template, dict) and not retry_compact,
+                compact_output=retry_compact,
+                **request
+            )
+            self._add_usage(usage, reply)
+            
+            patch = parse(reply["content"]) if retry_compact else self._extract_json(reply["content"])
+            if whole:
+                json_data = patch
+                content = reply["content"]
+            elif isinstance(patch, dict):
+                for failure in failures:
+                    if failure["path"] in patch:
+                        set_at(json_data, failure["keys"], patch[failure["path"]])
+        
+        if failures:
+            print(f"警告: 提取结果仍有 {len(failures)} 处不符合 JSON 模板: {', '.join(f['path'] or '整体' for f in failures)}")
+        result["usage"] = usage
+        result["json_data"] = json_data
+        result["validation_errors"] = [{"path": failure["path"], "reason": failure["reason"]} for failure in failures]
+        result["repairs"] = repairs
+        result["output_format"] = "tsv" if compact else "json"
+        result["truncated"] = truncated
+        result["continuations"] = continuations
+        return result
+    
+    def _continue_rows(
+        self,
+        prompt: str,
+        request: Dict[str, Any],
+        template: Union[Dict, list],
+        compact: bool,
+        json_data: Any,
+        content: str,
+        usage: Dict[str, Any],
+        parser: Optional[KimiRowStreamParser],
+        on_row: Optional[Callable[[int, Any], None]]
+    ) -> Tuple[bool, int]:
+        """
+        回复被截断时续写剩余的行（内部方法）
+        
+        在同一对话中附上被截断的回复，告诉模型已完整输出的行数和最后一行，只请求之后剩余的行；
+        新的行追加到 json_data 的行数组中（与已有行重复的开头部分去掉）。续写的回复仍被截断时继续续写，
+        直到正常结束或达到 max_continuations。
+        
+        Args:
+            prompt: 用户提示词
+            request: 其余请求参数（系统提示词、图片、温度、max_tokens）
+            template: 模板
+            compact: 是否为紧凑输出
+            json_data: 已解析的数据，行数组会被就地扩充
+            content: 被截断的回复
+            usage: token 合计，会被就地累加
+            parser: 增量解析器（提供 on_row 时），用于继续行号并回调新的行
+            on_row: 每完成一行时的回调
+            
+        Returns:
+            (最终是否仍被截断, 续写次数)
+        """
+        rows_key = rows_key_of(template)
+        rows = self._rows_of(json_data, rows_key)
+        messages = [{"role": "assistant", "content": content}]
+        continuations = 0
+        truncated = True
+        while truncated and rows and continuations < self.max_continuations:
+            continuations += 1
+            if compact:
+                last = rows[-1] if isinstance(rows[-1], dict) else {}
+                last_row = "\t".join(str(last.get(column, "")) for column in compact_layout(template)["columns"])
+                followup = self.COMPACT_CONTINUE_PROMPT.format(count=len(rows), last_row=last_row)
+            else:
+                followup = self.CONTINUE_PROMPT.format(count=len(rows), last_row=json.dumps(rows[-1], ensure_ascii=False))
+            messages.append({"role": "user", "content": followup})
+            print(f"输出达到 max_tokens 被截断，已完整输出 {len(rows)} 行，请求续写剩余的行（第 {continuations} 次）")
+            
+            reply = self._request(
+                prompt,
+                extra_messages=messages,
+                json_output=isinstance(template, dict) and not compact,
+                compact_output=compact,
+                **request
+            )
+            self._add_usage(usage, reply)
+            truncated = self._finish_reason(reply) == "length"
+            text = reply["content"]
+            if compact:
+                patch = expand_compact_rows(self._drop_partial_line(text) if truncated else text, template)
+            else:
+                patch = self._extract_json(text)
+            
+            added = self._stitch_rows(rows, self._rows_of(patch, rows_key) or [])
+            if not added:
+                break
+            if parser is not None:
+                for index, row in parser.extend(added):
+                    on_row(index, row)
+            messages.append({"role": "assistant", "content": text})
+        return truncated, continuations
+    
+    @staticmethod
+    def _rows_of(data: Any, rows_key: Optional[str]) -> Optional[list]:
+        """获取数据中的行数组（顶层为数组时 rows_key 为 None），不存在时返回 None"""
+        rows = data if rows_key is None else (data.get(rows_key) if isinstance(data, dict) else None)
+        return rows if isinstance(rows, list) else None
+    
+    @staticmethod
+    def _stitch_rows(rows: list, new_rows: list) -> list:
+        """
+        把续写得到的行追加到 rows（就地修改），去掉与 rows 末尾重复的开头部分
+        
+        Returns:
+            实际追加的行
+        """
+        overlap = 0
+        for size in range(min(len(rows), len(new_rows)), 0, -1):
+            if rows[-size:] == new_rows[:size]:
+                overlap = size
+                break
+        added = new_rows[overlap:]
+        rows.extend(added)
+        return added
+    
+    @staticmethod
+    def _add_usage(usage: Dict[str, Any], reply: Dict[str, Any]):
+        """把一次请求的 token 用量累加到 usage"""
+        for key, value in (reply["usage"] or {}).items():
+            if isinstance(value, (int, float)):
+                usage[key] = usage.get(key, 0) + value
+    
+    def _budget_max_tokens(
+        self,
+        template: Union[Dict, list, None],
+        image_paths: Optional[str],
+        image_base64: Optional[str],
+        compact: bool
+    ) -> int:
+        """
+        未指定 max_tokens 时按模板和图片中的行数估算（内部方法）
+        
+        估算偏小时由截断续写补齐剩余的行，因此预算只需覆盖常见情况。
+        
+        Returns:
+            max_tokens
+        """
+        if not self.adaptive_max_tokens or template is None:
+            return DEFAULT_MAX_TOKENS
+        budget = self.output_budget.budget(template, image_path=image_paths, image_base64=image_base64, compact=compact)
+        print(
+            f"max_tokens 预算: {budget['max_tokens']}（{'检测到' if budget['rows_detected'] else '假定'} "
+            f"{budget['rows']} 行 x 每行约 {budget['row_tokens']} token）"
+        )
+        return budget["max_tokens"]
+    
+    @staticmethod
+    def _finish_reason(result: Dict[str, Any]) -> Optional[str]:
+        """获取回复的 finish_reason（"length" 表示输出达到 max_tokens 被截断）"""
+        choices = (result.get("raw_response") or {}).get("choices") or [{}]
+        return choices[0].get("finish_reason")
+    
+    @staticmethod
+    def _drop_partial_line(content: str) -> str:
+        """去掉被截断的紧凑输出中不完整的最后一行"""
+        return content if content.endswith("\n") else content.rpartition("\n")[0]
+    
+    def _build_compact_prompt(self, template: Union[Dict, list]) -> Tuple[str, str]:
+        """
+        构建紧凑输出的系统提示词和用户提示词（模板须满足 compact_layout）
+        
+        Args:
+            template: 模板
+            
+        Returns:
+            (系统提示词, 用户提示词)
+        """
+        layout = compact_layout(template)
+        rows = template if layout["rows_key"] is None else template[layout["rows_key"]]
+        columns = layout["columns"]
+        fields = ""
+        if layout["fields"]:
+            lines = "\n".join(f"@{key}\t{template[key]}" for key in layout["fields"])
+            fields = f"\n【表格外的字段】\n在表头之前，每个字段单独输出一行：@字段名、制表符、值，例如：\n{lines}\n"
+        system_prompt = self.COMPACT_PROMPT_TEMPLATE.format(
+            header="\t".join(columns),
+            example="\t".join(str(rows[0][column]) for column in columns),
+            fields=fields
         )
+        return system_prompt, self.COMPACT_USER_PROMPT
+    
+    def _build_prompt(
+        self,
+        json_template: Union[str, Dict, list],
+        custom_prompt: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """
+        构建提取数据的系统提示词和用户提示词
+        
+        模板和提取规则放在系统提示词中，作为所有请求共用的静态前缀；用户消息只包含图片和固定的短提示。
+        
+        Args:
+            json_template: JSON 数据模板（字符串、字典或列表）
+            custom_prompt: 自定义提示词，提供时直接作为用户提示词，系统提示词使用 SYSTEM_PROMPT
+            
+        Returns:
+            (系统提示词, 用户提示词)
+        """
+        if custom_prompt is not None:
+            return self.SYSTEM_PROMPT, custom_prompt
         
-        # 提取 JSON 数据
-        json_data = self._extract_json(result["content"])
+        # 字符串模板先解析再统一格式化，同一模板无论来自文件、字符串还是字典，前缀都逐字节相同
+        if isinstance(json_template, str):
+            try:
+                json_template = json.loads(json_template)
+            except json.JSONDecodeError:
+                pass
+        
+        # 将 JSON 模板转换为字符串
+        if isinstance(json_template, (dict, list)):
+            template_str = json.dumps(json_template, ensure_ascii=False, indent=2)
+        else:
+            template_str = json_template
+        
+        return self.DEFAULT_PROMPT_TEMPLATE.format(template_str=template_str), self.USER_PROMPT
+    
+    def _build_result(
+        self,
+        result: Dict[str, Any],
+        image_path: str,
+        image_source: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        根据 KimiClient 的响应构建提取结果
+        
+        Args:
+            result: _extract 的返回值
+            image_path: 图片路径（base64 输入时为 "base64_image"）
+            image_source: 图片来源标记（可选）
+            
+        Returns:
+            包含提取的 JSON 数据和原始响应的字典；validation_errors 为仍不符合模板的位置，
+            repairs 为追问的轮数，output_format 为实际使用的输出格式，truncated 表示输出达到 max_tokens 被截断
+            （续写后仍被截断），continuations 为续写的次数
+        """
+        # 提取 JSON 数据（_extract 已按模板校验和修复）
+        json_data = result["json_data"] if "json_data" in result else self._extract_json(result["content"])
         
-        return {
+        extracted = {
             "json_data": json_data,
             "raw_content": result["content"],
             "raw_response": result["raw_response"],
-            "image_path": "base64_image",
-            "image_source": "base64",
-            "usage": result["usage"]
+            "image_path": image_path,
+            "usage": result["usage"],
+            "validation_errors": result.get("validation_errors", []),
+            "repairs": result.get("repairs", 0),
+            "output_format": result.get("output_format", "json"),
+            "truncated": result.get("truncated", False),
+            "continuations": result.get("continuations", 0)
         }
+        if image_source:
+            extracted["image_source"] = image_source
+        return extracted
     
     def _extract_json(self, content: str) -> Union[Dict, list, None]:
         """
@@ -228,25 +910,26 @@ JSON 数据必须是有效的、可解析的格式。"""
             content: API 返回的文本内容
             
         Returns:
-            提取的 JSON 数据（字典或列表）
+            提取的 JSON 数据（字典或列表），无法解析时返回 None
         """
         # 尝试提取代码块中的 JSON
         json_str = None
         
+        # 流式提前结束时代码块可能没有结尾的 ```
         if "```json" in content:
             start = content.find("```json") + 7
             end = content.find("```", start)
-            json_str = content[start:end].strip()
+            json_str = content[start:end if end != -1 else None].strip()
         elif "```" in content:
             start = content.find("```") + 3
             end = content.find("```", start)
-            json_str = content[start:end].strip()
+            json_str = content[start:end if end != -1 else None].strip()
         else:
             json_str = content.strip()
         
-        # 尝试解析 JSON
+        # 尝试解析 JSON，多余的逗号、被截断的结尾等格式问题在本地修复
         try:
-            return json.loads(json_str)
+            return repair_json_text(json_str)
         except json.JSONDecodeError as e:
             print(f"警告: JSON 解析失败 - {e}")
             print(f"原始内容: {json_str[:200]}...")
@@ -260,73 +943,175 @@ JSON 数据必须是有效的、可解析的格式。"""
             json_data: JSON 数据
             output_path: 输出文件路径
         """
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(kimi_json.dumps_bytes(json_data, indent=2))
     
     def batch_extract(
         self,
         image_paths: list,
         json_template: Union[str, Dict, list],
         output_dir: str,
-        custom_prompt: Optional[str] = None
+        custom_prompt: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+        resume: bool = True
     ) -> list:
         """
         批量从多张表格图片中提取数据
         
+        多张图片并发提取（见 iter_batch_extract），返回的结果与 image_paths 的顺序一致。
+        每张图片的内容哈希、状态、输出路径和 token 用量记录在 output_dir 的进度清单中（见 KimiBatchManifest），
+        中断后重新运行时跳过已完成的图片，只重试失败和新增的图片。
+        
         Args:
             image_paths: 图片文件路径列表
             json_template: JSON 数据模板
             output_dir: 输出目录
             custom_prompt: 自定义提示词
+            max_workers: 同时提取的图片数，默认读取环境变量 KIMI_BATCH_WORKERS，
+                未设置时使用 KimiClient 的 max_concurrency；1 表示逐张提取
+            on_result: 每张图片完成时的回调（可选），按完成顺序在调用线程中执行，参数为该图片的结果
+            resume: 是否跳过进度清单中已完成、且图片内容和模板 / 提示词都未变化的图片，
+                为 False 时全部重新提取（清单仍会更新）
             
         Returns:
-            提取结果列表
+            提取结果列表，跳过的图片带有 "skipped": True，数据从已保存的输出文件读取
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(image_paths)
+        for item in self.iter_batch_extract(image_paths, json_template, output_dir, custom_prompt, max_workers, resume):
+            results[item["index"]] = item
+            if on_result is not None:
+                on_result(item)
+        return results
+    
+    def iter_batch_extract(
+        self,
+        image_paths: list,
+        json_template: Union[str, Dict, list],
+        output_dir: str,
+        custom_prompt: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        resume: bool = True
+    ) -> Iterator[Dict[str, Any]]:
         """
-        results = []
+        批量提取，按完成顺序逐个返回结果
+        
+        提取在最多 max_workers 个线程中并发执行；所有请求都经过 KimiClient，
+        因此仍受 RPM / TPM 限流（配额不足时排队）和 429 暂停的约束，并发数大于配额允许的速率时只会排队等待。
+        提前停止迭代时取消尚未开始的提取。
+        输出文件名为 <图片文件名>.json，不同目录中有同名图片时为 <图片文件名>_<序号>.json。
+        
+        Args:
+            与 batch_extract 相同
+            
+        Returns:
+            结果迭代器，每个结果包含 "index"（在 image_paths 中的位置）
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv("KIMI_BATCH_WORKERS", 0)) or self.client.max_concurrency
+        max_workers = max(1, min(max_workers, len(image_paths) or 1))
         
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
+        manifest = KimiBatchManifest(output_dir)
+        # 模板、提示词或输出格式变化后，已完成的图片也需要重新提取
+        params = KimiBatchManifest.fingerprint(json_template, custom_prompt, self.output_format, self.model)
+        
+        # 不同目录中的同名图片加上序号，避免并发写入同一个输出文件
+        base_names = [os.path.splitext(os.path.basename(image_path))[0] for image_path in image_paths]
+        name_counts = Counter(base_names)
+        output_paths = [
+            os.path.join(output_dir, f"{base_name}_{index}.json" if name_counts[base_name] > 1 else f"{base_name}.json")
+            for index, base_name in enumerate(base_names)
+        ]
         
-        for i, image_path in enumerate(image_paths):
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kimi-batch")
+        futures = []
+        try:
+            for index, image_path in enumerate(image_paths):
+                futures.append(executor.submit(
+                    self._batch_extract_one, index, image_path, json_template, output_paths[index], custom_prompt,
+                    manifest, params, resume
+                ))
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # shutdown 的 cancel_futures 参数需要 Python 3.9，逐个取消尚未开始的提取
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    def _batch_extract_one(
+        self,
+        index: int,
+        image_path: str,
+        json_template: Union[str, Dict, list],
+        output_path: str,
+        custom_prompt: Optional[str],
+        manifest: KimiBatchManifest,
+        params: str,
+        resume: bool
+    ) -> Dict[str, Any]:
+        """提取并保存一张图片，返回批量结果中的一项（不抛出异常），并把结果记录到进度清单"""
+        digest = KimiBatchManifest.file_hash(image_path)
+        entry = manifest.completed(image_path, digest, params) if resume else None
+        if entry is not None:
             try:
-                # 提取数据
-                result = self.extract_table_data(image_path, json_template, custom_prompt)
-                
-                # 生成输出文件名
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                output_path = os.path.join(output_dir, f"{base_name}.json")
-                
-                # 保存 JSON
-                if result["json_data"]:
-                    self.save_json(result["json_data"], output_path)
-                    
-                    results.append({
-                        "image_path": image_path,
-                        "output_path": output_path,
-                        "success": True,
-                        "data": result["json_data"]
-                    })
-                    
-                    print(f"✓ 已提取: {image_path} -> {output_path}")
-                else:
-                    results.append({
-                        "image_path": image_path,
-                        "output_path": None,
-                        "success": False,
-                        "error": "JSON 解析失败"
-                    })
-                    print(f"✗ 提取失败: {image_path} - JSON 解析失败")
-                
-            except Exception as e:
-                results.append({
+                with open(entry["output_path"], "rb") as f:
+                    data = kimi_json.loads(f.read())
+                print(f"- 已跳过（已完成）: {image_path} -> {entry['output_path']}")
+                return {
+                    "index": index,
                     "image_path": image_path,
-                    "output_path": None,
-                    "success": False,
-                    "error": str(e)
-                })
-                print(f"✗ 提取失败: {image_path}, 错误: {str(e)}")
+                    "output_path": entry["output_path"],
+                    "success": True,
+                    "data": data,
+                    "usage": entry.get("usage", {}),
+                    "skipped": True
+                }
+            except (OSError, ValueError):
+                # 输出文件损坏，重新提取
+                pass
         
-        return results
+        try:
+            # 提取数据
+            result = self.extract_table_data(image_path, json_template, custom_prompt)
+            
+            # 保存 JSON
+            usage = result.get("usage") or {}
+            if result["json_data"]:
+                self.save_json(result["json_data"], output_path)
+                manifest.record(image_path, digest, params, "done", output_path, usage)
+                print(f"✓ 已提取: {image_path} -> {output_path}")
+                return {
+                    "index": index,
+                    "image_path": image_path,
+                    "output_path": output_path,
+                    "success": True,
+                    "data": result["json_data"],
+                    "usage": usage
+                }
+            
+            manifest.record(image_path, digest, params, "failed", usage=usage, error="JSON 解析失败")
+            print(f"✗ 提取失败: {image_path} - JSON 解析失败")
+            return {
+                "index": index,
+                "image_path": image_path,
+                "output_path": None,
+                "success": False,
+                "error": "JSON 解析失败"
+            }
+        
+        except Exception as e:
+            manifest.record(image_path, digest, params, "failed", error=str(e))
+            print(f"✗ 提取失败: {image_path}, 错误: {str(e)}")
+            return {
+                "index": index,
+                "image_path": image_path,
+                "output_path": None,
+                "success": False,
+                "error": str(e)
+            }
 
 
 # 使用示例
@@ -0,0 +1,217 @@
+"""
+Kimi 请求的 token 预估与上下文档位选择
+在发送请求前估算文本、图片和最大生成 token 数，选择能容纳请求的最小上下文档位（8k / 32k / 128k）
+"""
+import io
+import os
+import re
+import sys
+import math
+import base64
+import weakref
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+from PIL import Image
+
+# 处理相对导入，支持直接运行和作为模块导入
+try:
+    from .kimi_payload import ImageSource
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.kimi_payload import ImageSource
+
+
+# moonshot-v1 系列的上下文档位（token 数），按从小到大排列
+CONTEXT_TIERS = [
+    ("8k", 8 * 1024),
+    ("32k", 32 * 1024),
+    ("128k", 128 * 1024)
+]
+
+# 无法读取图片尺寸时，每张图片按此 token 数预估
+DEFAULT_IMAGE_TOKENS = 1024
+
+# 读取 base64 图片尺寸时最多解码的字符数（只需要文件头）
+_HEADER_BASE64_CHARS = 256 * 1024
+
+_MODEL_PATTERN = re.compile(r"^moonshot-v1-(8k|32k|128k)(-vision-preview)?$")
+
+
+class KimiTokenEstimator:
+    """请求 token 预估与模型档位选择"""
+    
+    def __init__(
+        self,
+        chars_per_token: float = 3.0,
+        image_patch_size: Optional[int] = None,
+        message_overhead: int = 4,
+        safety_margin: float = 0.05
+    ):
+        """
+        初始化预估器
+        
+        Args:
+            chars_per_token: ASCII 文本每个 token 对应的字符数；中日韩等非 ASCII 字符按每字 1 个 token 保守估计
+            image_patch_size: 图片按 patch_size x patch_size 像素折算 1 个 token，
+                默认读取环境变量 KIMI_IMAGE_PATCH_SIZE 或 28
+            message_overhead: 每条消息的格式开销 token 数
+            safety_margin: 选择档位时预留的比例，预估值 * (1 + safety_margin) 不超过上下文长度才视为可容纳
+        """
+        if image_patch_size is None:
+            image_patch_size = int(os.getenv("KIMI_IMAGE_PATCH_SIZE", 28))
+        
+        self.chars_per_token = chars_per_token
+        self.image_patch_size = image_patch_size
+        self.message_overhead = message_overhead
+        self.safety_margin = safety_margin
+        # 同一个 ImageSource 只读取一次尺寸（限流预算和档位选择都会用到）
+        self._image_sizes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+    
+    def estimate_text(self, text: str) -> int:
+        """
+        预估文本的 token 数
+        
+        Args:
+            text: 文本内容
+            
+        Returns:
+            token 数
+        """
+        if not text:
+            return 0
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return (len(text) - ascii_chars) + math.ceil(ascii_chars / self.chars_per_token)
+    
+    def estimate_image(self, image: Any) -> int:
+        """
+        根据图片尺寸预估图片的 token 数
+        
+        Args:
+            image: ImageSource 或 data URL 字符串
+            
+        Returns:
+            token 数，无法读取尺寸时返回 DEFAULT_IMAGE_TOKENS
+        """
+        size = self.image_size(image)
+        if size is None:
+            return DEFAULT_IMAGE_TOKENS
+        width, height = size
+        return math.ceil(width / self.image_patch_size) * math.ceil(height / self.image_patch_size)
+    
+    def image_size(self, image: Any) -> Optional[Tuple[int, int]]:
+        """
+        读取图片尺寸（只解析文件头）
+        
+        Args:
+            image: ImageSource 或 data URL 字符串
+            
+        Returns:
+            (宽, 高)，无法识别时返回 None
+        """
+        if isinstance(image, str):
+            if not image.startswith("data:image"):
+                # 远程 URL 等无法在本地读取
+                return None
+            image = ImageSource.from_base64(image)
+        if not isinstance(image, ImageSource):
+            return None
+        with self._lock:
+            if image in self._image_sizes:
+                return self._image_sizes[image]
+        
+        size = None
+        try:
+            if image.path is not None:
+                with Image.open(image.path) as img:
+                    size = img.size
+            elif image.data is not None:
+                with Image.open(io.BytesIO(image.data)) as img:
+                    size = img.size
+            else:
+                header = image.base64_data[:_HEADER_BASE64_CHARS]
+                header = header[:len(header) // 4 * 4]
+                with Image.open(io.BytesIO(base64.b64decode(header))) as img:
+                    size = img.size
+        except Exception:
+            size = None
+        with self._lock:
+            self._image_sizes[image] = size
+        return size
+    
+    def estimate(self, messages: List[Dict[str, Any]], max_tokens: int = 0) -> Dict[str, Any]:
+        """
+        预估一次请求的 token 数
+        
+        Args:
+            messages: 消息列表
+            max_tokens: 最大生成 token 数
+            
+        Returns:
+            {
+                "text_tokens": int,  # 文本（含消息格式开销）
+                "image_tokens": int,  # 图片
+                "image_count": int,  # 图片数量
+                "max_tokens": int,  # 最大生成数
+                "total_tokens": int  # 合计
+            }
+        """
+        text_tokens = 0
+        image_tokens = 0
+        image_count = 0
+        for message in messages:
+            text_tokens += self.message_overhead
+            content = message.get("content")
+            if isinstance(content, str):
+                text_tokens += self.estimate_text(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "text":
+                    text_tokens += self.estimate_text(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    image_count += 1
+                    image_tokens += self.estimate_image(part.get("image_url", {}).get("url"))
+        return {
+            "text_tokens": text_tokens,
+            "image_tokens": image_tokens,
+            "image_count": image_count,
+            "max_tokens": max_tokens,
+            "total_tokens": text_tokens + image_tokens + max_tokens
+        }
+    
+    def select_model(self, model: str, estimate: Dict[str, Any], auto_tier: bool = True) -> str:
+        """
+        为请求选择模型
+        
+        moonshot-v1-{8k,32k,128k}[-vision-preview] 系列：有图片时使用 vision 版本；
+        auto_tier 为 True 时选择能容纳预估 token 数的最小档位，为 False 时保持 model 的档位。
+        其他模型没有图片或名称中含 vision 时原样返回；有图片时按名称中的 128k / 32k 切换到对应档位的
+        vision 模型，否则使用 8k 的 vision 模型。
+        
+        Args:
+            model: 基础模型名称
+            estimate: estimate() 的返回值
+            auto_tier: 是否自动选择上下文档位
+            
+        Returns:
+            本次请求使用的模型名称
+        """
+        match = _MODEL_PATTERN.match(model)
+        if not match:
+            if estimate["image_count"] == 0 or "vision" in model:
+                return model
+            # 文本模型无法处理图片，切换到视觉模型
+            tier = "128k" if "128k" in model else "32k" if "32k" in model else "8k"
+            return f"moonshot-v1-{tier}-vision-preview"
+        
+        tier = match.group(1)
+        vision = bool(match.group(2)) or estimate["image_count"] > 0
+        if auto_tier:
+            needed = estimate["total_tokens"] * (1 + self.safety_margin)
+            fitting = [name for name, context in CONTEXT_TIERS if context >= needed]
+            # 超过最大档位时仍使用最大档位，由服务端返回准确的错误
+            tier = fitting[0] if fitting else CONTEXT_TIERS[-1][0]
+        
+        return f"moonshot-v1-{tier}" + ("-vision-preview" if vision else "")
@@ -0,0 +1,159 @@
+"""
+Kimi API 的 HTTP 传输层
+KimiClient 通过传输对象发送请求，默认使用 requests；可替换为自定义实现（如测试桩、其他 HTTP 库）
+"""
+import time
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# 当前线程中新建连接（TCP + TLS 握手）累计的耗时，由 TimedHTTPAdapter 的连接写入
+_connect_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.monotonic() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.monotonic() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """记录新建连接耗时的 HTTPAdapter（连接池行为与 HTTPAdapter 相同）"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+
+class KimiTransport:
+    """
+    传输层接口
+    
+    post() 需要返回与 requests.Response 兼容的对象（status_code、headers、json()、iter_lines()、
+    raise_for_status()、close()），超时和连接失败需分别抛出 requests.Timeout / requests.ConnectionError，
+    以便 KimiClient 按请求策略重试。
+    
+    响应对象可以带有 kimi_timing 字典（"connect": 新建连接耗时，复用连接时为 0；"ttfb": 首字节耗时），
+    KimiClient 会把它计入调用指标；没有时只记录客户端测得的耗时。
+    """
+    
+    def post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        data: Any,
+        stream: bool = False,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        """
+        发送 POST 请求
+        
+        Args:
+            url: 请求地址
+            headers: 请求头
+            data: 请求体（字节串或可迭代的字节块，如 StreamingJSONPayload）
+            stream: 是否以流式方式读取响应体
+            timeout: (连接超时, 读取超时)
+            
+        Returns:
+            响应对象
+        """
+        raise NotImplementedError
+    
+    def upload(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        files: Dict[str, Any],
+        data: Optional[Dict[str, str]] = None,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        """
+        以 multipart/form-data 上传文件
+        
+        Args:
+            url: 请求地址
+            headers: 请求头（不含 Content-Type，由传输层生成）
+            files: 文件字段，格式同 requests 的 files 参数
+            data: 其他表单字段
+            timeout: (连接超时, 读取超时)
+            
+        Returns:
+            响应对象
+        """
+        raise NotImplementedError
+    
+    def close(self):
+        """释放传输层持有的资源"""
+        pass
+
+
+class RequestsTransport(KimiTransport):
+    """基于 requests 的默认传输层"""
+    
+    def __init__(self, session: Optional[requests.Session] = None):
+        """
+        Args:
+            session: 使用的会话（可选），不提供时每次请求新建连接；
+                挂载 TimedHTTPAdapter 的会话（如 get_shared_session）可以记录连接耗时
+        """
+        self.session = session
+    
+    def post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        data: Any,
+        stream: bool = False,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        if self.session is None:
+            return requests.post(url, headers=headers, data=data, stream=stream, timeout=timeout)
+        
+        _connect_timing.seconds = 0.0
+        response = self.session.post(url, headers=headers, data=data, stream=stream, timeout=timeout)
+        timing = {"ttfb": response.elapsed.total_seconds()}
+        if isinstance(self.session.get_adapter(url), TimedHTTPAdapter):
+            timing["connect"] = _connect_timing.seconds
+        response.kimi_timing = timing
+        return response
+    
+    def upload(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        files: Dict[str, Any],
+        data: Optional[Dict[str, str]] = None,
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> requests.Response:
+        if self.session is not None:
+            return self.session.post(url, headers=headers, files=files, data=data, timeout=timeout)
+        return requests.post(url, headers=headers, files=files, data=data, timeout=timeout)